@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+"""
+Load-tests the publishing path with a fleet of simulated SenseHats against a local broker stand-in.
+
+Every simulated device is a `SenseHatService` of publish.py on the simulated
+backend, with its own paho client, `ConnectionSupervisor` and
+`AsyncPublisher`; each tick runs the service's own `collect()` and
+`publish_metrics()`, which publish the combined state document. Reports the
+throughput, the end-to-end latency from sample time to broker receipt, the
+publisher's acknowledgement latency and the messages lost.
+
+Usage: python3 bench/bench_fleet.py [--publishers N] [--rate HZ] [--duration S] [--qos Q]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from mqtt_standin import BrokerStandIn  # noqa: E402
+from publish import SenseHatService  # noqa: E402
+from settings import Settings, compile_settings  # noqa: E402
+
+
+def device_config(index: int, port: int, qos: int, max_inflight: int) -> Dict:
+    """Return the configuration of one simulated device, with its own topics, client id and seed."""
+    device = f"bench/sensehat{index}"
+    return {
+        "id": device,
+        "client_id": f"bench-sensehat{index}",
+        "seconds": 1,
+        "broker": {"host": "127.0.0.1", "port": port},
+        "publish": {"qos": qos, "max_inflight": max_inflight},
+        "topics": {
+            "device": device,
+            "status": "/status",
+            "config": "/config",
+            "state": "/state",
+            "availability": "/availability",
+            "humidity": device + "/humidity",
+            "pressure": device + "/pressure",
+            "temperature": device + "/temperature",
+        },
+        "backend": {"type": "simulated", "seed": index},
+        "combined_state": True,
+    }
+
+
+class SimulatedSenseHat(SenseHatService):
+    """One device of the fleet, running publish.py's cycle on its own thread."""
+
+    def __init__(self, cfg: Settings):
+        super().__init__(cfg)
+        self.supervisor = self.build_supervisor()
+        self.sent = 0
+        self.overruns = 0
+        self.latencies: List[float] = []
+        self._thread: threading.Thread | None = None
+
+    def _done(self, future: Future):
+        if future.exception() is None:
+            self.latencies.append(future.result())
+
+    def publish(self, topic: str, msg, retain: bool = False, qos: int | None = None, sample_time: float | None = None):
+        # Counts what the real publish path sends, and its acknowledgement latency
+        future = super().publish(topic, msg, retain=retain, qos=qos, sample_time=sample_time)
+        self.sent += 1
+        if future is not None:
+            future.add_done_callback(self._done)
+        return future
+
+    def _loop(self, rate_hz: float, until: float):
+        period = 1.0 / rate_hz
+        next_tick = time.monotonic()
+        while next_tick < until:
+            collected = self.collect(None)
+            if collected is not None:
+                self.publish_metrics(*collected, None)
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                self.overruns += 1
+                next_tick = time.monotonic()
+            else:
+                time.sleep(delay)
+
+    def start(self, rate_hz: float, until: float):
+        self._thread = threading.Thread(target=self._loop, args=(rate_hz, until), daemon=True)
+        self._thread.start()
+
+    def join(self):
+        self._thread.join()
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Return the p50 and p99 of latencies in seconds, in milliseconds."""
+    if not values:
+        return {}
+    p50, p99 = np.percentile(np.asarray(values) * 1000, (50, 99))
+    return {"p50": round(float(p50), 2), "p99": round(float(p99), 2)}
+
+
+def run(publishers: int, rate_hz: float, duration: float, qos: int, max_inflight: int) -> Dict:
+    """Run one load test and return its results."""
+    arrivals: List[tuple] = []
+    broker = BrokerStandIn(
+        on_message=lambda client_id, topic, payload, received: arrivals.append((topic, payload, received))
+    )
+    port = broker.start()
+    fleet = [
+        SimulatedSenseHat(compile_settings(device_config(index, port, qos, max_inflight)))
+        for index in range(publishers)
+    ]
+    state_topics = {member.cfg.combined_state_topic for member in fleet}
+    for member in fleet:
+        member.supervisor.start()
+    deadline = time.monotonic() + 10
+    while not all(member.mqtt_client.is_connected() for member in fleet):
+        if time.monotonic() > deadline:
+            raise RuntimeError("The fleet did not connect to the broker stand-in")
+        time.sleep(0.05)
+
+    started = time.monotonic()
+    for member in fleet:
+        member.start(rate_hz, started + duration)
+    for member in fleet:
+        member.join()
+    # Let the last messages reach the broker and be acknowledged
+    deadline = time.monotonic() + 5
+    while any(member.publisher.stats()["inflight"] for member in fleet) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+    time.sleep(0.2)
+    for member in fleet:
+        member.supervisor.stop()
+        member.mqtt_client.disconnect()
+    broker.stop()
+
+    sent = sum(member.sent for member in fleet)
+    stats = broker.stats()
+    # Availability and discovery messages are not counted. The state document carries the
+    # wall-clock time of its reading, so a resent message has the same topic and payload.
+    states = {}
+    for topic, payload, received in arrivals:
+        if topic in state_topics:
+            states.setdefault((topic, payload), received)
+    unique = len(states)
+    end_to_end = [
+        received - datetime.datetime.fromisoformat(json.loads(payload)["timestamp"]).timestamp()
+        for (topic, payload), received in states.items()
+    ]
+    return {
+        "publishers": publishers,
+        "rate_hz": rate_hz,
+        "qos": qos,
+        "sent": sent,
+        "received": unique,
+        "lost": sent - unique,
+        "loss_pct": round(100.0 * (sent - unique) / sent, 3) if sent else 0.0,
+        "throughput": round(unique / elapsed, 1),
+        "end_to_end_ms": percentiles(end_to_end),
+        "ack_ms": percentiles([latency for member in fleet for latency in member.latencies]),
+        "overruns": sum(member.overruns for member in fleet),
+        "broker": stats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--publishers", type=int, default=10, help="simulated devices")
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second per device")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    parser.add_argument("--max-inflight", type=int, default=20)
+    args = parser.parse_args()
+    results = run(args.publishers, args.rate, args.duration, args.qos, args.max_inflight)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""
+Compares the JSON and binary payloads of the IMU and high-rate statistics streams.
+
+Reports the bytes per sample and the encode and decode time of each. Run it
+on the Pi itself for Pi-class numbers. "stats binary" is what is published:
+it refers to its column names by schema id. "stats named" embeds the names,
+and the "names" column shows the bytes they take in each payload.
+
+Usage: python3 bench/bench_payloads.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from binencoder import StatsEncoder, TableEncoder  # noqa: E402
+from binformat import decode, decode_stats  # noqa: E402
+from highrate import RingBuffer  # noqa: E402
+from imu import IMU_CHANNELS, encode_block  # noqa: E402
+from serialization import dumps  # noqa: E402
+
+RATE_HZ = 119.0
+BLOCK_SIZE = 50
+CHANNELS = ("temp_room", "temp_from_pressure", "temp_from_humidity", "temp_cpu", "pressure", "humidity")
+
+
+def imu_block() -> np.ndarray:
+    rng = np.random.default_rng(1)
+    block = rng.normal(0.0, 1.0, (BLOCK_SIZE, len(IMU_CHANNELS)))
+    block[:, 0] = time.time() + np.arange(BLOCK_SIZE) / RATE_HZ
+    return block
+
+
+def stats() -> dict:
+    rng = np.random.default_rng(1)
+    buffer = RingBuffer(CHANNELS, 100)
+    for _ in range(100):
+        buffer.append(rng.normal(20.0, 1.0, len(CHANNELS)), time.time())
+    return buffer.aggregate()
+
+
+def cases():
+    block = imu_block()
+    imu_encoder = TableEncoder(IMU_CHANNELS)
+    cycle = stats()
+    stats_encoder = StatsEncoder(tuple(cycle))
+    named_encoder = StatsEncoder(tuple(cycle), schema=False)
+    # What a subscriber keeps from the schema topic
+    schemas = {stats_encoder.table.schema_id: stats_encoder.table.columns}
+    now = time.time()
+    # (name, samples per message, bytes of column names, encode, decode)
+    return [
+        ("imu json", BLOCK_SIZE, 0, lambda: dumps(encode_block(block, RATE_HZ)), json.loads),
+        ("imu binary", BLOCK_SIZE, len(imu_encoder.names), lambda: imu_encoder.encode(block, RATE_HZ), decode),
+        ("stats json", 1, 0, lambda: dumps(cycle), json.loads),
+        (
+            "stats binary", 1, len(stats_encoder.table.schema_id),
+            lambda: stats_encoder.encode(cycle, RATE_HZ, now),
+            lambda payload: decode_stats(payload, schemas),
+        ),
+        (
+            "stats named", 1, len(named_encoder.table.names),
+            lambda: named_encoder.encode(cycle, RATE_HZ, now), decode_stats,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"{'payload':<13} {'bytes':>6} {'names':>6} {'B/sample':>9} {'encode us':>10} {'decode us':>10}")
+    for name, samples, names, encoder, decoder in cases():
+        payload = encoder()
+        encode = min(timeit.repeat(encoder, number=iterations, repeat=3)) / iterations
+        decode_time = min(timeit.repeat(lambda: decoder(payload), number=iterations, repeat=3)) / iterations
+        print(
+            f"{name:<13} {len(payload):6d} {names:6d} {len(payload) / samples:9.1f} "
+            f"{encode * 1e6:10.2f} {decode_time * 1e6:10.2f}"
+        )
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+Compares the state payload encoders.
+
+`template` is what Reading.to_json() uses: a dictionary per message encoded
+by `dumps()`. `precompiled` formats only the values into literal key
+fragments, without a dictionary; it is kept to show that it is slower.
+
+Usage: python3 bench/bench_serialization.py [iterations]
+"""
+import datetime
+import json
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from serialization import STATE_TEMPLATE, dumps  # noqa: E402
+
+# '{"avg":%s,"room":%s,...}', the keys encoded once
+FRAGMENTS = "{" + ",".join(json.dumps(key) + ":%s" for key in STATE_TEMPLATE.keys) + "}"
+
+VALUES = {
+    "avg": 21.3,
+    "room": 27.4,
+    "cpu": 48.3,
+    "pressure": 1013.25,
+    "humidity": 40.1,
+    "temperature": 27.4,
+}
+NOW = datetime.datetime.now()
+
+
+def concatenation() -> str:
+    # The string concatenation previously done in calculate_metrics()
+    return (
+        '{ "avg": '
+        + str(VALUES["avg"])
+        + ', "room": '
+        + str(VALUES["room"])
+        + ', "cpu": '
+        + str(VALUES["cpu"])
+        + ', "pressure": '
+        + str(VALUES["pressure"])
+        + ', "humidity": '
+        + str(VALUES["humidity"])
+        + ', "temperature": '
+        + str(VALUES["temperature"])
+        + ', timestamp: "'
+        + str(NOW)
+        + '" }'
+    )
+
+
+def stdlib_json() -> bytes:
+    return json.dumps(dict(VALUES, timestamp=str(NOW))).encode("utf-8")
+
+
+def fast_dumps() -> bytes:
+    return dumps(dict(VALUES, timestamp=str(NOW)))
+
+
+def template() -> bytes:
+    return STATE_TEMPLATE.render(
+        VALUES["avg"],
+        VALUES["room"],
+        VALUES["cpu"],
+        VALUES["pressure"],
+        VALUES["humidity"],
+        VALUES["temperature"],
+        str(NOW),
+    )
+
+
+def _value(value) -> str:
+    if value.__class__ is float:
+        return repr(value) if math.isfinite(value) else "null"
+    return json.dumps(value, ensure_ascii=False)
+
+
+def precompiled() -> bytes:
+    values = (
+        VALUES["avg"],
+        VALUES["room"],
+        VALUES["cpu"],
+        VALUES["pressure"],
+        VALUES["humidity"],
+        VALUES["temperature"],
+        str(NOW),
+    )
+    return (FRAGMENTS % tuple(map(_value, values))).encode("utf-8")
+
+
+def valid(encoder) -> bool:
+    try:
+        json.loads(encoder())
+    except ValueError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"{'encoder':<14} {'us/op':>8} {'bytes':>6} valid")
+    for encoder in (concatenation, stdlib_json, fast_dumps, template, precompiled):
+        seconds = min(timeit.repeat(encoder, number=iterations, repeat=3))
+        print(
+            f"{encoder.__name__:<14} {seconds / iterations * 1e6:8.2f} "
+            f"{len(encoder()):6d} {valid(encoder)}"
+        )
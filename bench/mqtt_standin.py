@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+"""
+A minimal in-process MQTT 3.1.1 broker stand-in for load tests.
+
+It accepts any client, acknowledges CONNECT, PUBLISH (QoS 0, 1 and 2),
+SUBSCRIBE and PINGREQ, and counts what it receives per client. It does not
+route messages to subscribers: it only stands in for the broker a publisher
+talks to.
+
+Usage: python3 bench/mqtt_standin.py [port]
+"""
+import asyncio
+import collections
+import sys
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+    """Read one packet: (type, flags, body). Raises IncompleteReadError at EOF."""
+    first = (await reader.readexactly(1))[0]
+    length = 0
+    multiplier = 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = await reader.readexactly(length) if length else b""
+    return first >> 4, first & 0x0F, body
+
+
+def _string(data: bytes, offset: int) -> Tuple[bytes, int]:
+    length = int.from_bytes(data[offset : offset + 2], "big")
+    return data[offset + 2 : offset + 2 + length], offset + 2 + length
+
+
+class BrokerStandIn:
+    """
+    Serves MQTT on 127.0.0.1 from an event loop on a background thread.
+
+    `received` counts the PUBLISH packets of each client id; `on_message`,
+    when set, is called on the broker thread with (client id, topic,
+    payload, receive time from `time.time()`).
+    """
+
+    def __init__(self, port: int = 0, on_message: Callable[[str, str, bytes, float], None] | None = None):
+        """
+        Parameters
+        ----------
+        port
+            The port to listen on, 0 for any free port.
+        on_message
+            Called for every received message.
+        """
+        self.port = port
+        self.on_message = on_message
+        self.received: Dict[str, int] = collections.Counter()
+        self.bytes = 0
+        self.duplicates = 0
+        self.connections = 0
+        self.by_qos: Dict[int, int] = collections.Counter()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+
+    def start(self) -> int:
+        """Start serving and return the port."""
+        self._thread = threading.Thread(target=self._run, name="broker", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.port
+
+    def stop(self):
+        """Close every connection and stop the broker thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def stats(self) -> Dict:
+        """Return the message counts."""
+        return {
+            "connections": self.connections,
+            "messages": sum(self.received.values()),
+            "bytes": self.bytes,
+            "duplicates": self.duplicates,
+            "by_qos": dict(self.by_qos),
+        }
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._serve, "127.0.0.1", self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client_id = ""
+        # QoS 2 packet ids received and not yet released
+        unreleased: set = set()
+        try:
+            while True:
+                kind, flags, body = await read_packet(reader)
+                if kind == CONNECT:
+                    _, offset = _string(body, 0)
+                    # Level, flags and keep alive precede the payload
+                    client_id = _string(body, offset + 4)[0].decode("utf-8", "replace")
+                    self.connections += 1
+                    writer.write(bytes((CONNACK << 4, 2, 0, 0)))
+                elif kind == PUBLISH:
+                    self._publish(client_id, flags, body, writer, unreleased)
+                elif kind == PUBREL:
+                    unreleased.discard(body[:2])
+                    writer.write(bytes((PUBCOMP << 4, 2)) + body[:2])
+                elif kind == SUBSCRIBE:
+                    granted = self._count_filters(body[2:])
+                    writer.write(bytes((SUBACK << 4, 2 + granted)) + body[:2] + bytes(granted))
+                elif kind == UNSUBSCRIBE:
+                    writer.write(bytes((UNSUBACK << 4, 2)) + body[:2])
+                elif kind == PINGREQ:
+                    writer.write(bytes((PINGRESP << 4, 0)))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Disconnected, or the broker is stopping
+            pass
+        finally:
+            writer.close()
+
+    def _publish(self, client_id: str, flags: int, body: bytes, writer: asyncio.StreamWriter, unreleased: set):
+        qos = (flags >> 1) & 3
+        topic, offset = _string(body, 0)
+        packet_id = b""
+        if qos:
+            packet_id = body[offset : offset + 2]
+            offset += 2
+        if qos == 2:
+            writer.write(bytes((PUBREC << 4, 2)) + packet_id)
+            if packet_id in unreleased:
+                self.duplicates += 1
+                return
+            unreleased.add(packet_id)
+        elif qos == 1:
+            writer.write(bytes((PUBACK << 4, 2)) + packet_id)
+            if flags & 0x08:
+                # DUP: the client resent a message we may already have counted
+                self.duplicates += 1
+        payload = body[offset:]
+        self.received[client_id] += 1
+        self.by_qos[qos] += 1
+        self.bytes += len(payload)
+        if self.on_message is not None:
+            self.on_message(client_id, topic.decode("utf-8", "replace"), payload, time.time())
+
+    @staticmethod
+    def _count_filters(data: bytes) -> int:
+        count = 0
+        offset = 0
+        while offset < len(data):
+            _, offset = _string(data, offset)
+            offset += 1
+            count += 1
+        return count
+
+
+if __name__ == "__main__":
+    broker = BrokerStandIn(int(sys.argv[1]) if len(sys.argv) > 1 else 1883)
+    print(f"Listening on 127.0.0.1:{broker.start()}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(5)
+            print(broker.stats())
+    except KeyboardInterrupt:
+        broker.stop()
@@ -13,11 +13,14 @@ import os
 import time
 import datetime
 from sense_hat import SenseHat, ACTION_PRESSED, ACTION_HELD, ACTION_RELEASED
+from src import psychrometrics
+from src.thermal import ThermalReader
 
 sense = SenseHat()
 #sense.set_rotation(180)
 sense.set_imu_config(False, False, False)
 sense.low_light = True
+thermal = ThermalReader()
 
 s = (0.070) 	# text scroll speed
 code = (0)  # which section of code to run
@@ -71,9 +74,7 @@ sense.stick.direction_middle = pushed_middle
 
 
 def get_cpu_temp():
-    res = os.popen("vcgencmd measure_temp").readline()
-    t = float(res.replace("temp=", "").replace("'C\n", ""))
-    return (t)
+    return thermal.read()
 
 # use moving average to smooth readings
 
@@ -115,6 +116,9 @@ while True:
         tf = round(tf)
         tf = int(tf)  # Fahrenheight
 
+    # Heat index, dew point, wet-bulb, delta-T and vapor pressure in one pass
+        derived = psychrometrics.compute(t_corr, h, p)
+
     # Temperature display
         if t_corr <= 5:
             tc = [0, 0, 0]  # white
@@ -129,23 +133,14 @@ while True:
         msg = "temp %sc (%sf) -" % (t_corr, tf)
         sense.show_message(msg, scroll_speed=s, text_colour=tc)
 
-    # Calculate the Heat Index
-        T2 = pow(tf, 2)
-        H2 = pow(h, 2)
-        C1 = [-42.379, 2.04901523, 10.14333127, -0.22475541, -
-              6.83783e-03, -5.481717e-02, 1.22874e-03, 8.5282e-04, -1.99e-06]
-        heatindex1 = C1[0] + (C1[1] * tf) + (C1[2] * h) + (C1[3] * tf * h) + (C1[4] * T2) + (
-            C1[5] * H2) + (C1[6] * T2 * h) + (C1[7] * tf * H2) + (C1[8] * T2 * H2)
-        hic1 = ((heatindex1 - 32) * 5/9)
-        hic1 = round(hic1)
+    # Heat Index
+        hic1 = round(float(derived["heat_index"]))
         hic1 = int(hic1)
         msg = "feels like %sc -" % (hic1)
         sense.show_message(msg, scroll_speed=s, text_colour=tc)
 
-    # Calculate the dew point
-        d = t_corr-(14.55+0.114*t_corr)*(1-(0.01*h))-((2.5+0.007*t_corr)
-                                                      * (1-(0.01*h)))**3-(15.9+0.117*t_corr)*(1-(0.01*h))**14
-        d = round(d)
+    # Dew point
+        d = round(float(derived["dew_point"]))
         d = int(d)
 
     # Calculate the difference between dew point & current temp
@@ -232,26 +227,14 @@ while True:
             msg = "baro very high %smb (dry) -" % (p)
             sense.show_message(msg, scroll_speed=s, text_colour=pc)
 
-    # Wet Bulb Temperature
-        Tdc = ((t_corr-(14.55+0.114*t_corr)*(1-(0.01*h))-((2.5+0.007*t_corr)
-               * (1-(0.01*h)))**3-(15.9+0.117*t_corr)*(1-(0.01*h))**14))
-
-        E = (6.11*10**(7.5*Tdc/(237.7+Tdc)))
-
-        WBc = (((0.00066*p)*t_corr)+((4098*E)/((Tdc+237.7)**2)*Tdc)) / \
-            ((0.00066*p)+(4098*E)/((Tdc+237.7)**2))
-
-    # Delta-T - If the Delta T is between 2C and 8C, pesticides are more effective
-        Dt = t_corr - WBc
-        Dt = round(Dt)
+    # Delta-T (temperature minus wet bulb) - If the Delta T is between 2C and 8C, pesticides are more effective
+        Dt = round(float(derived["delta_t"]))
         Dt = int(Dt)
         msg = "delta-t %sc" % (Dt)
         sense.show_message(msg, scroll_speed=s, text_colour=[0, 255, 0])
 
     # Vapor Pressure(Mb)
-        Vp = (6.11*10**(7.5*((t_corr-(14.55+0.114*t_corr)*(1-(0.01*h))-((2.5+0.007*t_corr)*(1-(0.01*h)))**3-(15.9+0.117*t_corr)*(1-(0.01*h))**14)
-                             )/(237.7+((t_corr-(14.55+0.114*t_corr)*(1-(0.01*h))-((2.5+0.007*t_corr)*(1-(0.01*h)))**3-(15.9+0.117*t_corr)*(1-(0.01*h))**14)))))
-        Vp = round(Vp)
+        Vp = round(float(derived["vapor_pressure"]))
         Vp = int(Vp)
         msg = "vapor pressure: %sMb -" % (Vp)
 # sense.show_message(msg, scroll_speed=s, text_colour=[0, 255, 0])
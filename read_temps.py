@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 from sense_hat import SenseHat
+from src.thermal import ThermalReader
 
 # import paho.mqtt.client as mqtt
 import os, sys, json, time
@@ -21,15 +22,7 @@ if __name__ == "__main__":
             1,
         )
         temp_room_str = str(temp_room)
-        temp_cpu = round(
-            float(
-                os.popen("vcgencmd measure_temp")
-                .readline()
-                .replace("temp=", "")
-                .replace("'C\n", "")
-            ),
-            1,
-        )
+        temp_cpu = round(ThermalReader().read(), 1)
         temp_cpu_str = str(temp_cpu)
         # calculates the real temperature compesating CPU heating
         temp_avg = round(temp_room - ((temp_cpu - temp_room)/1.5), 1)
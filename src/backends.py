@@ -0,0 +1,410 @@
+"""
+Sensor backends used by SenseHatDevice: real hardware, a simulator and trace replay.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import csv
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from i2csensors import HTS221, HTS221_ADDRESS, LPS25H, LPS25H_ADDRESS, open_bus
+from ledmatrix import framebuffer_pixels
+from thermal import ThermalReader
+
+# Values returned by `SensorBackend.read_all()`, in order
+ENV_FIELDS = ("pressure", "temp_from_pressure", "humidity", "temp_from_humidity", "temp_cpu")
+# Values returned by `SensorBackend.read_imu()`, in order
+IMU_FIELDS = ("ax", "ay", "az", "gx", "gy", "gz", "mx", "my", "mz")
+
+
+class SensorBackend:
+    """
+    The sensor and display operations SenseHatDevice needs from a SenseHat.
+
+    Subclasses implement `read_all()` and may override the other methods
+    with cheaper per-sensor reads.
+    """
+
+    def read_all(self) -> Tuple[float, float, float, float, float]:
+        """
+        Read every environmental sensor once.
+
+        Returns
+        -------
+        Tuple[float, float, float, float, float]
+            The values of `ENV_FIELDS`.
+        """
+        raise NotImplementedError
+
+    def sampling_devices(self) -> Dict[str, Dict]:
+        """
+        Describe the sensors for `SamplingEngine`, grouped by physical device.
+
+        The default reads everything as one device with `read_all()`.
+        """
+        return {"sensors": {ENV_FIELDS: self.read_all}}
+
+    def read_imu(self) -> Tuple[float, ...]:
+        """
+        Read the accelerometer (g), gyroscope (rad/s) and magnetometer (uT) once.
+
+        Returns
+        -------
+        Tuple[float, ...]
+            The values of `IMU_FIELDS`.
+        """
+        raise NotImplementedError(f"{type(self).__name__} has no IMU")
+
+    def get_temperature(self) -> float:
+        """Get the temperature from the humidity sensor."""
+        return self.read_all()[3]
+
+    def get_humidity(self) -> float:
+        """Get the relative humidity in %."""
+        return self.read_all()[2]
+
+    def get_pressure(self) -> float:
+        """Get the pressure in hPa."""
+        return self.read_all()[0]
+
+    def show_message(self, message: str):
+        """Scroll a message on the LED matrix."""
+
+    def set_pixels(self, pixels: List[List[int]]):
+        """Show a frame of 64 [r, g, b] pixels on the LED matrix."""
+
+    def write_frame(self, frame: bytes):
+        """Show a 128-byte framebuffer frame, see `ledmatrix.to_framebuffer`."""
+        self.set_pixels(framebuffer_pixels(frame))
+
+    def clear(self):
+        """Turn the LED matrix off."""
+
+    def recalibrate(self) -> bool:
+        """
+        Read the sensors' calibration again instead of the cached values.
+
+        Returns
+        -------
+        bool
+            False when the backend has no calibration to reload.
+        """
+        return False
+
+    def close(self):
+        """Release the resources held by the backend."""
+
+
+class HardwareBackend(SensorBackend):
+    """
+    A real SenseHat, read through RTIMULib or, when configured, through the
+    direct I2C drivers.
+    """
+
+    def __init__(self, i2c: Dict | None = None, thermal_root: str | None = None):
+        """
+        Parameters
+        ----------
+        i2c
+            Settings of the direct I2C drivers ('bus', 'humidity_address',
+            'pressure_address'), or None to use RTIMULib.
+        thermal_root
+            Overrides the thermal sysfs directory.
+        """
+        # Imported here so the other backends work on machines without a SenseHat
+        from sense_hat import SenseHat
+
+        self.sense = SenseHat()
+        self.thermal = ThermalReader() if thermal_root is None else ThermalReader(thermal_root)
+        self.hts221 = None
+        self.lps25h = None
+        # The LED framebuffer, opened on the first streamed frame
+        self._fb: int | None = None
+        if i2c:
+            bus = open_bus(int(i2c.get("bus", 1)))
+            # The sampling engine reads the two chips on separate threads: one lock for the shared handle
+            bus_lock = threading.Lock()
+            self.hts221 = HTS221(bus, int(i2c.get("humidity_address", HTS221_ADDRESS)), bus_lock)
+            self.lps25h = LPS25H(bus, int(i2c.get("pressure_address", LPS25H_ADDRESS)), bus_lock)
+
+    def read_all(self):
+        if self.lps25h is not None:
+            pressure, temp_from_pressure = self.lps25h.read()
+            humidity, temp_from_humidity = self.hts221.read()
+        else:
+            temp_from_pressure = self.sense.get_temperature_from_pressure()
+            temp_from_humidity = self.sense.get_temperature_from_humidity()
+            humidity = self.sense.get_humidity()
+            pressure = self.sense.get_pressure()
+        return pressure, temp_from_pressure, humidity, temp_from_humidity, self.thermal.read()
+
+    def sampling_devices(self):
+        if self.lps25h is not None:
+            devices = {
+                "lps25h": {("pressure", "temp_from_pressure"): self.lps25h.read},
+                "hts221": {("humidity", "temp_from_humidity"): self.hts221.read},
+            }
+        else:
+            # Both chips are behind the one SenseHat/RTIMULib object, which is
+            # not safe to call from two threads: read them as one device
+            devices = {
+                "sensehat": {
+                    "temp_from_pressure": self.sense.get_temperature_from_pressure,
+                    "pressure": self.sense.get_pressure,
+                    "temp_from_humidity": self.sense.get_temperature_from_humidity,
+                    "humidity": self.sense.get_humidity,
+                },
+            }
+        devices["soc"] = {"temp_cpu": self.thermal.read}
+        return devices
+
+    def read_imu(self):
+        accel = self.sense.get_accelerometer_raw()
+        gyro = self.sense.get_gyroscope_raw()
+        compass = self.sense.get_compass_raw()
+        return (
+            accel["x"], accel["y"], accel["z"],
+            gyro["x"], gyro["y"], gyro["z"],
+            compass["x"], compass["y"], compass["z"],
+        )
+
+    def get_temperature(self):
+        return self.sense.get_temperature()
+
+    def get_humidity(self):
+        return self.sense.get_humidity()
+
+    def get_pressure(self):
+        return self.sense.get_pressure()
+
+    def show_message(self, message):
+        self.sense.show_message(message)
+
+    def set_pixels(self, pixels):
+        self.sense.set_pixels(pixels)
+
+    def write_frame(self, frame):
+        # One write to the framebuffer instead of sense_hat's write per pixel;
+        # its rotation is only applied by set_pixels
+        if self._fb is None:
+            device = getattr(self.sense, "_fb_device", None)
+            if device is None or self.sense.rotation != 0:
+                self.set_pixels(framebuffer_pixels(frame))
+                return
+            self._fb = os.open(device, os.O_WRONLY)
+        os.pwrite(self._fb, frame, 0)
+
+    def clear(self):
+        self.sense.clear()
+
+    def recalibrate(self) -> bool:
+        if self.hts221 is not None:
+            self.hts221.recalibrate()
+        # RTIMULib reads the calibration registers when a sensor is initialised
+        self.sense._pressure_init = self.sense._pressure.pressureInit()
+        if self.hts221 is None:
+            self.sense._humidity_init = self.sense._humidity.humidityInit()
+            return bool(self.sense._humidity_init and self.sense._pressure_init)
+        return bool(self.sense._pressure_init)
+
+    def close(self):
+        self.thermal.close()
+        if self._fb is not None:
+            os.close(self._fb)
+            self._fb = None
+
+
+class SimulatedBackend(SensorBackend):
+    """
+    A deterministic simulator. Every channel is a base value plus a linear
+    drift per reading and Gaussian noise from a seeded generator, so the
+    same seed always produces the same sequence.
+    """
+
+    DEFAULT_BASE = {
+        "pressure": 1013.25,
+        "temp_from_pressure": 27.0,
+        "humidity": 45.0,
+        "temp_from_humidity": 27.5,
+        "temp_cpu": 48.0,
+    }
+    DEFAULT_NOISE = {
+        "pressure": 0.05,
+        "temp_from_pressure": 0.05,
+        "humidity": 0.3,
+        "temp_from_humidity": 0.05,
+        "temp_cpu": 0.5,
+    }
+
+    def __init__(
+        self,
+        seed: int = 0,
+        base: Dict[str, float] | None = None,
+        noise: Dict[str, float] | None = None,
+        drift: Dict[str, float] | None = None,
+        latency: float = 0.0,
+    ):
+        """
+        Parameters
+        ----------
+        seed
+            Seed of the noise generator.
+        base
+            Starting value per field of `ENV_FIELDS`.
+        noise
+            Standard deviation of the noise per field.
+        drift
+            Change per reading per field.
+        latency
+            Seconds each reading takes, to imitate a slow bus.
+        """
+        self._random = random.Random(seed)
+        # Separate generator so IMU reads do not shift the environmental sequence
+        self._imu_random = random.Random(seed + 1)
+        self.base = dict(self.DEFAULT_BASE, **(base or {}))
+        self.noise = dict(self.DEFAULT_NOISE, **(noise or {}))
+        self.drift = drift or {}
+        self.latency = latency
+        self.readings = 0
+        self.messages: List[str] = []
+        # The last frame shown on the LED matrix, as pixels or streamed
+        self.pixels: List[List[int]] | None = None
+        self.frame: bytes | None = None
+        self.frames = 0
+
+    def read_all(self):
+        if self.latency:
+            time.sleep(self.latency)
+        n = self.readings
+        self.readings += 1
+        gauss = self._random.gauss
+        return tuple(
+            self.base[field] + self.drift.get(field, 0.0) * n + gauss(0.0, self.noise[field])
+            for field in ENV_FIELDS
+        )
+
+    def read_imu(self):
+        gauss = self._imu_random.gauss
+        # At rest: 1 g on z, no rotation, a fixed magnetic field
+        return (
+            gauss(0.0, 0.01), gauss(0.0, 0.01), 1.0 + gauss(0.0, 0.01),
+            gauss(0.0, 0.002), gauss(0.0, 0.002), gauss(0.0, 0.002),
+            20.0 + gauss(0.0, 0.5), 0.0 + gauss(0.0, 0.5), -40.0 + gauss(0.0, 0.5),
+        )
+
+    def show_message(self, message):
+        self.messages.append(message)
+
+    def set_pixels(self, pixels):
+        self.pixels = pixels
+
+    def write_frame(self, frame):
+        self.frame = frame
+        self.frames += 1
+
+
+class ReplayBackend(SensorBackend):
+    """
+    Streams a recorded trace. Each reading returns the next row of a CSV file
+    whose header names the `ENV_FIELDS` columns, and optionally the
+    `IMU_FIELDS` columns, which `read_imu()` streams independently.
+    """
+
+    def __init__(self, path: str, loop: bool = True):
+        """
+        Parameters
+        ----------
+        path
+            The CSV trace, for example one written by `record_trace()`.
+        loop
+            Start over at the end of the trace instead of raising EOFError.
+        """
+        with open(path, "r", encoding="utf-8", newline="") as fp:
+            reader = csv.DictReader(fp)
+            has_imu = all(field in (reader.fieldnames or ()) for field in IMU_FIELDS)
+            self.rows = []
+            self.imu_rows = []
+            for row in reader:
+                self.rows.append(tuple(float(row[field]) for field in ENV_FIELDS))
+                if has_imu:
+                    self.imu_rows.append(tuple(float(row[field]) for field in IMU_FIELDS))
+        if not self.rows:
+            raise ValueError(f"Trace {path} has no rows")
+        self.loop = loop
+        self.position = 0
+        self.imu_position = 0
+
+    def read_all(self):
+        if self.position >= len(self.rows):
+            if not self.loop:
+                raise EOFError("End of trace")
+            self.position = 0
+        row = self.rows[self.position]
+        self.position += 1
+        return row
+
+    def read_imu(self):
+        if not self.imu_rows:
+            return super().read_imu()
+        if self.imu_position >= len(self.imu_rows):
+            if not self.loop:
+                raise EOFError("End of trace")
+            self.imu_position = 0
+        row = self.imu_rows[self.imu_position]
+        self.imu_position += 1
+        return row
+
+
+def record_trace(
+    read: Callable[[], Sequence[float]], path: str, samples: int, interval: float = 0.0
+):
+    """
+    Write `samples` readings of a backend to a CSV trace for `ReplayBackend`.
+
+    Parameters
+    ----------
+    read
+        A backend's `read_all`.
+    path
+        The CSV file to write.
+    samples
+        The number of readings.
+    interval
+        Seconds to wait between readings.
+    """
+    with open(path, "w", encoding="utf-8", newline="") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(("time",) + ENV_FIELDS)
+        for i in range(samples):
+            writer.writerow((time.time(),) + tuple(read()))
+            if interval and i + 1 < samples:
+                time.sleep(interval)
+
+
+def create_backend(config: Dict) -> SensorBackend:
+    """
+    Build the backend selected by the 'backend' section of the configuration.
+
+    Parameters
+    ----------
+    config
+        The whole configuration. 'backend' holds a 'type' of "hardware"
+        (default), "simulated" or "replay" plus that backend's options.
+
+    Returns
+    -------
+    SensorBackend
+        The backend.
+    """
+    options = dict(config.get("backend", {}))
+    kind = options.pop("type", "hardware")
+    if kind == "hardware":
+        return HardwareBackend(i2c=config.get("i2c"), **options)
+    if kind == "simulated":
+        return SimulatedBackend(**options)
+    if kind == "replay":
+        return ReplayBackend(**options)
+    raise ValueError(f"Unknown backend type '{kind}'")
@@ -0,0 +1,124 @@
+"""
+Encodes IMU blocks and high-rate statistics in the binary format of binformat.py.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+
+from binformat import FLOAT32, FLOAT64, HEADER, MAGIC, SCHEMA_VERSION, TIME_COLUMN, VERSION, schema_id
+
+STATISTICS = ("mean", "min", "max", "stddev")
+
+
+class TableEncoder:
+    """
+    Encodes tables with a fixed set of columns.
+
+    The column names are encoded once; each payload is the header, the names
+    and the values written straight from a NumPy array. With `schema`, the
+    payload carries the schema id of the names instead, and `names` must be
+    published on the schema topic.
+    """
+
+    def __init__(self, columns: Sequence[str], double: bool = False, schema: bool = False):
+        """
+        Parameters
+        ----------
+        columns
+            The column names, in the order of the array columns.
+        double
+            Write float64 values instead of float32.
+        schema
+            Write version 2 tables, which refer to the names by `schema_id`.
+        """
+        self.columns = tuple(columns)
+        self.names = ",".join(self.columns).encode("ascii")
+        self.schema_id = schema_id(self.names)
+        self.version = SCHEMA_VERSION if schema else VERSION
+        self._reference = self.schema_id if schema else self.names
+        self.value_type = FLOAT64 if double else FLOAT32
+        self.dtype = np.dtype("<f8" if double else "<f4")
+        self.time_index = self.columns.index(TIME_COLUMN) if TIME_COLUMN in self.columns else None
+
+    def encode(self, rows: np.ndarray, rate_hz: float = 0.0, base_time: float | None = None) -> bytes:
+        """
+        Encode a (rows, columns) array.
+
+        Parameters
+        ----------
+        rows
+            The values. It is not modified.
+        rate_hz
+            The nominal sample rate, 0 when not applicable.
+        base_time
+            The epoch time the "time" column is made relative to; defaults
+            to the first sample time, or 0 without a "time" column.
+
+        Returns
+        -------
+        bytes
+            The payload.
+        """
+        rows = np.atleast_2d(rows)
+        if rows.shape[1] != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} columns, got {rows.shape[1]}")
+        values = rows.astype(self.dtype)
+        if self.time_index is not None:
+            if base_time is None:
+                base_time = float(rows[0, self.time_index]) if len(rows) else 0.0
+            # Subtract in float64, before the precision of float32 matters
+            values[:, self.time_index] = rows[:, self.time_index] - base_time
+        header = HEADER.pack(
+            MAGIC, self.version, self.value_type, len(rows), len(self._reference), base_time or 0.0, rate_hz
+        )
+        return header + self._reference + values.tobytes()
+
+
+class StatsEncoder:
+    """
+    Encodes the statistics of `RingBuffer.aggregate()` as a one-row table
+    with a "<channel>.<statistic>" column per value and one "count" column.
+
+    The column names take more room than the values, so by default the
+    table refers to them by schema id: publish `table.names` once on the
+    schema topic.
+    """
+
+    def __init__(self, channels: Sequence[str], schema: bool = True):
+        """
+        Parameters
+        ----------
+        channels
+            The channels of the statistics, in output order.
+        schema
+            Refer to the column names by schema id rather than embedding them.
+        """
+        self.channels = tuple(channels)
+        columns = [f"{channel}.{statistic}" for channel in self.channels for statistic in STATISTICS]
+        self.table = TableEncoder(columns + ["count"], schema=schema)
+        self._row = np.zeros((1, len(columns) + 1), dtype=np.float64)
+
+    def encode(self, stats: Dict[str, Dict[str, float]], rate_hz: float, timestamp: float) -> bytes:
+        """
+        Encode one cycle of statistics.
+
+        Parameters
+        ----------
+        stats
+            Channel -> {"mean", "min", "max", "stddev", "count"}.
+        rate_hz
+            The sample rate.
+        timestamp
+            The epoch time of the cycle.
+        """
+        row = self._row[0]
+        i = 0
+        for channel in self.channels:
+            channel_stats = stats[channel]
+            for statistic in STATISTICS:
+                row[i] = channel_stats[statistic]
+                i += 1
+        row[i] = stats[self.channels[0]]["count"]
+        return self.table.encode(self._row, rate_hz=rate_hz, base_time=timestamp)
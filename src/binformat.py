@@ -0,0 +1,157 @@
+"""
+The binary payload format of the high-rate streams, and its decoder.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+
+Only the standard library is used, so subscribers can copy this file alone.
+
+A payload is a table of floats:
+
+    header  HEADER: magic b"SB", version, value type, rows, length of the
+            column names, base time (epoch seconds), sample rate (Hz)
+    names   the column names, ASCII, comma separated
+    values  rows x columns little-endian floats, row after row
+
+A "time" column holds seconds since the base time, so it keeps sub-millisecond
+precision in float32.
+
+Version 2 tables, used for the statistics, carry the 8-character schema id
+of their column names instead of the names themselves. The names are
+published once, retained, on the schema topic `<stats topic>/schema/<id>`;
+subscribers keep the {id: columns} of `parse_schema()` and pass them to
+`decode()`.
+"""
+import struct
+import zlib
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+MAGIC = b"SB"
+VERSION = 1
+# The names section holds a schema id, see schema_id()
+SCHEMA_VERSION = 2
+HEADER = struct.Struct("<2sBBHHdf")
+
+# Value type codes and their struct format characters
+FLOAT32 = 1
+FLOAT64 = 2
+VALUE_FORMATS = {FLOAT32: "f", FLOAT64: "d"}
+
+TIME_COLUMN = "time"
+
+
+class FormatError(ValueError):
+    """The payload is not a binary table, or is truncated."""
+
+
+class UnknownSchema(FormatError):
+    """The payload refers to a schema that was not received."""
+
+
+def schema_id(names: bytes) -> bytes:
+    """Return the id of comma-separated column names: their CRC-32 as 8 hex digits."""
+    return b"%08x" % zlib.crc32(names)
+
+
+def parse_schema(payload: bytes) -> Tuple[bytes, Tuple[str, ...]]:
+    """
+    Parse a message of a schema topic.
+
+    Returns
+    -------
+    Tuple[bytes, Tuple[str, ...]]
+        The schema id and the column names.
+    """
+    names = bytes(payload)
+    return schema_id(names), tuple(names.decode("ascii").split(",")) if names else ()
+
+
+def is_binary(payload: bytes) -> bool:
+    """Return True when the payload starts like a binary table rather than JSON."""
+    return payload[: len(MAGIC)] == MAGIC
+
+
+def decode(payload: bytes, schemas: Mapping[bytes, Sequence[str]] | None = None) -> Dict:
+    """
+    Decode a binary table.
+
+    Parameters
+    ----------
+    payload
+        The message payload.
+    schemas
+        The column names of each schema id, needed by version 2 tables.
+
+    Returns
+    -------
+    Dict
+        {"columns": names, "time": base time, "rate": Hz, "rows": [[...], ...]},
+        with the "time" column converted back to epoch seconds.
+
+    Raises
+    ------
+    FormatError
+        When the payload is not a valid table.
+    UnknownSchema
+        When its schema id is not in `schemas`.
+    """
+    if len(payload) < HEADER.size:
+        raise FormatError(f"Payload of {len(payload)} bytes is shorter than the header")
+    magic, version, value_type, rows, names_length, base_time, rate = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise FormatError("Not a binary table")
+    if version not in (VERSION, SCHEMA_VERSION):
+        raise FormatError(f"Unsupported version {version}")
+    if value_type not in VALUE_FORMATS:
+        raise FormatError(f"Unknown value type {value_type}")
+    offset = HEADER.size
+    names = bytes(payload[offset : offset + names_length])
+    if version == SCHEMA_VERSION:
+        if schemas is None or names not in schemas:
+            raise UnknownSchema(f"Unknown schema {names.decode('ascii', 'replace')}")
+        columns = tuple(schemas[names])
+    else:
+        columns = tuple(names.decode("ascii").split(",")) if names else ()
+    offset += names_length
+    row_format = struct.Struct("<" + VALUE_FORMATS[value_type] * len(columns))
+    if len(payload) != offset + rows * row_format.size:
+        raise FormatError(f"Expected {offset + rows * row_format.size} bytes, got {len(payload)}")
+    table = [list(values) for values in row_format.iter_unpack(payload[offset:])] if columns else [[]] * rows
+    if TIME_COLUMN in columns:
+        index = columns.index(TIME_COLUMN)
+        for row in table:
+            row[index] += base_time
+    return {"columns": columns, "time": base_time, "rate": rate, "rows": table}
+
+
+def decode_records(
+    payload: bytes, schemas: Mapping[bytes, Sequence[str]] | None = None
+) -> List[Dict[str, float]]:
+    """Decode a binary table into one {column: value} dictionary per row; see `decode`."""
+    table = decode(payload, schemas)
+    return [dict(zip(table["columns"], row)) for row in table["rows"]]
+
+
+def decode_stats(
+    payload: bytes, schemas: Mapping[bytes, Sequence[str]] | None = None
+) -> Dict[str, Dict[str, float]]:
+    """
+    Decode the statistics of a high-rate cycle; see `decode`.
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        Channel -> {"mean", "min", "max", "stddev", "count"}, as in the JSON
+        payload of the stats topic.
+    """
+    table = decode(payload, schemas)
+    if not table["rows"]:
+        return {}
+    values = dict(zip(table["columns"], table["rows"][0]))
+    count = int(values.pop("count", 0))
+    stats: Dict[str, Dict[str, float]] = {}
+    for name, value in values.items():
+        channel, _, statistic = name.rpartition(".")
+        stats.setdefault(channel, {})[statistic] = value
+    for channel_stats in stats.values():
+        channel_stats["count"] = count
+    return stats
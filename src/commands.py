@@ -0,0 +1,219 @@
+"""
+Routes inbound MQTT messages to command handlers through a wildcard topic trie.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import collections
+import logging
+import threading
+from typing import Callable, Deque, Dict, List, Tuple
+
+log = logging.getLogger(__name__)
+
+# A command handler: called with the topic and the payload
+Handler = Callable[[str, bytes], None]
+
+
+class TopicTrie:
+    """
+    MQTT topic filters, with the `+` and `#` wildcards, compiled into a trie.
+
+    Matching walks one node per topic level instead of testing every filter,
+    and the handlers of the most recent topics are cached until the next
+    `add()`. As the MQTT specification requires, a wildcard first level does
+    not match topics starting with `$`, such as `$SYS/...`.
+    """
+
+    def __init__(self, cache_size: int = 256):
+        """
+        Parameters
+        ----------
+        cache_size
+            Topics whose handlers are cached; the cache is emptied when full,
+            so remote topics with wildcard levels cannot grow it without bound.
+        """
+        self.cache_size = cache_size
+        self._root: Dict = {}
+        self._cache: Dict[str, Tuple[Handler, ...]] = {}
+
+    def add(self, topic_filter: str, handler: Handler):
+        """
+        Register a handler for a topic filter.
+
+        Raises
+        ------
+        ValueError
+            When `#` is not the last level or a wildcard is not a whole level.
+        """
+        levels = topic_filter.split("/")
+        for i, level in enumerate(levels):
+            if ("#" in level and (level != "#" or i != len(levels) - 1)) or ("+" in level and level != "+"):
+                raise ValueError(f"Invalid topic filter '{topic_filter}'")
+        node = self._root
+        for level in levels:
+            node = node.setdefault(level, {})
+        node.setdefault(None, []).append(handler)
+        self._cache.clear()
+
+    def match(self, topic: str) -> Tuple[Handler, ...]:
+        """Return the handlers of every filter matching a topic, in registration order per filter."""
+        handlers = self._cache.get(topic)
+        if handlers is None:
+            found: List[Handler] = []
+            levels = topic.split("/")
+            if topic.startswith("$"):
+                # Only a literal first level: "#" and "+/..." do not match "$SYS/..."
+                child = self._root.get(levels[0])
+                if child is not None:
+                    self._walk(child, levels, 1, found)
+            else:
+                self._walk(self._root, levels, 0, found)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            handlers = self._cache[topic] = tuple(found)
+        return handlers
+
+    def _walk(self, node: Dict, levels: List[str], index: int, found: List[Handler]):
+        # "#" also matches the parent level: "a/#" matches "a"
+        if "#" in node:
+            found.extend(node["#"].get(None, ()))
+        if index == len(levels):
+            found.extend(node.get(None, ()))
+            return
+        child = node.get(levels[index])
+        if child is not None:
+            self._walk(child, levels, index + 1, found)
+        child = node.get("+")
+        if child is not None:
+            self._walk(child, levels, index + 1, found)
+
+
+class CommandDispatcher:
+    """
+    Runs the handlers of inbound messages on a worker thread.
+
+    `submit()` only appends to a bounded queue, which drops its oldest
+    message when full, so it can be called from the paho network thread: a
+    burst of commands or a slow handler never stalls the network loop.
+
+    Inline handlers, for streams with their own buffering, run on the
+    receiving thread through `handle_inline()` and must not block.
+    """
+
+    def __init__(self, queue_size: int = 32, default: Handler | None = None):
+        """
+        Parameters
+        ----------
+        queue_size
+            Messages waiting for the worker; older ones are dropped beyond it.
+        default
+            Called for the messages no filter matches.
+        """
+        self.trie = TopicTrie()
+        self.inline = TopicTrie()
+        self.default = default
+        self.dispatched = 0
+        self.unmatched = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue: Deque[Tuple[str, bytes]] = collections.deque(maxlen=queue_size)
+        self._ready = threading.Condition()
+        self._stop = False
+        self._thread: threading.Thread | None = None
+
+    def register(self, topic_filter: str, handler: Handler, inline: bool = False):
+        """Call a handler for every message on topics matching the filter, inline or on the worker."""
+        (self.inline if inline else self.trie).add(topic_filter, handler)
+
+    def reset(self):
+        """Forget every registered filter, e.g. before registering them under a new topic."""
+        self.trie = TopicTrie()
+        self.inline = TopicTrie()
+
+    def handle_inline(self, topic: str, payload: bytes) -> bool:
+        """
+        Run the inline handlers of a message on the calling thread.
+
+        Returns
+        -------
+        bool
+            True when an inline handler matched: the message is then not
+            meant for `submit()` or `dispatch()`.
+        """
+        handlers = self.inline.match(topic)
+        for handler in handlers:
+            try:
+                handler(topic, payload)
+            except Exception as ex:
+                self.errors += 1
+                log.warning("%s: %s", topic, ex)
+        if handlers:
+            self.dispatched += 1
+        return bool(handlers)
+
+    def dispatch(self, topic: str, payload: bytes) -> bool:
+        """
+        Run the handlers of a message on the calling thread.
+
+        Returns
+        -------
+        bool
+            False when no handler matched the topic.
+        """
+        handlers = self.trie.match(topic)
+        if not handlers:
+            self.unmatched += 1
+            if self.default is not None:
+                self.default(topic, payload)
+            return False
+        for handler in handlers:
+            try:
+                handler(topic, payload)
+            except Exception as ex:
+                self.errors += 1
+                log.warning("%s: %s", topic, ex)
+        self.dispatched += 1
+        return True
+
+    def submit(self, topic: str, payload: bytes):
+        """Queue a message for the worker thread and return at once."""
+        with self._ready:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append((topic, payload))
+            self._ready.notify()
+
+    def start(self):
+        """Start the worker thread."""
+        self._stop = False
+        self._thread = threading.Thread(target=self._loop, name="commands", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread once the message being handled is done."""
+        with self._ready:
+            self._stop = True
+            self._ready.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while True:
+            with self._ready:
+                while not self._queue and not self._stop:
+                    self._ready.wait()
+                if self._stop:
+                    return
+                topic, payload = self._queue.popleft()
+            self.dispatch(topic, payload)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the dispatch counters."""
+        return {
+            "dispatched": self.dispatched,
+            "unmatched": self.unmatched,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queued": len(self._queue),
+        }
@@ -0,0 +1,164 @@
+"""
+Report-by-exception: decides which readings are worth publishing.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import time
+from typing import Callable, Dict
+
+
+class ChangeFilter:
+    """
+    Suppresses readings that did not move by more than a deadband since the
+    last published value, unless the sensor has been silent for longer than
+    the heartbeat.
+
+    A deadband is {"absolute": x} in the sensor's unit, {"relative": r} as a
+    fraction of the last published value, or both, in which case the larger
+    threshold wins. Sensors without a deadband, and without a "default" one,
+    are published whenever their value changes at all.
+
+    A value only becomes the reference for the next decisions once the
+    caller reports it as published with `commit()`; after `rollback()`, or
+    without either, the last published value stays the reference.
+    """
+
+    def __init__(
+        self,
+        deadbands: Dict[str, Dict[str, float]] | None = None,
+        heartbeat: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Parameters
+        ----------
+        deadbands
+            Sensor name -> deadband. The "default" entry applies to sensors
+            that have none of their own.
+        heartbeat
+            Maximum number of seconds a sensor may stay silent.
+        clock
+            Returns the current time in seconds.
+        """
+        self.deadbands = deadbands or {}
+        self.heartbeat = heartbeat
+        self.clock = clock
+        # sensor -> (last published value, when it was published)
+        self._last: Dict[str, tuple] = {}
+        # sensor or document -> the values decided for publishing, with the time and the reason
+        self._pending: Dict[str, tuple] = {}
+        self.published: Dict[str, int] = {}
+        self.suppressed: Dict[str, int] = {}
+        self.heartbeats: Dict[str, int] = {}
+
+    def _threshold(self, sensor: str, last_value: float) -> float:
+        band = self.deadbands.get(sensor, self.deadbands.get("default"))
+        if not band:
+            return 0.0
+        return max(
+            float(band.get("absolute", 0.0)),
+            float(band.get("relative", 0.0)) * abs(last_value),
+        )
+
+    def _check(self, sensor: str, value: float, now: float) -> str | None:
+        last = self._last.get(sensor)
+        if last is None or value is None or last[0] is None:
+            return "change"
+        last_value, last_time = last
+        if now - last_time >= self.heartbeat:
+            return "heartbeat"
+        if abs(value - last_value) > self._threshold(sensor, last_value):
+            return "change"
+        return None
+
+    def _record(self, sensor: str, value: float, now: float, reason: str):
+        self._last[sensor] = (value, now)
+        self.published[sensor] = self.published.get(sensor, 0) + 1
+        if reason == "heartbeat":
+            self.heartbeats[sensor] = self.heartbeats.get(sensor, 0) + 1
+
+    def commit(self, name: str):
+        """
+        Make the values of the last positive decision for a sensor or a
+        document the reference, once they were published.
+        """
+        pending = self._pending.pop(name, None)
+        if pending is None:
+            return
+        values, now, reason = pending
+        for sensor, value in values.items():
+            self._last[sensor] = (value, now)
+        self._record(name, values.get(name), now, reason)
+
+    def rollback(self, name: str):
+        """Forget the last positive decision for a sensor or a document: its publish failed."""
+        self._pending.pop(name, None)
+
+    def should_publish(self, sensor: str, value: float) -> bool:
+        """
+        Decide whether a reading should be published, and count the decision.
+
+        Parameters
+        ----------
+        sensor
+            The sensor name, as used in the deadbands.
+        value
+            The new reading.
+
+        Returns
+        -------
+        bool
+            True when the value left the deadband or the heartbeat expired.
+            `commit()` then makes it the reference for the next decision.
+        """
+        now = self.clock()
+        reason = self._check(sensor, value, now)
+        if reason is None:
+            self.suppressed[sensor] = self.suppressed.get(sensor, 0) + 1
+            return False
+        self._pending[sensor] = ({sensor: value}, now, reason)
+        return True
+
+    def should_publish_all(self, name: str, values: Dict[str, float]) -> bool:
+        """
+        Decide whether a document of several values should be published.
+
+        The document is published when any value left its deadband or the
+        document's heartbeat expired; `commit()` then makes all values the
+        reference.
+
+        Parameters
+        ----------
+        name
+            The document name, used for the counters and the heartbeat.
+        values
+            Sensor name -> new reading.
+        """
+        now = self.clock()
+        reasons = [self._check(sensor, value, now) for sensor, value in values.items()]
+        last = self._last.get(name)
+        if last is None or now - last[1] >= self.heartbeat:
+            reasons.append("heartbeat" if last is not None else "change")
+        reasons = [reason for reason in reasons if reason is not None]
+        if not reasons:
+            self.suppressed[name] = self.suppressed.get(name, 0) + 1
+            return False
+        reason = "change" if "change" in reasons else "heartbeat"
+        self._pending[name] = (dict(values), now, reason)
+        return True
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return the published, suppressed and heartbeat counters per sensor."""
+        sensors = set(self.published) | set(self.suppressed)
+        return {
+            sensor: {
+                "published": self.published.get(sensor, 0),
+                "suppressed": self.suppressed.get(sensor, 0),
+                "heartbeats": self.heartbeats.get(sensor, 0),
+            }
+            for sensor in sorted(sensors)
+        }
+
+    def total_suppressed(self) -> int:
+        """Return the number of suppressed messages over all sensors."""
+        return sum(self.suppressed.values())
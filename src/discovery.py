@@ -0,0 +1,79 @@
+"""
+Home Assistant MQTT discovery payloads, encoded once and republished on Home Assistant's birth message.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+from typing import Callable, Dict, List, Tuple
+
+from psychrometrics import DERIVED
+from serialization import dumps
+
+# Where Home Assistant publishes "online" when it starts and "offline" when it stops
+HA_STATUS_TOPIC = "homeassistant/status"
+
+
+def discovery_messages(device) -> List[Tuple[str, Dict]]:
+    """
+    Build the discovery configurations of a SenseHatDevice.
+
+    Parameters
+    ----------
+    device
+        The SenseHatDevice.
+
+    Returns
+    -------
+    List[Tuple[str, Dict]]
+        (config topic, configuration) pairs: the device, pressure, humidity,
+        temperature and, when 'derived' is set, each derived value.
+    """
+    topics = device.cfg.topics
+    config_topics = device.cfg.config_topics
+    messages = [
+        (topics["device"] + topics["config"], device.define_sensehat_device()),
+        (config_topics["pressure"], device.message_config_pressure("pressure")),
+        (config_topics["humidity"], device.message_config_humidity("humidity")),
+        (config_topics["temperature"], device.message_config_temperature("temperature")),
+    ]
+    if device.cfg.get("derived"):
+        for sensor in DERIVED:
+            messages.append((topics["device"] + "/" + sensor + topics["config"], device.message_config_derived(sensor)))
+    return messages
+
+
+class DiscoveryCache:
+    """
+    Discovery payloads encoded once at startup.
+
+    They are meant to be published retained: the broker then hands them to
+    Home Assistant whenever it subscribes, so they only need to be sent
+    again when Home Assistant announces itself with its birth message.
+    """
+
+    def __init__(self, messages: List[Tuple[str, Dict]]):
+        """
+        Parameters
+        ----------
+        messages
+            (config topic, configuration) pairs, see `discovery_messages()`.
+        """
+        self.messages: List[Tuple[str, bytes]] = [(topic, dumps(config)) for topic, config in messages]
+        self.publishes = 0
+
+    def publish(self, send: Callable[[str, bytes], object]):
+        """
+        Send every cached payload.
+
+        Parameters
+        ----------
+        send
+            Publishes one (topic, payload), retained.
+        """
+        for topic, payload in self.messages:
+            send(topic, payload)
+        self.publishes += 1
+
+    @staticmethod
+    def is_birth(topic: str, payload: bytes) -> bool:
+        """Return True for Home Assistant's "online" birth message."""
+        return topic == HA_STATUS_TOPIC and payload.strip().lower() == b"online"
@@ -0,0 +1,235 @@
+"""
+Publishes every message to several brokers, each with its own client, queue and retry policy.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import collections
+import logging
+import ssl
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List
+
+import paho.mqtt.client
+
+from publisher import AsyncPublisher
+from supervisor import ConnectionSupervisor
+
+log = logging.getLogger(__name__)
+
+
+def create_client(broker: Dict, client_id: str) -> paho.mqtt.client.Client:
+    """
+    Build a paho client for one entry of the 'brokers' configuration.
+
+    Parameters
+    ----------
+    broker
+        'host' and 'port', optionally 'username'/'password' and the TLS
+        files 'ca_certs', 'certfile', 'keyfile'.
+    client_id
+        The MQTT client id.
+
+    Returns
+    -------
+    paho.mqtt.client.Client
+        The client, not connected yet.
+    """
+    client = paho.mqtt.client.Client(client_id=client_id)
+    if broker.get("username"):
+        client.username_pw_set(broker["username"], broker.get("password") or None)
+    if broker.get("ca_certs") or broker.get("certfile"):
+        client.tls_set(
+            ca_certs=broker.get("ca_certs") or None,
+            certfile=broker.get("certfile") or None,
+            keyfile=broker.get("keyfile") or None,
+            tls_version=ssl.PROTOCOL_TLSv1_2,
+        )
+    return client
+
+
+class BrokerLink:
+    """
+    One broker of a fan-out: its client, connection supervisor and queues.
+
+    Messages published while the broker is unreachable wait in a bounded
+    backlog, which drops its oldest message when full, and are handed to the
+    client once it reconnects. Messages that fail are retried up to
+    `retries` times.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client: paho.mqtt.client.Client,
+        connect: Callable[[paho.mqtt.client.Client], object],
+        qos: int = 0,
+        retries: int = 2,
+        max_inflight: int = 20,
+        max_pending: int = 1000,
+        timeout: float = 30.0,
+        reconnect: Dict | None = None,
+        availability: Callable[[], List[str]] | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        name
+            The broker name used in the metrics.
+        client
+            The broker's own client.
+        connect
+            Opens the connection, see `ConnectionSupervisor`.
+        qos
+            The quality of service of every message to this broker.
+        retries
+            How many times a failed message is sent again.
+        max_inflight, max_pending
+            See `AsyncPublisher`. `max_pending` also bounds the backlog.
+        timeout
+            Seconds before an unacknowledged message fails.
+        reconnect
+            'base_delay', 'max_delay' and 'jitter' of the reconnect backoff.
+        availability
+            Returns the availability topics set to "online", retained, after
+            every connection; `connect` is expected to set the retained
+            "offline" last will.
+        """
+        reconnect = reconnect or {}
+        self.name = name
+        self.client = client
+        self.qos = qos
+        self.retries = retries
+        self.timeout = timeout
+        self.availability = availability
+        self.publisher = AsyncPublisher(client, max_inflight=max_inflight, max_pending=max_pending)
+        self.supervisor = ConnectionSupervisor(
+            client,
+            connect,
+            base_delay=float(reconnect.get("base_delay", 1.0)),
+            max_delay=float(reconnect.get("max_delay", 60.0)),
+            jitter=float(reconnect.get("jitter", 0.5)),
+        )
+        self.retried = 0
+        self.dropped = 0
+        self.bytes = 0
+        # (topic, payload, retain, attempt)
+        self._backlog: Deque[tuple] = collections.deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._last_stats = (time.monotonic(), 0)
+        client.on_publish = self.publisher.on_publish
+        client.on_connect = self._on_connect
+
+    def start(self):
+        """Connect in the background."""
+        self.supervisor.start()
+
+    def stop(self):
+        """Stop the network thread and disconnect."""
+        self.supervisor.stop()
+        self.client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            log.warning("%s: connection refused: %s", self.name, paho.mqtt.client.connack_string(rc))
+            return
+        log.info("%s: connected, sending %d queued messages", self.name, len(self._backlog))
+        if self.availability is not None:
+            for topic in self.availability():
+                self._send(topic, "online", True, 0)
+        self._flush()
+
+    def _flush(self):
+        while True:
+            with self._lock:
+                if not self._backlog:
+                    return
+                message = self._backlog.popleft()
+            self._send(*message)
+
+    def _queue(self, message: tuple):
+        with self._lock:
+            if len(self._backlog) == self._backlog.maxlen:
+                self.dropped += 1
+            self._backlog.append(message)
+
+    def _send(self, topic: str, payload, retain: bool, attempt: int):
+        future = self.publisher.publish(topic, payload, qos=self.qos, retain=retain)
+        self.bytes += len(payload) if isinstance(payload, (bytes, bytearray, str)) else 0
+
+        def done(result: Future):
+            if result.exception() is None:
+                return
+            if attempt >= self.retries:
+                return
+            self.retried += 1
+            message = (topic, payload, retain, attempt + 1)
+            if self.client.is_connected():
+                self._send(*message)
+            else:
+                self._queue(message)
+
+        future.add_done_callback(done)
+
+    def publish(self, topic: str, payload, retain: bool = False):
+        """Send a message now, or queue it until the broker is reachable."""
+        if self.client.is_connected():
+            self._send(topic, payload, retain, 0)
+        else:
+            self._queue((topic, payload, retain, 0))
+
+    def stats(self) -> Dict:
+        """
+        Return the delivery metrics of this broker.
+
+        'throughput' is the messages acknowledged per second since the
+        previous call; 'queued' the backlog waiting for a connection.
+        """
+        self.publisher.expire(self.timeout)
+        counters = self.publisher.stats()
+        now = time.monotonic()
+        last_time, last_published = self._last_stats
+        self._last_stats = (now, counters["published"])
+        elapsed = now - last_time
+        counters.update(
+            {
+                "throughput": round((counters["published"] - last_published) / elapsed, 2) if elapsed > 0 else 0.0,
+                "queued": len(self._backlog),
+                "backlog_dropped": self.dropped,
+                "retried": self.retried,
+                "bytes": self.bytes,
+                "latency": self.publisher.latency_percentiles(),
+                "connection": self.supervisor.stats(),
+            }
+        )
+        return counters
+
+
+class FanoutPublisher:
+    """
+    Sends every message to each `BrokerLink`. A slow or unreachable broker
+    only fills its own queues; the others are not delayed.
+    """
+
+    def __init__(self, links: List[BrokerLink]):
+        self.links = links
+
+    def start(self):
+        """Connect every broker in the background."""
+        for link in self.links:
+            link.start()
+
+    def stop(self):
+        """Disconnect every broker."""
+        for link in self.links:
+            link.stop()
+
+    def publish(self, topic: str, payload, retain: bool = False):
+        """Hand a message to every broker without waiting for any of them."""
+        for link in self.links:
+            link.publish(topic, payload, retain)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Return the metrics of each broker, keyed by name."""
+        return {link.name: link.stats() for link in self.links}
@@ -0,0 +1,187 @@
+"""
+Gateway mode: many SenseHat devices, each with its own identity and discovery, behind one MQTT connection.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import logging
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from discovery import DiscoveryCache, discovery_messages
+from reading import Reading
+from sensehatdevice import SenseHatDevice
+from serialization import dumps
+from settings import ConfigError, Settings, compile_settings, thaw
+
+log = logging.getLogger(__name__)
+
+# Settings of a gateway entry that replace the base configuration's
+DEVICE_KEYS = ("backend", "i2c", "sampling", "derived", "device_name")
+
+
+def device_config(base: Settings, entry: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Build the configuration of one gateway device from the base configuration.
+
+    Parameters
+    ----------
+    base
+        The process configuration.
+    entry
+        One item of 'gateway.devices': a required 'device_id', an optional
+        'topic' root (defaults to the base root with its last level replaced
+        by the device id) and any of `DEVICE_KEYS`.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The raw configuration of the device. Every base topic under the base
+        root is moved under the device's root.
+    """
+    raw = thaw(base.raw)
+    raw.pop("gateway", None)
+    device_id = entry["device_id"]
+    old_root = base.topics["device"]
+    new_root = entry.get("topic") or old_root.rsplit("/", 1)[0] + "/" + device_id
+    topics = raw["topics"]
+    for key, topic in topics.items():
+        if topic.startswith(old_root):
+            topics[key] = new_root + topic[len(old_root) :]
+    if raw["id"].startswith(old_root):
+        raw["id"] = new_root + raw["id"][len(old_root) :]
+    raw["device_id"] = device_id
+    raw["device_name"] = device_id
+    for key in DEVICE_KEYS:
+        if key in entry:
+            raw[key] = thaw(entry[key])
+    # One message per device and cycle: a gateway serves many devices per connection
+    raw["combined_state"] = True
+    return raw
+
+
+def shared_availability(config: Dict[str, Any], gateway_topic: str) -> Dict[str, Any]:
+    """
+    Make a discovery configuration depend on the gateway's availability too.
+
+    The connection's last will can only cover one topic, the gateway's, so
+    each device is available while both it and the gateway are online.
+    """
+    if "availability_topic" not in config:
+        return config
+    config = dict(config)
+    config["availability"] = [{"topic": config.pop("availability_topic")}, {"topic": gateway_topic}]
+    config["availability_mode"] = "all"
+    return config
+
+
+class GatewayDevice:
+    """One device of a gateway: its SenseHatDevice and its discovery payloads."""
+
+    def __init__(self, device: SenseHatDevice, gateway_topic: str):
+        self.device = device
+        self.settings: Settings = device.cfg
+        self.discovery = DiscoveryCache(
+            [(topic, shared_availability(config, gateway_topic)) for topic, config in discovery_messages(device)]
+        )
+        self.published = 0
+        self.errors = 0
+
+
+class Gateway:
+    """
+    Serves the extra devices listed in the 'gateway' section of the
+    configuration over the process's MQTT connection.
+
+    Every cycle the devices are read in parallel and each publishes one
+    combined state document; discovery and availability are per device.
+    """
+
+    def __init__(self, base: Settings, workers: int | None = None):
+        """
+        Parameters
+        ----------
+        base
+            The process configuration, with a 'gateway' section holding a
+            'devices' list, see `device_config()`.
+        workers
+            Threads reading the devices; defaults to 'gateway.workers', or
+            one per device up to 8.
+
+        Raises
+        ------
+        ConfigError
+            When a device configuration is invalid or two devices share a
+            device id.
+        """
+        section = base.get("gateway", {})
+        entries = section.get("devices", ())
+        if not all(isinstance(entry, Mapping) and isinstance(entry.get("device_id"), str) for entry in entries):
+            raise ConfigError("Every item of 'gateway.devices' must be an object with a 'device_id'")
+        ids = [entry["device_id"] for entry in entries]
+        if len(set(ids)) != len(ids) or base.get("device_id", SenseHatDevice.DEFAULT_DEVICE_ID) in ids:
+            raise ConfigError("Every gateway device needs its own 'device_id'")
+        self.availability_topic = base.availability_topic
+        self.devices: List[GatewayDevice] = [
+            GatewayDevice(SenseHatDevice(compile_settings(device_config(base, entry))), self.availability_topic)
+            for entry in entries
+        ]
+        workers = workers or int(section.get("workers", min(8, max(1, len(self.devices)))))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gateway")
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    def availability_topics(self) -> List[str]:
+        """Return the availability topic of every device."""
+        return [member.settings.availability_topic for member in self.devices]
+
+    def publish_discovery(self, send: Callable[[str, bytes], object]):
+        """Send the cached discovery payloads of every device, see `DiscoveryCache.publish`."""
+        for member in self.devices:
+            member.discovery.publish(send)
+
+    def _read(self, member: GatewayDevice) -> Tuple[GatewayDevice, Reading | None]:
+        try:
+            return member, member.device.calculate_metrics()
+        except Exception as ex:
+            member.errors += 1
+            log.warning("%s: reading failed: %s", member.device.device_id, ex)
+            return member, None
+
+    def publish_cycle(self, send: Callable[[str, bytes, float], object]) -> int:
+        """
+        Read every device in parallel and publish their states.
+
+        Parameters
+        ----------
+        send
+            Publishes (topic, payload, sample time).
+
+        Returns
+        -------
+        int
+            The number of devices published.
+        """
+        published = 0
+        for member, metrics in self._executor.map(self._read, self.devices):
+            if metrics is None:
+                continue
+            state = metrics.state_dict()
+            if member.settings.get("derived"):
+                state.update(member.device.derived_metrics(metrics))
+            send(member.settings.combined_state_topic, dumps(state), metrics.time)
+            member.published += 1
+            published += 1
+        return published
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return the published and failed cycles of each device, keyed by device id."""
+        return {
+            member.device.device_id: {"published": member.published, "errors": member.errors}
+            for member in self.devices
+        }
+
+    def close(self):
+        """Stop the reading threads."""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,79 @@
+"""
+Drives the GPIO output pins that may be switched remotely.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import threading
+from typing import Dict, Iterable
+
+# Payloads accepted as on and off
+ON = {b"1", b"on", b"true", b"high"}
+OFF = {b"0", b"off", b"false", b"low"}
+
+
+def parse_level(payload: bytes) -> bool:
+    """
+    Return the level requested by a payload such as "1", "on" or "false".
+
+    Raises
+    ------
+    ValueError
+        When the payload is not a level.
+    """
+    value = payload.strip().lower()
+    if value in ON:
+        return True
+    if value in OFF:
+        return False
+    raise ValueError(f"Not an on/off value: {payload!r}")
+
+
+class GpioOutputs:
+    """
+    A fixed set of BCM pins driven as outputs through RPi.GPIO.
+
+    Only the configured pins can be switched, and each is set up as an output
+    on first use. RPi.GPIO is imported then, so the rest of the program runs
+    on machines without it.
+    """
+
+    def __init__(self, pins: Iterable[int]):
+        """
+        Parameters
+        ----------
+        pins
+            The BCM numbers of the pins that may be switched.
+        """
+        self.pins = frozenset(int(pin) for pin in pins)
+        self.levels: Dict[int, bool] = {}
+        self._gpio = None
+        self._lock = threading.Lock()
+
+    def set(self, pin: int, level: bool):
+        """
+        Drive a pin high or low.
+
+        Raises
+        ------
+        ValueError
+            When the pin is not one of the configured pins.
+        """
+        if pin not in self.pins:
+            raise ValueError(f"GPIO {pin} is not in the configured pins {sorted(self.pins)}")
+        with self._lock:
+            if self._gpio is None:
+                import RPi.GPIO as GPIO
+
+                GPIO.setmode(GPIO.BCM)
+                self._gpio = GPIO
+            if pin not in self.levels:
+                self._gpio.setup(pin, self._gpio.OUT)
+            self._gpio.output(pin, level)
+            self.levels[pin] = level
+
+    def close(self):
+        """Release the pins that were set up."""
+        with self._lock:
+            if self._gpio is not None and self.levels:
+                self._gpio.cleanup(list(self.levels))
+            self.levels.clear()
@@ -0,0 +1,198 @@
+"""
+High-rate sampling into a fixed-size ring buffer with aggregated statistics.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import threading
+import time
+from typing import Callable, Dict, Sequence, Tuple
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    A fixed-size, array-backed ring buffer of multi-channel samples.
+
+    The storage is allocated once; appending a sample only writes into the
+    preallocated row, so the sampling loop does not allocate per sample.
+    When the buffer is full the oldest samples are overwritten.
+    """
+
+    def __init__(self, channels: Sequence[str], capacity: int):
+        """
+        Parameters
+        ----------
+        channels
+            The name of each column of a sample.
+        capacity
+            The maximum number of samples kept.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.channels = tuple(channels)
+        self.capacity = capacity
+        self._data = np.zeros((capacity, len(self.channels)), dtype=np.float64)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._index = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, values: Sequence[float], timestamp: float):
+        """Store one sample, overwriting the oldest one when full."""
+        self._data[self._index] = values
+        self._times[self._index] = timestamp
+        self._index = (self._index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def clear(self):
+        """Forget every stored sample without releasing the storage."""
+        self._index = 0
+        self._count = 0
+
+    def span(self) -> Tuple[float, float]:
+        """Return the (oldest, newest) timestamps of the stored samples."""
+        if self._count == 0:
+            return 0.0, 0.0
+        valid = self._times[: self._count]
+        return float(valid.min()), float(valid.max())
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Return a view of the stored samples of each channel."""
+        data = self._data[: self._count]
+        return {channel: data[:, i] for i, channel in enumerate(self.channels)}
+
+    def aggregate(
+        self, derive: Callable[[Dict[str, np.ndarray]], Dict[str, np.ndarray]] | None = None
+    ) -> Dict[str, Dict[str, float]] | None:
+        """
+        Compute the statistics of every channel over the stored samples.
+
+        Parameters
+        ----------
+        derive
+            Computes extra channels from the stored columns in one vectorized
+            call; their statistics are included in the result.
+
+        Returns
+        -------
+        Dict[str, Dict[str, float]] | None
+            Channel -> {"mean", "min", "max", "stddev", "count"}, or None when
+            the buffer is empty. Sample order does not matter, so the whole
+            valid region is reduced in one vectorized pass per statistic.
+        """
+        if self._count == 0:
+            return None
+        data = self._data[: self._count]
+        channels = self.channels
+        if derive is not None:
+            extra = derive(self.columns())
+            channels = channels + tuple(extra)
+            data = np.column_stack([data] + [np.broadcast_to(column, self._count) for column in extra.values()])
+        mean = data.mean(axis=0)
+        low = data.min(axis=0)
+        high = data.max(axis=0)
+        stddev = data.std(axis=0)
+        return {
+            channel: {
+                "mean": float(mean[i]),
+                "min": float(low[i]),
+                "max": float(high[i]),
+                "stddev": float(stddev[i]),
+                "count": self._count,
+            }
+            for i, channel in enumerate(channels)
+        }
+
+
+class HighRateSampler:
+    """
+    Calls a read function at a fixed rate on a background thread and stores
+    the results in a `RingBuffer`.
+    """
+
+    def __init__(
+        self,
+        read: Callable[[], Sequence[float]],
+        channels: Sequence[str],
+        rate_hz: float,
+        capacity: int,
+    ):
+        """
+        Parameters
+        ----------
+        read
+            Returns one value per channel.
+        channels
+            The channel names, in the order returned by `read`.
+        rate_hz
+            The sampling rate.
+        capacity
+            The ring buffer size. Size it for at least one publish interval.
+        """
+        if rate_hz <= 0:
+            raise ValueError("rate_hz must be positive")
+        self.read = read
+        self.period = 1.0 / rate_hz
+        self.buffer = RingBuffer(channels, capacity)
+        self.errors = 0
+        self.overruns = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Start the sampling thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="highrate", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sampling thread and wait for it to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                values = self.read()
+            except Exception:
+                self.errors += 1
+            else:
+                with self._lock:
+                    self.buffer.append(values, time.time())
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # The read took longer than a period: skip ahead instead of bursting
+                self.overruns += 1
+                next_tick = time.monotonic()
+                continue
+            self._stop.wait(delay)
+
+    def drain(
+        self, derive: Callable[[Dict[str, np.ndarray]], Dict[str, np.ndarray]] | None = None
+    ) -> Dict[str, Dict[str, float]] | None:
+        """
+        Aggregate the samples taken since the previous call and reset the buffer.
+
+        Parameters
+        ----------
+        derive
+            See `RingBuffer.aggregate`.
+
+        Returns
+        -------
+        Dict[str, Dict[str, float]] | None
+            See `RingBuffer.aggregate`.
+        """
+        with self._lock:
+            stats = self.buffer.aggregate(derive)
+            self.buffer.clear()
+        return stats
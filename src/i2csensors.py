@@ -0,0 +1,250 @@
+"""
+Direct I2C drivers for the SenseHat HTS221 humidity and LPS25H pressure sensors.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import struct
+import threading
+from typing import Dict, List, Tuple
+
+try:
+    from smbus2 import SMBus
+except ImportError:  # pragma: no cover - depends on the platform
+    try:
+        from smbus import SMBus
+    except ImportError:
+        SMBus = None
+
+# Setting the MSB of the register address enables auto-increment on both chips
+AUTO_INCREMENT = 0x80
+
+HTS221_ADDRESS = 0x5F  # I2CHumidityAddress=95 in RTIMULib.ini
+HTS221_WHO_AM_I = 0xBC
+LPS25H_ADDRESS = 0x5C  # I2CPressureAddress=92 in RTIMULib.ini
+LPS25H_WHO_AM_I = 0xBD
+
+REG_WHO_AM_I = 0x0F
+
+
+def open_bus(bus: int = 1):
+    """
+    Open an i2c-dev bus.
+
+    Parameters
+    ----------
+    bus
+        The bus number, 1 on every Raspberry Pi with a 40-pin header.
+
+    Returns
+    -------
+    SMBus
+        The open bus handle. Drivers sharing it must share one lock, see
+        `HTS221`.
+    """
+    if SMBus is None:
+        raise ImportError("smbus2 (or smbus) is required for the I2C driver")
+    return SMBus(bus)
+
+
+class MemoryBus:
+    """
+    An in-memory stand-in for an SMBus handle, holding one 256-byte register
+    map per device address. Counts transactions so tests and benchmarks can
+    check how many bus round trips a read costs.
+    """
+
+    def __init__(self):
+        self.registers: Dict[int, bytearray] = {}
+        self.transactions = 0
+
+    def device(self, address: int) -> bytearray:
+        """Return the register map of a device, creating it if needed."""
+        return self.registers.setdefault(address, bytearray(256))
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        self.transactions += 1
+        return self.device(address)[register & 0x7F]
+
+    def write_byte_data(self, address: int, register: int, value: int):
+        self.transactions += 1
+        self.device(address)[register & 0x7F] = value & 0xFF
+
+    def read_i2c_block_data(self, address: int, register: int, length: int) -> List[int]:
+        self.transactions += 1
+        start = register & 0x7F
+        return list(self.device(address)[start:start + length])
+
+    def close(self):
+        pass
+
+
+class HTS221:
+    """
+    The HTS221 relative humidity and temperature sensor.
+
+    The factory calibration coefficients are read once and cached; every
+    measurement is then a single 4-byte burst read of the output registers.
+
+    Every transfer holds `lock`. smbus selects the chip with a separate
+    I2C_SLAVE ioctl before each transfer, and the ioctl releases the GIL, so
+    drivers sharing a bus handle must share the lock: otherwise a thread can
+    read the registers of the chip another thread just selected.
+    """
+
+    REG_CTRL_REG1 = 0x20
+    REG_HUMIDITY_OUT_L = 0x28
+    REG_CALIB_0 = 0x30
+
+    def __init__(self, bus, address: int = HTS221_ADDRESS, lock=None):
+        """
+        Parameters
+        ----------
+        bus
+            An open SMBus handle, or a `MemoryBus`.
+        address
+            The I2C address of the sensor.
+        lock
+            The lock of the bus handle, shared with the other drivers on it;
+            by default the driver's own.
+        """
+        self.bus = bus
+        self.address = address
+        self.lock = lock or threading.Lock()
+        self._calibration: Tuple[float, float, float, float, float, float, float, float] | None = None
+        with self.lock:
+            # Power on, block data update, 12.5 Hz output data rate
+            self.bus.write_byte_data(self.address, self.REG_CTRL_REG1, 0x87)
+
+    def who_am_i(self) -> int:
+        """Return the WHO_AM_I register, 0xBC for a HTS221."""
+        with self.lock:
+            return self.bus.read_byte_data(self.address, REG_WHO_AM_I)
+
+    def calibration(self):
+        """Read the calibration registers on first use and return the cached values."""
+        with self.lock:
+            return self._load_calibration()
+
+    def _load_calibration(self):
+        # Called with the lock held
+        if self._calibration is None:
+            raw = bytes(
+                self.bus.read_i2c_block_data(
+                    self.address, self.REG_CALIB_0 | AUTO_INCREMENT, 16
+                )
+            )
+            h0_rh = raw[0] / 2.0
+            h1_rh = raw[1] / 2.0
+            t0_degc = (((raw[5] & 0x03) << 8) | raw[2]) / 8.0
+            t1_degc = (((raw[5] & 0x0C) << 6) | raw[3]) / 8.0
+            h0_t0_out, = struct.unpack_from("<h", raw, 6)
+            h1_t0_out, = struct.unpack_from("<h", raw, 10)
+            t0_out, t1_out = struct.unpack_from("<hh", raw, 12)
+            self._calibration = (
+                h0_rh, h1_rh, h0_t0_out, h1_t0_out, t0_degc, t1_degc, t0_out, t1_out
+            )
+        return self._calibration
+
+    def recalibrate(self):
+        """Drop the cached calibration; the next read loads it from the sensor again."""
+        self._calibration = None
+
+    def read(self) -> Tuple[float, float]:
+        """
+        Read humidity and temperature with one burst read.
+
+        Returns
+        -------
+        Tuple[float, float]
+            The relative humidity in % and the temperature in degrees Celsius.
+        """
+        with self.lock:
+            h0_rh, h1_rh, h0_t0_out, h1_t0_out, t0_degc, t1_degc, t0_out, t1_out = self._load_calibration()
+            raw = bytes(
+                self.bus.read_i2c_block_data(
+                    self.address, self.REG_HUMIDITY_OUT_L | AUTO_INCREMENT, 4
+                )
+            )
+        h_out, t_out = struct.unpack("<hh", raw)
+        humidity = h0_rh + (h_out - h0_t0_out) * (h1_rh - h0_rh) / (h1_t0_out - h0_t0_out)
+        temperature = t0_degc + (t_out - t0_out) * (t1_degc - t0_degc) / (t1_out - t0_out)
+        return min(max(humidity, 0.0), 100.0), temperature
+
+    def get_humidity(self) -> float:
+        """Get the relative humidity in %."""
+        return self.read()[0]
+
+    def get_temperature(self) -> float:
+        """Get the temperature in degrees Celsius."""
+        return self.read()[1]
+
+
+class LPS25H:
+    """
+    The LPS25H pressure and temperature sensor.
+
+    Its output is factory trimmed, so every measurement is a single 5-byte
+    burst read of the pressure and temperature registers. Transfers hold
+    `lock`, as in `HTS221`.
+    """
+
+    REG_RES_CONF = 0x10
+    REG_CTRL_REG1 = 0x20
+    REG_CTRL_REG2 = 0x21
+    REG_PRESS_OUT_XL = 0x28
+    REG_FIFO_CTRL = 0x2E
+
+    def __init__(self, bus, address: int = LPS25H_ADDRESS, lock=None):
+        """
+        Parameters
+        ----------
+        bus
+            An open SMBus handle, or a `MemoryBus`.
+        address
+            The I2C address of the sensor.
+        lock
+            The lock of the bus handle, shared with the other drivers on it;
+            by default the driver's own.
+        """
+        self.bus = bus
+        self.address = address
+        self.lock = lock or threading.Lock()
+        with self.lock:
+            # Same set-up as RTIMULib: power on, 25 Hz, block data update,
+            # 32-sample internal averaging with the FIFO in mean mode
+            self.bus.write_byte_data(self.address, self.REG_CTRL_REG1, 0xC4)
+            self.bus.write_byte_data(self.address, self.REG_RES_CONF, 0x05)
+            self.bus.write_byte_data(self.address, self.REG_FIFO_CTRL, 0xC0)
+            self.bus.write_byte_data(self.address, self.REG_CTRL_REG2, 0x40)
+
+    def who_am_i(self) -> int:
+        """Return the WHO_AM_I register, 0xBD for a LPS25H."""
+        with self.lock:
+            return self.bus.read_byte_data(self.address, REG_WHO_AM_I)
+
+    def read(self) -> Tuple[float, float]:
+        """
+        Read pressure and temperature with one burst read.
+
+        Returns
+        -------
+        Tuple[float, float]
+            The pressure in hPa and the temperature in degrees Celsius.
+        """
+        with self.lock:
+            raw = bytes(
+                self.bus.read_i2c_block_data(
+                    self.address, self.REG_PRESS_OUT_XL | AUTO_INCREMENT, 5
+                )
+            )
+        pressure = int.from_bytes(raw[0:3], "little", signed=True) / 4096.0
+        temperature = 42.5 + int.from_bytes(raw[3:5], "little", signed=True) / 480.0
+        return pressure, temperature
+
+    def get_pressure(self) -> float:
+        """Get the pressure in hPa."""
+        return self.read()[0]
+
+    def get_temperature(self) -> float:
+        """Get the temperature in degrees Celsius."""
+        return self.read()[1]
@@ -0,0 +1,178 @@
+"""
+Streams accelerometer, gyroscope and magnetometer readings in preallocated blocks.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Sequence
+
+import numpy as np
+
+# Columns of an IMU block: sample time, then the x, y, z of each sensor
+IMU_CHANNELS = ("time", "ax", "ay", "az", "gx", "gy", "gz", "mx", "my", "mz")
+
+# LSM9DS1AccelSampleRate codes from RTIMULib.ini, in Hz
+LSM9DS1_ACCEL_RATES = {1: 14.9, 2: 59.5, 3: 119.0, 4: 238.0, 5: 476.0, 6: 952.0}
+
+# Where sense_hat keeps its RTIMULib settings, then the copy in this repository
+RTIMULIB_PATHS = (
+    os.path.expanduser("~/.config/sense_hat/RTIMULib.ini"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RTIMULib.ini"),
+)
+
+
+def read_settings(path: str) -> Dict[str, str]:
+    """
+    Parse an RTIMULib settings file.
+
+    Parameters
+    ----------
+    path
+        The RTIMULib.ini file.
+
+    Returns
+    -------
+    Dict[str, str]
+        The key=value pairs, without comments.
+    """
+    settings = {}
+    with open(path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            settings[key.strip()] = value.strip()
+    return settings
+
+
+def configured_sample_rate(paths: Sequence[str] = RTIMULIB_PATHS, default: float = 119.0) -> float:
+    """
+    Return the LSM9DS1 accelerometer sample rate configured for RTIMULib.
+
+    Parameters
+    ----------
+    paths
+        RTIMULib.ini files to try, in order.
+    default
+        The rate used when no file sets one.
+
+    Returns
+    -------
+    float
+        The sample rate in Hz.
+    """
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        code = read_settings(path).get("LSM9DS1AccelSampleRate")
+        if code is not None and int(code) in LSM9DS1_ACCEL_RATES:
+            return LSM9DS1_ACCEL_RATES[int(code)]
+    return default
+
+
+class ImuStreamer:
+    """
+    Reads the IMU at a fixed rate on a background thread into a preallocated
+    NumPy block and hands every full block to a callback.
+
+    The block is reused for the next batch as soon as the callback returns,
+    so the callback must encode or copy it before returning.
+    """
+
+    def __init__(
+        self,
+        read: Callable[[], Sequence[float]],
+        rate_hz: float,
+        block_size: int,
+        on_block: Callable[[np.ndarray], None],
+    ):
+        """
+        Parameters
+        ----------
+        read
+            Returns the nine values of `IMU_CHANNELS` after the time column.
+        rate_hz
+            The sampling rate.
+        block_size
+            The number of samples per block.
+        on_block
+            Called with the (block_size, 10) array when a block is full.
+        """
+        if rate_hz <= 0:
+            raise ValueError("rate_hz must be positive")
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.read = read
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.on_block = on_block
+        self.block = np.zeros((block_size, len(IMU_CHANNELS)), dtype=np.float64)
+        self.blocks = 0
+        self.errors = 0
+        self.overruns = 0
+        self._row = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Start the streaming thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="imu", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the streaming thread. A partly filled block is discarded."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        block = self.block
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                values = self.read()
+            except Exception:
+                self.errors += 1
+            else:
+                row = block[self._row]
+                row[0] = time.time()
+                row[1:] = values
+                self._row += 1
+                if self._row == len(block):
+                    self._row = 0
+                    self.blocks += 1
+                    try:
+                        self.on_block(block)
+                    except Exception:
+                        self.errors += 1
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                self.overruns += 1
+                next_tick = time.monotonic()
+                continue
+            self._stop.wait(delay)
+
+
+def encode_block(block: np.ndarray, rate_hz: float) -> Dict:
+    """
+    Build the batched message of one IMU block.
+
+    Parameters
+    ----------
+    block
+        A full block from `ImuStreamer`.
+    rate_hz
+        The nominal sampling rate.
+
+    Returns
+    -------
+    Dict
+        {"rate": Hz, "columns": IMU_CHANNELS, "samples": [[...], ...]}.
+    """
+    return {"rate": rate_hz, "columns": IMU_CHANNELS, "samples": block.tolist()}
@@ -0,0 +1,185 @@
+"""
+Decodes raw frames for the 8x8 LED matrix and writes them at a limited frame rate.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+PIXELS = 64
+# 8 bits per channel, row by row from the top left
+RGB_FRAME_SIZE = PIXELS * 3
+# 16 bits per pixel, big-endian 5-6-5, as in the SenseHat framebuffer
+RGB565_FRAME_SIZE = PIXELS * 2
+
+
+def decode_frame(payload: bytes) -> List[List[int]]:
+    """
+    Decode a raw frame into the pixel list of `SenseHat.set_pixels()`.
+
+    Parameters
+    ----------
+    payload
+        192 bytes of RGB or 128 bytes of RGB565.
+
+    Returns
+    -------
+    List[List[int]]
+        64 [r, g, b] pixels.
+
+    Raises
+    ------
+    ValueError
+        When the payload has neither size.
+    """
+    if len(payload) == RGB_FRAME_SIZE:
+        return [list(payload[i : i + 3]) for i in range(0, RGB_FRAME_SIZE, 3)]
+    if len(payload) == RGB565_FRAME_SIZE:
+        pixels = []
+        for i in range(0, RGB565_FRAME_SIZE, 2):
+            value = (payload[i] << 8) | payload[i + 1]
+            red = (value >> 11) & 0x1F
+            green = (value >> 5) & 0x3F
+            blue = value & 0x1F
+            # Scale to 8 bits, repeating the high bits into the low ones
+            pixels.append([(red << 3) | (red >> 2), (green << 2) | (green >> 4), (blue << 3) | (blue >> 2)])
+        return pixels
+    raise ValueError(f"A frame has {RGB_FRAME_SIZE} (RGB) or {RGB565_FRAME_SIZE} (RGB565) bytes, not {len(payload)}")
+
+
+def to_framebuffer(payload: bytes) -> bytes:
+    """
+    Convert a raw frame to the SenseHat framebuffer layout.
+
+    Parameters
+    ----------
+    payload
+        192 bytes of RGB or 128 bytes of big-endian RGB565.
+
+    Returns
+    -------
+    bytes
+        128 bytes of little-endian RGB565, as written to /dev/fb1.
+
+    Raises
+    ------
+    ValueError
+        When the payload has neither size.
+    """
+    if len(payload) == RGB565_FRAME_SIZE:
+        return np.frombuffer(payload, dtype=">u2").astype("<u2").tobytes()
+    if len(payload) == RGB_FRAME_SIZE:
+        rgb = np.frombuffer(payload, dtype=np.uint8).reshape(PIXELS, 3).astype(np.uint16)
+        packed = ((rgb[:, 0] >> 3) << 11) | ((rgb[:, 1] >> 2) << 5) | (rgb[:, 2] >> 3)
+        return packed.astype("<u2").tobytes()
+    raise ValueError(f"A frame has {RGB_FRAME_SIZE} (RGB) or {RGB565_FRAME_SIZE} (RGB565) bytes, not {len(payload)}")
+
+
+def framebuffer_pixels(frame: bytes) -> List[List[int]]:
+    """Return the 64 [r, g, b] pixels of a framebuffer frame, see `to_framebuffer`."""
+    return decode_frame(np.frombuffer(frame, dtype="<u2").astype(">u2").tobytes())
+
+
+class FrameWriter:
+    """
+    Shows streamed frames on the LED matrix at no more than `max_fps`.
+
+    Frames are converted on arrival into a back buffer; a writer thread swaps
+    it with the front buffer and writes that one. A frame arriving before
+    the previous one was written replaces it, so a stream faster than the
+    display is coalesced to the latest frame instead of queueing.
+    """
+
+    def __init__(self, write: Callable[[bytes], None], max_fps: float = 30.0):
+        """
+        Parameters
+        ----------
+        write
+            Writes one 128-byte framebuffer frame, e.g. `SensorBackend.write_frame`.
+        max_fps
+            The maximum number of frames written per second.
+        """
+        if max_fps <= 0:
+            raise ValueError("max_fps must be positive")
+        self.write = write
+        self.period = 1.0 / max_fps
+        self.received = 0
+        self.written = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._back = bytearray(RGB565_FRAME_SIZE)
+        self._front = bytearray(RGB565_FRAME_SIZE)
+        self._pending = False
+        self._ready = threading.Condition()
+        self._stop = False
+        self._thread: threading.Thread | None = None
+
+    def submit(self, payload: bytes):
+        """
+        Queue a raw frame, replacing a frame not written yet. Does not block.
+
+        Raises
+        ------
+        ValueError
+            When the payload is not a frame, see `to_framebuffer`.
+        """
+        frame = to_framebuffer(payload)
+        with self._ready:
+            self.received += 1
+            if self._pending:
+                self.coalesced += 1
+            self._back[:] = frame
+            self._pending = True
+            self._ready.notify()
+
+    def start(self):
+        """Start the writer thread."""
+        self._stop = False
+        self._thread = threading.Thread(target=self._loop, name="led-frames", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread; a frame not written yet is discarded."""
+        with self._ready:
+            self._stop = True
+            self._ready.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        next_frame = time.monotonic()
+        while True:
+            with self._ready:
+                while not self._pending and not self._stop:
+                    self._ready.wait()
+                if self._stop:
+                    return
+                self._front, self._back = self._back, self._front
+                self._pending = False
+            try:
+                self.write(bytes(self._front))
+                self.written += 1
+            except Exception as ex:
+                self.errors += 1
+                log.warning("Writing a frame failed: %s", ex)
+            # Frames arriving meanwhile are coalesced into the back buffer
+            next_frame = max(next_frame + self.period, time.monotonic())
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the frame counters."""
+        return {
+            "received": self.received,
+            "written": self.written,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
@@ -0,0 +1,216 @@
+"""
+Structured logging through a background queue, with per-event rate limiting and sampling.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, TextIO
+
+# Every LogRecord has these attributes: the others were passed as `extra` and are fields
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "event"}
+
+
+def fields(record: logging.LogRecord) -> Dict[str, Any]:
+    """Return the structured fields of a record: its `extra` values, except `event`."""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class TextFormatter(logging.Formatter):
+    """One line per record: `[<time>] <LEVEL> [<event>] <message> key=value ...`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = (
+            f"[{datetime.datetime.fromtimestamp(record.created)}] {record.levelname} "
+            f"[{getattr(record, 'event', record.name)}] {record.getMessage()}"
+        )
+        for key, value in fields(record).items():
+            line += f" {key}={value!r}" if isinstance(value, str) and " " in value else f" {key}={value}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the time, level, event, message and fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "event": getattr(record, "event", record.name),
+            "message": record.getMessage(),
+        }
+        document.update(fields(record))
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return json.dumps(document, ensure_ascii=False, default=str)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "seen", "suppressed")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.seen = 0
+        self.suppressed = 0
+
+
+class EventFilter(logging.Filter):
+    """
+    Rate limits and samples log records per event.
+
+    A record's event is its `event` extra, or else its logger name and
+    message template, so messages should use %-style arguments rather than
+    f-strings. Each event logs up to `burst` records at once and `rate` per
+    second after that; events listed in `sample` only log one record in n.
+    The next record of an event after some were dropped carries their
+    number as its `suppressed` field.
+
+    Errors always pass, and so does everything while disabled, e.g. at the
+    DEBUG level.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 10, sample: Mapping[str, int] | None = None,
+                 max_events: int = 1024, clock: Callable[[], float] = time.monotonic):
+        """
+        Parameters
+        ----------
+        rate
+            Records per second of each event once its burst is spent.
+        burst
+            Records of an event logged at once.
+        sample
+            One record in n is logged for these events, before rate limiting.
+        max_events
+            Events tracked; all are forgotten when more show up.
+        clock
+            Returns the current time in seconds.
+        """
+        super().__init__()
+        self.enabled = True
+        self.rate = rate
+        self.burst = burst
+        self.sample: Dict[str, int] = dict(sample or {})
+        self.max_events = max_events
+        self.clock = clock
+        self.suppressed = 0
+        self._buckets: Dict[Any, _Bucket] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is None:
+            record.event = record.name
+            key = (record.name, record.msg)
+        else:
+            key = event
+        if not self.enabled or record.levelno >= logging.ERROR:
+            return True
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_events:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = _Bucket(float(self.burst), now)
+            bucket.seen += 1
+            bucket.tokens = min(float(self.burst), bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            if (bucket.seen - 1) % self.sample.get(record.event, 1) or bucket.tokens < 1.0:
+                bucket.suppressed += 1
+                self.suppressed += 1
+                return False
+            bucket.tokens -= 1.0
+            if bucket.suppressed:
+                record.suppressed = bucket.suppressed
+                bucket.suppressed = 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records when its bounded queue is full, instead of raising."""
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Routes the root logger through a bounded queue to a thread writing a stream.
+
+    Logging calls only filter the record, format its message and queue it:
+    the writes, flushed one by one, happen on the listener's thread.
+    """
+
+    def __init__(self, stream: TextIO | None = None, queue_size: int = 10000):
+        """
+        Parameters
+        ----------
+        stream
+            Where the records are written, by default stdout.
+        queue_size
+            Records waiting for the writer; newer ones are dropped beyond it.
+        """
+        self.filter = EventFilter()
+        self.handler = logging.StreamHandler(stream or sys.stdout)
+        self.handler.setFormatter(TextFormatter())
+        self.queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.queue_handler.addFilter(self.filter)
+        self.listener = logging.handlers.QueueListener(self.queue_handler.queue, self.handler)
+        self._started = False
+
+    def configure(self, section: Mapping[str, Any], sample: Mapping[str, int] | None = None):
+        """
+        Apply the 'logging' section of the configuration; it can be applied again on reload.
+
+        Parameters
+        ----------
+        section
+            'level' ("debug", "info", "warning" or "error", default "info"),
+            'format' ("text" or "json"), 'rate' and 'burst' per event, and
+            'sample', one record in n per event; see `EventFilter`. The
+            DEBUG level logs every record.
+        sample
+            The default sampling of events, which 'sample' overrides per event.
+        """
+        level = logging.getLevelName(str(section.get("level", "info")).upper())
+        logging.getLogger().setLevel(level)
+        self.handler.setFormatter(JsonFormatter() if section.get("format") == "json" else TextFormatter())
+        self.filter.enabled = level > logging.DEBUG
+        self.filter.rate = float(section.get("rate", 1.0))
+        self.filter.burst = int(section.get("burst", 10))
+        self.filter.sample = {**(sample or {}), **section.get("sample", {})}
+
+    def start(self):
+        """Start the writer thread and route the root logger to it."""
+        if not self._started:
+            logging.getLogger().addHandler(self.queue_handler)
+            self.listener.start()
+            self._started = True
+
+    def stop(self):
+        """Write the queued records and stop the writer thread."""
+        if self._started:
+            logging.getLogger().removeHandler(self.queue_handler)
+            self.listener.stop()
+            self._started = False
+
+    def stats(self) -> Dict[str, int]:
+        """Return the records suppressed by the filter and dropped on a full queue."""
+        return {"suppressed": self.filter.suppressed, "dropped": self.queue_handler.dropped}
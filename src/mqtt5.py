@@ -0,0 +1,128 @@
+"""
+MQTT v5 publish properties: topic aliases, message expiry and user properties.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import copy
+import datetime
+import itertools
+import threading
+from typing import Dict, Tuple
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+class TopicAliases:
+    """
+    Assigns MQTT v5 topic aliases so that repeated publishes to a topic send
+    a 2-byte alias instead of the topic string.
+
+    The first publish to a topic carries the topic and the alias; once it has
+    been handed to the client, later publishes carry only the alias. Aliases
+    only live as long as a connection, so `reset()` must be called from
+    on_connect with the broker's TopicAliasMaximum. Until then, and when the
+    broker allows no aliases, topics are sent in full.
+
+    Only use aliases for QoS 0 messages: a QoS 1 or 2 message that paho
+    resends after a reconnect would refer to an alias the new connection
+    does not know.
+    """
+
+    def __init__(self):
+        self.maximum = 0
+        self.assigned = 0
+        self.hits = 0
+        self._aliases: Dict[str, int] = {}
+        self._established: set = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def reset(self, maximum: int):
+        """Forget every alias: a new connection allows up to `maximum` aliases."""
+        with self._lock:
+            self.maximum = maximum
+            self._aliases.clear()
+            self._established.clear()
+            self._generation += 1
+
+    def resolve(self, topic: str) -> Tuple[str, int | None, tuple | None]:
+        """
+        Decide how to address a publish.
+
+        Returns
+        -------
+        Tuple[str, int | None, tuple | None]
+            The topic to send ("" when the alias alone is enough), the alias
+            to send, if any, and a token for `confirm()` when this publish
+            establishes the alias.
+        """
+        with self._lock:
+            alias = self._aliases.get(topic)
+            if alias is None:
+                if len(self._aliases) >= self.maximum:
+                    return topic, None, None
+                alias = len(self._aliases) + 1
+                self._aliases[topic] = alias
+                self.assigned += 1
+                return topic, alias, (self._generation, topic)
+            if topic in self._established:
+                self.hits += 1
+                return "", alias, None
+            # Another thread is still establishing it: send in full meanwhile
+            return topic, None, None
+
+    def apply(self, topic: str, qos: int, properties: Properties | None) -> Tuple[str, Properties | None, tuple | None]:
+        """
+        Address a publish by alias when possible.
+
+        Returns
+        -------
+        Tuple[str, Properties | None, tuple | None]
+            The topic and properties to send, and the token to `confirm()`
+            once the client accepted the message.
+        """
+        if qos > 0:
+            return topic, properties, None
+        topic, alias, token = self.resolve(topic)
+        if alias is None:
+            return topic, properties, None
+        aliased = copy.copy(properties) if properties is not None else Properties(PacketTypes.PUBLISH)
+        aliased.TopicAlias = alias
+        return topic, aliased, token
+
+    def confirm(self, token: tuple):
+        """Mark an alias as known by the broker once its first publish was handed to the client."""
+        generation, topic = token
+        with self._lock:
+            if generation == self._generation:
+                self._established.add(topic)
+
+
+class PublishProperties:
+    """
+    Builds the MQTT v5 properties of telemetry publishes: message expiry, so
+    the broker drops stale backlog, and a sequence number and sample time as
+    user properties, so they do not need to be in the payload.
+    """
+
+    def __init__(self, expiry: int | None = None):
+        """
+        Parameters
+        ----------
+        expiry
+            Message expiry interval in seconds, or None to keep messages
+            until they are delivered.
+        """
+        self.expiry = expiry
+        self._sequence = itertools.count(1)
+
+    def build(self, sample_time: float | None = None) -> Properties:
+        """Return the properties of the next telemetry message."""
+        properties = Properties(PacketTypes.PUBLISH)
+        if self.expiry:
+            properties.MessageExpiryInterval = int(self.expiry)
+        properties.UserProperty = ("seq", str(next(self._sequence)))
+        if sample_time is not None:
+            properties.UserProperty = ("time", datetime.datetime.fromtimestamp(sample_time).isoformat())
+        return properties
@@ -0,0 +1,130 @@
+"""
+Vectorized psychrometric calculations for temperature, humidity and pressure samples.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+
+Every function accepts scalars or NumPy arrays of the same shape and returns
+the same kind. The formulas are the ones the clock display has always used.
+"""
+from typing import Dict
+
+import numpy as np
+
+# Rothfusz regression coefficients of the heat index, in Fahrenheit
+HEAT_INDEX_COEFFICIENTS = (
+    -42.379, 2.04901523, 10.14333127, -0.22475541, -6.83783e-03,
+    -5.481717e-02, 1.22874e-03, 8.5282e-04, -1.99e-06,
+)
+
+# Names of the values returned by `compute()`
+DERIVED = ("dew_point", "heat_index", "vapor_pressure", "wet_bulb", "delta_t")
+
+
+def fahrenheit(temperature):
+    """Convert degrees Celsius to Fahrenheit."""
+    return np.asarray(temperature) * 9 / 5 + 32
+
+
+def heat_index(temperature, humidity):
+    """
+    Return the heat index ("feels like") in degrees Celsius.
+
+    Parameters
+    ----------
+    temperature
+        The temperature in degrees Celsius.
+    humidity
+        The relative humidity in %.
+    """
+    c = HEAT_INDEX_COEFFICIENTS
+    tf = fahrenheit(temperature)
+    h = np.asarray(humidity)
+    t2 = tf * tf
+    h2 = h * h
+    hi = (
+        c[0] + c[1] * tf + c[2] * h + c[3] * tf * h + c[4] * t2
+        + c[5] * h2 + c[6] * t2 * h + c[7] * tf * h2 + c[8] * t2 * h2
+    )
+    return (hi - 32) * 5 / 9
+
+
+def dew_point(temperature, humidity):
+    """
+    Return the dew point in degrees Celsius.
+
+    Parameters
+    ----------
+    temperature
+        The temperature in degrees Celsius.
+    humidity
+        The relative humidity in %.
+    """
+    t = np.asarray(temperature)
+    dryness = 1 - 0.01 * np.asarray(humidity)
+    return (
+        t
+        - (14.55 + 0.114 * t) * dryness
+        - ((2.5 + 0.007 * t) * dryness) ** 3
+        - (15.9 + 0.117 * t) * dryness ** 14
+    )
+
+
+def vapor_pressure(dew):
+    """Return the vapor pressure in millibar from the dew point in degrees Celsius."""
+    dew = np.asarray(dew)
+    return 6.11 * 10 ** (7.5 * dew / (237.7 + dew))
+
+
+def wet_bulb(temperature, pressure, dew, vapor=None):
+    """
+    Return the wet-bulb temperature in degrees Celsius.
+
+    Parameters
+    ----------
+    temperature
+        The temperature in degrees Celsius.
+    pressure
+        The air pressure in millibar.
+    dew
+        The dew point, see `dew_point()`.
+    vapor
+        The vapor pressure, computed from `dew` when not given.
+    """
+    t = np.asarray(temperature)
+    dew = np.asarray(dew)
+    if vapor is None:
+        vapor = vapor_pressure(dew)
+    gamma = 0.00066 * np.asarray(pressure)
+    slope = 4098 * vapor / (dew + 237.7) ** 2
+    return (gamma * t + slope * dew) / (gamma + slope)
+
+
+def compute(temperature, humidity, pressure) -> Dict[str, np.ndarray]:
+    """
+    Compute every derived value, sharing the dew point and vapor pressure.
+
+    Parameters
+    ----------
+    temperature
+        The temperature in degrees Celsius.
+    humidity
+        The relative humidity in %.
+    pressure
+        The air pressure in millibar.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        The values named in `DERIVED`. Delta-T is the temperature minus the
+        wet-bulb temperature.
+    """
+    dew = dew_point(temperature, humidity)
+    vapor = vapor_pressure(dew)
+    wet = wet_bulb(temperature, pressure, dew, vapor)
+    return {
+        "dew_point": dew,
+        "heat_index": heat_index(temperature, humidity),
+        "vapor_pressure": vapor,
+        "wet_bulb": wet,
+        "delta_t": np.asarray(temperature) - wet,
+    }
@@ -1,112 +1,73 @@
 #!/usr/bin/python3
+import atexit
+from concurrent.futures import Future
 import datetime
 import json
+import logging
 import os
-from struct import Struct
 import sys
 import time
-from typing import Dict
+from typing import Callable, Dict, List, Tuple
 import ssl
 #from aiohttp import JsonPayload, Payload
 import paho.mqtt.client
 from paho.mqtt.client import MQTTMessageInfo, Client
 from paho.mqtt.client import MQTTMessage
 #from pydantic import Json
+from binencoder import StatsEncoder, TableEncoder
+from binformat import FormatError, decode, is_binary
+from commands import CommandDispatcher
+from deadband import ChangeFilter
+from discovery import HA_STATUS_TOPIC, DiscoveryCache, discovery_messages
+from fanout import BrokerLink, FanoutPublisher, create_client
+from gateway import Gateway
+from gpio import GpioOutputs, parse_level
+from highrate import HighRateSampler
+from imu import IMU_CHANNELS, ImuStreamer, configured_sample_rate, encode_block
+from ledmatrix import FrameWriter
+from logs import LogPipeline
+from mqtt5 import PublishProperties, TopicAliases
+from psychrometrics import DERIVED
+from publisher import AsyncPublisher
+from reading import Reading
+from runtime import AsyncRuntime
+from sampler import IncompleteSample
 from sensehatdevice import SenseHatDevice
+from serialization import dumps
+from settings import ConfigError, ConfigWatcher, Settings, compile_settings, load_settings, thaw
+from spool import Backfill, SegmentLog
+from supervisor import ConnectionSupervisor
 
 
-def load_configuration() -> Dict[str, str | Dict[str, str]]:
-    """
-    Load the configuration from the 'config.json' file.
-
-    Returns
-    -------
-    Dict[str, str | Dict[str, str]]
-    """
-    # Get the path to the config file
-    cfg_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
-
-    # Check if the config file exists
-    if not os.path.exists(cfg_path):
-        sys.stderr.write("Configuration file " + cfg_path + " not found.\n")
-        sys.exit(1)
-
-    # Load the configuration from the file
-    content = "{}"
-    with open(cfg_path, "r", encoding="utf-8") as fp:
-        content = fp.read()
-        if content == "":
-            sys.stderr.write("Configuration file " + cfg_path + " is empty.\n")
-            sys.exit(1)
-
-    init_config = json.loads(content)
-    return init_config
+# The configuration file, next to this script
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
 
+# Settings that are only read at startup: changing them needs a restart
+RESTART_KEYS = (
+    "id", "broker", "client", "backend", "i2c", "sampling", "sample_rate_hz", "imu",
+    "report_by_exception", "publish", "spool", "reconnect", "runtime", "brokers", "mqtt5",
+    "client_id", "device_id", "device_name", "gateway", "commands", "led",
+)
 
-def validate_configuration(init_config: Dict[str, str | Dict[str, str]]):
-    """
-    Validate the configuration to ensure it has all the required fields.
-    """
-    # Check if 'id' field exists
-    if "id" not in init_config:
-        sys.stderr.write("No 'id' field in configuration.\n")
-        sys.exit(1)
-
-    # Check if 'broker' field exists
-    if "broker" not in init_config:
-        sys.stderr.write("No 'broker' field in configuration.\n")
-        sys.exit(1)
+# Events logged once in n at the INFO level by default, see `LogPipeline.configure`
+LOG_SAMPLE = {"reading": 10, "report": 10}
 
-    # Check if 'topics' field exists
-    if "topics" not in init_config:
-        sys.stderr.write("No 'topics' field in configuration.\n")
-        sys.exit(1)
-
-    # Check if 'seconds' field exists
-    if "seconds" not in init_config:
-        sys.stderr.write("No 'seconds' field in configuration.\n")
-        sys.exit(1)
+log = logging.getLogger("publish")
 
 
-def build_mqtt() -> paho.mqtt.client.Client:
+def load_configuration() -> Settings:
     """
-    Builds and configures an MQTT client.
+    Load, validate and compile the configuration from the 'config.json' file.
 
     Returns
     -------
-    paho.mqtt.client.Client
-        The configured MQTT client.
+    Settings
     """
-    # Generate a ClientId
-    client_id_alt = str(cfg["id"])  # type: ignore
-
-    # Load TLS certificate and key
-    # tls_context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH, cafile="../ca.crt")
-    # tls_context.load_cert_chain(certfile="../server.crt", keyfile="../server.key", password="majestic")
-    # Build the MQTT client with the generated client id, clean session, and TCP transport
-    build_client = paho.mqtt.client.Client(client_id="sensehat")
-    # Set username and password for authentication
-    username = cfg["broker"]["username"]
-    password = cfg["broker"]["password"]
-    if("" not in password):
-        build_client.username_pw_set(username, password)
-    # Configure TLS
-    if (cfg["client"]["certfile"] != ""):
-        build_client.tls_insecure_set(True)
-        build_client.tls_set(
-            certfile=cfg["client"]["certfile"],
-            keyfile=cfg["client"]["keyfile"],
-            keyfile_password=cfg["client"]["keyfile_password"],
-            ca_certs=cfg["client"]["ca_certs"],
-            tls_version=ssl.PROTOCOL_TLSv1_2,
-        )
-
-    # Configure MQTT client callbacks
-
-    build_client.on_connect = on_connect
-    build_client.on_message = on_message
-    #build_client.on_subscribe = on_subscribe
-    return build_client
+    try:
+        return load_settings(CONFIG_PATH)
+    except ConfigError as ce:
+        sys.stderr.write(f"{ce}\n")
+        sys.exit(1)
 
 
 def error_code_message(rc):
@@ -126,360 +87,1053 @@ def error_code_message(rc):
 
 def print_info(client, userdata, rc, log_header) -> None:
     """
-    Print the clientId from a paho.mqtt.client object.
-
-    Args:
-        client: The paho.mqtt.client object.
-
-    Returns:
-        None
+    Log the client, the user data and the message or result code of a
+    callback, at the DEBUG level.
 
     Parameters
     ----------
     client
+        The paho.mqtt.client object.
     userdata
-    log_header
     rc
+        The received message or the result code.
+    log_header
+        The event of the log records.
     """
-    if client is paho.mqtt.client.Client:
-        print(f"[{log_header}] Client: {client._host} - {client._client_id}")
-
-    print(f"[{log_header}] UserData: {userdata}")
-    if rc is MQTTMessage:
-        print(f"[{log_header}] Message id: {rc.mid}")
-        print(f"[{log_header}] Topic: {rc.topic}")
-        print(f"[{log_header}] Qos: {rc.qos}")
-        print(f"[{log_header}] Retain: {rc.retain}")
-        print(f"[{log_header}] Message payload: {rc.payload.decode()}")
+    if not log.isEnabledFor(logging.DEBUG):
+        # Called for every message: skip building the records
+        return
+    extra = {"event": log_header}
+    if isinstance(client, paho.mqtt.client.Client):
+        log.debug("Client: %s - %s", client._host, client._client_id, extra=extra)
+    log.debug("UserData: %s", userdata, extra=extra)
+    if isinstance(rc, MQTTMessage):
+        log.debug(
+            "Message id %s on topic %s, qos %s, retain %s: %s",
+            rc.mid, rc.topic, rc.qos, rc.retain, rc.payload.decode("utf-8", "replace"),
+            extra=extra,
+        )
+    elif rc == 0:
+        log.debug("ResultCode: %s - %s", rc, error_code_message(rc), extra=extra)
     else:
-        if rc is int(0):
-            print(f"[{log_header}] ResultCode: {rc} - {error_code_message(rc)}")
+        log.debug("Unknown rc: %s", rc, extra=extra)
+
+
+def handle_command(topic: str, payload: bytes):
+    log.info("Topic: %s", topic, extra={"event": "handle_command"})
+    log.debug("Message received: %s", payload.decode("utf-8", "replace"), extra={"event": "handle_command"})
+
+
+def log_publish_result(topic: str, msg) -> Callable[[Future], None]:
+    """Return a future callback that logs the outcome of a publish: failures as warnings, the rest at DEBUG."""
+    def done(future: Future):
+        error = future.exception()
+        if error is not None:
+            log.warning("%s. Message: %s", error, msg, extra={"event": "publish", "topic": topic})
         else:
-            print(f"[{log_header}] Unknown rc: {rc}")
-
-
-def on_connect(client: paho.mqtt.client.Client, userdata, flags, rc: int):
-    if rc == int(0):
-        print("[on_connect] Connected al broker MQTT")
-        print_info(client, userdata, rc, "on_connect")
-        # Suscribirse a un tema específico
-        client.subscribe(cfg["topics"]["device"] + cfg["topics"]["status"])
-        client.subscribe('homeassistant/status')
-        # mqtt_client.subscribe("homeassistant/status")
-        print("[on_connect] Subscribed to homeassistant/status topic.")
-        # mqtt_client.subscribe("homeassistant/nodered/status")
-        print(f'[on_connect] Subscribed to {cfg["topics"]["device"] + cfg["topics"]["status"]} topic.')
-
-        #online_topic = cfg["id"] + cfg["topics"]["availability"]
-        online_topic = cfg["topics"]["device"] + cfg["topics"]["availability"]
-        client.publish(online_topic, "online")
-        mqtt_client.publish(online_topic, "online")
-
-        print("[on_connect] Published to " + online_topic+ " topic.")
-        mqtt_client.publish(cfg["topics"]["pressure"] + cfg["topics"]["config"], json.dumps(sensehat_device.message_config_pressure("pressure")))
-        print(
-            "[on_connect] Published to "
-            + cfg["topics"]["pressure"]
-            + cfg["topics"]["config"]
-            + " topic."
-        )
-        mqtt_client.publish(cfg["topics"]["humidity"] + cfg["topics"]["config"],json.dumps(sensehat_device.message_config_humidity("humidity")), qos=1, retain=True)
-        print(
-            f"[on_connect] Published to "
-            + cfg["topics"]["humidity"]
-            + cfg["topics"]["config"]
-            + " topic."
-        )
-        mqtt_client.publish(
-            cfg["topics"]["temperature"] + cfg["topics"]["config"],
-            json.dumps(sensehat_device.message_config_temperature("temperature"))
-        )
-        print(
-            f"[on_connect] Published to "
-            + cfg["topics"]["temperature"]
-            + cfg["topics"]["config"]
-            + " topic."
-        )
-    # elif rc != int(0) and rc[0] != int(0):
-    #     print(f"[on_connect] Connection error. Return Code: {error_code_message(rc)}")
-    #else:
-        # print(
-        #     f"[on_connect] Unexpected Result Code: is int: {rc is int} - {type(rc)} {rc}"
-        # )
-
-
-# Function to handle the connection with the broker MQTT
-def on_subscribe(client, userdata, flags, rc: int):
-    print("[on_subscribe] On Subscribe event! Sending configurations!")
-    print_info(client, userdata, rc, "on_subscribe")
-    if rc == int(0) or rc[0] == int(0):
-        mqtt_client.publish(
-            cfg["topics"]["pressure"] + cfg["topics"]["config"],
-            json.dumps(sensehat_device.message_config_pressure("pressure"))
+            log.debug(
+                "Message `%s` to topic `%s` published in %.1f ms.", msg, topic, future.result() * 1000,
+                extra={"event": "publish"},
+            )
+    return done
+
+
+def settle(change_filter: ChangeFilter | None, name: str, future: Future | None):
+    """
+    Make the filtered values just published the reference of the
+    report-by-exception filter, unless the publish failed at once, e.g. while
+    disconnected without a spool: they are then compared again next cycle.
+    """
+    if change_filter is None:
+        return
+    if future is not None and future.done() and future.exception() is not None:
+        change_filter.rollback(name)
+    else:
+        # Queued, in flight, delivered or spooled
+        change_filter.commit(name)
+
+
+class SenseHatService:
+    """
+    Publishes one SenseHat to MQTT: the configuration, the clients and the
+    components built from it, with the callbacks and the cycle that use them.
+
+    Building one neither connects nor starts a thread: `run()` does, or a
+    harness drives `collect()`, `publish_metrics()` and `publish()` itself,
+    as bench/bench_fleet.py does for a fleet of services in one process.
+    """
+
+    def __init__(self, cfg: Settings, log_pipeline: LogPipeline | None = None):
+        """
+        Parameters
+        ----------
+        cfg
+            The settings, see `load_configuration`.
+        log_pipeline
+            Reconfigured with the settings on reload, and reported in the
+            statistics; None when the caller owns the logging set-up.
+
+        Raises
+        ------
+        Exception
+            When the SenseHat device cannot be initialized.
+        """
+        self.cfg = cfg
+        self.log_pipeline = log_pipeline
+        self.mqtt_client: Client = self.build_mqtt()
+        self.topic_aliases, self.telemetry_properties = self.build_mqtt5()
+        self.publisher = AsyncPublisher(
+            self.mqtt_client,
+            max_inflight=int(cfg.get("publish", {}).get("max_inflight", 20)),
+            max_pending=int(cfg.get("publish", {}).get("max_pending", 1000)),
+            aliases=self.topic_aliases,
         )
-        print(
-            "[on_subscribe] Published to "
-            + cfg["topics"]["pressure"]
-            + cfg["topics"]["config"]
-            + " topic."
+        self.spool = self.build_spool()
+        self.runtime: AsyncRuntime | None = None
+        # Schema id -> column names of the binary stats tables, see publish_stats_schemas()
+        self.stats_schemas: Dict[bytes, Tuple[str, ...]] = {}
+        self._stats_encoders: Dict[Tuple[str, ...], StatsEncoder] = {}
+        self.sensehat_device = SenseHatDevice(cfg)
+        self.discovery = DiscoveryCache(discovery_messages(self.sensehat_device))
+        self.gateway = self.build_gateway()
+        self.fanout = self.build_fanout()
+        self.commands = self.build_commands()
+        self.gpio_outputs = GpioOutputs(cfg.get("commands", {}).get("gpio_pins", ()))
+        self.frame_writer = FrameWriter(
+            self.sensehat_device.write_frame, max_fps=float(cfg.get("led", {}).get("max_fps", 30))
         )
-        mqtt_client.publish(
-            cfg["topics"]["humidity"] + cfg["topics"]["config"],
-            json.dumps(sensehat_device.message_config_humidity("humidity"))
 
+    def apply_settings(self, new: Settings, origin: str = CONFIG_PATH):
+        """
+        Switch to a reloaded configuration.
+
+        The interval, the topics and the per-cycle options take effect at the
+        next cycle; discovery is rebuilt and republished when it changed.
+
+        Parameters
+        ----------
+        new
+            The new settings.
+        origin
+            Where they come from, for the log.
+        """
+        old = self.cfg
+        self.cfg = new
+        self.sensehat_device.cfg = new
+        if self.runtime is not None:
+            self.runtime.interval = new.seconds
+        if self.log_pipeline is not None:
+            self.log_pipeline.configure(new.get("logging", {}), LOG_SAMPLE)
+        log.info("Applied %s, refreshing every %s seconds", origin, new.seconds, extra={"event": "config"})
+        if new.command_topic != old.command_topic:
+            self.commands.reset()
+            self.register_commands(self.commands, new.command_topic)
+            if self.mqtt_client.is_connected():
+                self.mqtt_client.subscribe(new.command_topic + "/#")
+        if new.topics != old.topics or any(new.get(key) != old.get(key) for key in ("combined_state", "derived")):
+            self.discovery = DiscoveryCache(discovery_messages(self.sensehat_device))
+            if self.mqtt_client.is_connected():
+                if new.status_topic != old.status_topic:
+                    self.mqtt_client.subscribe(new.status_topic)
+                self.publisher.publish(new.availability_topic, "online")
+                self.publish_discovery("config")
+        restart = [key for key in RESTART_KEYS if new.get(key) != old.get(key)]
+        if restart:
+            log.warning("Restart to apply the changes to: %s", ", ".join(restart), extra={"event": "config"})
+
+    def build_mqtt(self) -> paho.mqtt.client.Client:
+        """
+        Builds and configures an MQTT client.
+
+        Returns
+        -------
+        paho.mqtt.client.Client
+            The configured MQTT client.
+        """
+        # Generate a ClientId
+        client_id_alt = str(self.cfg["id"])  # type: ignore
+
+        # Load TLS certificate and key
+        # tls_context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH, cafile="../ca.crt")
+        # tls_context.load_cert_chain(certfile="../server.crt", keyfile="../server.key", password="majestic")
+        # Build the MQTT client with the generated client id, clean session, and TCP transport
+        # MQTT v5 brings topic aliases, message expiry and user properties, see mqtt5.py
+        protocol = paho.mqtt.client.MQTTv5 if self.cfg.get("mqtt5", {}).get("enabled") else paho.mqtt.client.MQTTv311
+        build_client = paho.mqtt.client.Client(client_id=self.cfg.get("client_id", "sensehat"), protocol=protocol)
+        # Set username and password for authentication
+        username = self.cfg["broker"].get("username", "")
+        password = self.cfg["broker"].get("password", "")
+        if("" not in password):
+            build_client.username_pw_set(username, password)
+        # Configure TLS
+        client_cfg = self.cfg.get("client", {})
+        if client_cfg.get("certfile", ""):
+            build_client.tls_insecure_set(True)
+            build_client.tls_set(
+                certfile=client_cfg["certfile"],
+                keyfile=client_cfg.get("keyfile") or None,
+                keyfile_password=client_cfg.get("keyfile_password") or None,
+                ca_certs=client_cfg.get("ca_certs") or None,
+                tls_version=ssl.PROTOCOL_TLSv1_2,
+            )
+
+        # Configure MQTT client callbacks
+
+        build_client.on_connect = self.on_connect
+        build_client.on_message = self.on_message
+        build_client.on_publish = self.on_publish
+        build_client.on_disconnect = self.on_disconnect
+        return build_client
+
+    def build_mqtt5(self) -> Tuple[TopicAliases | None, PublishProperties | None]:
+        """
+        Build the MQTT v5 publish options when the 'mqtt5' section of the
+        configuration is enabled.
+
+        Returns
+        -------
+        Tuple[TopicAliases | None, PublishProperties | None]
+            The topic aliases, unless 'aliases' is false, and the telemetry
+            properties with an 'expiry' in seconds (default 300, 0 for none);
+            (None, None) for MQTT 3.1.1.
+        """
+        mqtt5_cfg = self.cfg.get("mqtt5", {})
+        if not mqtt5_cfg.get("enabled"):
+            return None, None
+        aliases = TopicAliases() if mqtt5_cfg.get("aliases", True) else None
+        expiry = int(mqtt5_cfg.get("expiry", 300))
+        log.info("Using MQTT v5, topic aliases %s, telemetry expiry %s", "on" if aliases else "off", expiry or "none")
+        return aliases, PublishProperties(expiry or None)
+
+    def on_connect(self, client: paho.mqtt.client.Client, userdata, flags, rc: int, properties=None):
+        if rc == int(0):
+            log.info("Connected al broker MQTT", extra={"event": "on_connect"})
+            if self.topic_aliases is not None:
+                # Aliases belong to a connection: start over with the broker's limit
+                self.topic_aliases.reset(getattr(properties, "TopicAliasMaximum", 0))
+                log.info("Broker allows %d topic aliases.", self.topic_aliases.maximum, extra={"event": "on_connect"})
+            print_info(client, userdata, rc, "on_connect")
+            # Suscribirse a un tema específico
+            client.subscribe(self.cfg.status_topic)
+            client.subscribe(HA_STATUS_TOPIC)
+            client.subscribe(self.cfg.command_topic + "/#")
+            # mqtt_client.subscribe("homeassistant/status")
+            log.info("Subscribed to %s topic.", HA_STATUS_TOPIC, extra={"event": "on_connect"})
+            # mqtt_client.subscribe("homeassistant/nodered/status")
+            log.info("Subscribed to %s topic.", self.cfg.status_topic, extra={"event": "on_connect"})
+
+            #online_topic = cfg["id"] + cfg["topics"]["availability"]
+            online_topic = self.cfg.availability_topic
+            self.publisher.publish(online_topic, "online")
+
+            log.info("Published to %s topic.", online_topic, extra={"event": "on_connect"})
+            if self.gateway is not None:
+                for topic in self.gateway.availability_topics():
+                    self.publisher.publish(topic, "online")
+                log.info(
+                    "Published availability of %d gateway devices.", len(self.gateway), extra={"event": "on_connect"}
+                )
+            self.publish_stats_schemas()
+            # Retained by the broker: later reconnects only need them again on HA's birth message
+            if self.discovery.publishes == 0:
+                self.publish_discovery("on_connect")
+        # elif rc != int(0) and rc[0] != int(0):
+        #     print(f"[on_connect] Connection error. Return Code: {error_code_message(rc)}")
+        #else:
+            # print(
+            #     f"[on_connect] Unexpected Result Code: is int: {rc is int} - {type(rc)} {rc}"
+            # )
+
+    def on_disconnect(self, client: paho.mqtt.client.Client, userdata, rc: int, properties=None):
+        if self.topic_aliases is not None:
+            # No alias may be used until the next connection's CONNACK
+            self.topic_aliases.reset(0)
+
+    def on_publish(self, client, userdata, mid: int):
+        self.publisher.on_publish(client, userdata, mid)
+
+    # Función para manejar la recepción de mensajes MQTT
+    def publish_discovery(self, log_header: str):
+        """Publish the cached discovery payloads, retained."""
+        send = lambda topic, payload: self.publisher.publish(topic, payload, qos=1, retain=True)
+        self.discovery.publish(send)
+        log.info("Published %d discovery configurations.", len(self.discovery.messages), extra={"event": log_header})
+        if self.gateway is not None:
+            self.gateway.publish_discovery(send)
+            log.info(
+                "Published the discovery configurations of %d gateway devices.", len(self.gateway),
+                extra={"event": log_header},
+            )
+
+    def on_message(self, client, userdata, msg):
+        if self.commands.handle_inline(msg.topic, msg.payload):
+            # Streamed LED frames: buffered by the frame writer, not logged or queued per frame
+            return
+        print_info(client, userdata, msg, "on_message")
+        log.info("Received %d bytes on %s", len(msg.payload), msg.topic, extra={"event": "on_message"})
+        if DiscoveryCache.is_birth(msg.topic, msg.payload):
+            self.publish_discovery("on_message")
+            return
+        if self.runtime is not None:
+            # Handled by the runtime's command task, off the network thread
+            self.runtime.submit_command(msg.topic, msg.payload)
+        else:
+            # Handled by the dispatcher's worker thread, off the network thread
+            self.commands.submit(msg.topic, msg.payload)
+
+    def set_interval(self, topic: str, payload: bytes):
+        """Command: publish every `payload` seconds."""
+        seconds = int(payload)
+        if seconds < 1:
+            raise ValueError(f"The interval must be at least 1 second, not {seconds}")
+        raw = thaw(self.cfg.raw)
+        raw["seconds"] = seconds
+        self.apply_settings(compile_settings(raw), origin=topic)
+
+    def set_log_level(self, topic: str, payload: bytes):
+        """Command: log at the `payload` level, e.g. "debug" for every message."""
+        raw = thaw(self.cfg.raw)
+        raw.setdefault("logging", {})["level"] = payload.decode("utf-8", "replace").strip().lower()
+        self.apply_settings(compile_settings(raw), origin=topic)
+
+    def show_led_message(self, topic: str, payload: bytes):
+        """Command: scroll the payload on the LED matrix."""
+        (self.runtime or self.sensehat_device).show_message(payload.decode("utf-8", "replace"))
+
+    def stream_led_frame(self, topic: str, payload: bytes):
+        """Command: show a raw RGB or RGB565 frame on the LED matrix, see `FrameWriter`."""
+        self.frame_writer.submit(payload)
+
+    def set_gpio(self, topic: str, payload: bytes):
+        """Command: drive the GPIO named by the last topic level, e.g. `<command>/gpio/17` with "on"."""
+        self.gpio_outputs.set(int(topic.rsplit("/", 1)[1]), parse_level(payload))
+
+    def recalibrate(self, topic: str, payload: bytes):
+        """Command: reload the sensors' calibration."""
+        if not self.sensehat_device.recalibrate():
+            # Logged as a warning and counted as a failed command by the dispatcher
+            raise RuntimeError("The sensor backend could not reload its calibration")
+        log.info("Recalibrated the sensors.", extra={"event": "commands"})
+
+    def register_commands(self, dispatcher: CommandDispatcher, root: str):
+        """Register the command handlers under the command topic."""
+        dispatcher.register(root + "/interval", self.set_interval)
+        dispatcher.register(root + "/log/level", self.set_log_level)
+        dispatcher.register(root + "/led/message", self.show_led_message)
+        dispatcher.register(root + "/led/frame", self.stream_led_frame, inline=True)
+        dispatcher.register(root + "/gpio/+", self.set_gpio)
+        dispatcher.register(root + "/recalibrate", self.recalibrate)
+
+    def build_commands(self) -> CommandDispatcher:
+        """
+        Build the dispatcher of the messages received on the command topic
+        (defaults to `<device>/cmd`).
+
+        Other messages, such as those on the status topic, are only logged.
+        """
+        commands_cfg = self.cfg.get("commands", {})
+        dispatcher = CommandDispatcher(queue_size=int(commands_cfg.get("queue_size", 32)), default=handle_command)
+        self.register_commands(dispatcher, self.cfg.command_topic)
+        return dispatcher
+
+    def publish(
+        self,
+        topic: str,
+        msg: str,
+        retain: bool = False,
+        qos: int | None = None,
+        sample_time: float | None = None,
+    ) -> Future | None:
+        """
+        Publish a message without waiting for the network, by default with
+        the 'qos' of the 'publish' section of the configuration (0).
+
+        While disconnected, and when the 'spool' section of the configuration is
+        set, the message is stored on disk instead and replayed by the backfill.
+
+        In MQTT v5 mode, telemetry (messages with a `sample_time`) carries a
+        message expiry and its sequence number and sample time as user
+        properties.
+
+        Returns
+        -------
+        Future | None
+            Completes once the client reports the message as published, see
+            `AsyncPublisher.publish`; None when the message was spooled.
+        """
+        if self.fanout is not None:
+            # Every other broker has its own queues: this never waits for them
+            self.fanout.publish(topic, msg, retain=retain)
+        if self.spool is not None and not self.mqtt_client.is_connected():
+            self.spool.append(topic, msg if isinstance(msg, bytes) else str(msg).encode("utf-8"))
+            log.info(
+                "Not connected, spooled message `%s` to topic `%s`.", msg, topic,
+                extra={"event": "spool", "waiting": len(self.spool)},
+            )
+            return None
+        if qos is None:
+            qos = int(self.cfg.get("publish", {}).get("qos", 0))
+        properties = None
+        if self.telemetry_properties is not None and sample_time is not None:
+            properties = self.telemetry_properties.build(sample_time)
+        future = self.publisher.publish(topic, msg, qos=qos, retain=retain, properties=properties)
+        future.add_done_callback(log_publish_result(topic, msg))
+        return future
+
+    def mqtt_connect(self, param_client: paho.mqtt.client.Client) -> paho.mqtt.client.Client:
+        """
+        Connects the MQTT client to the broker and publishes an "online" message.
+
+        Args:
+            param_client: The MQTT client object.
+
+        Returns:
+            The connected MQTT client object.
+        """
+        topic = self.cfg.availability_topic
+        # param_client.will_clear()
+        param_client.will_clear()
+        param_client.will_set(topic, "offline")
+        log.info("Will set to topic %s with message 'offline'", topic, extra={"event": "mqtt_connect"})
+        # Connect to the MQTT broker
+
+        param_client.connect(
+            self.cfg["broker"]["host"], port=self.cfg["broker"]["port"], keepalive=60
         )
-        print(
-            f"[on_subscribe] Published to "
-            + cfg["topics"]["humidity"]
-            + cfg["topics"]["config"]
-            + " topic."
-        )
-        mqtt_client.publish(
-            cfg["topics"]["temperature"] + cfg["topics"]["config"],
-            json.dumps(sensehat_device.message_config_temperature("temperature"))
+        # Publish an "online" message
+        log.info(
+            "Connected to %s:%s", self.cfg["broker"]["host"], self.cfg["broker"]["port"],
+            extra={"event": "mqtt_connect"},
         )
-        print(
-            f"[on_subscribe] Published to "
-            + cfg["topics"]["temperature"]
-            + cfg["topics"]["config"]
-            + " topic."
+        log.debug("Username: %s", self.cfg["broker"].get("username", ""), extra={"event": "mqtt_connect"})
+
+        # Through the publisher, which must see every message id of the client
+        future = self.publisher.publish(topic, "online")
+
+        if future.done() and future.exception() is None:
+            log.info("Message sent to topic %s with message 'online'", topic, extra={"event": "mqtt_connect"})
+        else:
+            log.debug("Message to topic %s with message 'online' not sent yet", topic, extra={"event": "mqtt_connect"})
+
+        return param_client
+
+    def build_supervisor(self) -> ConnectionSupervisor:
+        """
+        Build the connection supervisor from the optional 'reconnect' section of
+        the configuration ('base_delay', 'max_delay' and 'jitter').
+
+        Returns
+        -------
+        ConnectionSupervisor
+            The supervisor, not started yet.
+        """
+        reconnect_cfg = self.cfg.get("reconnect", {})
+        return ConnectionSupervisor(
+            self.mqtt_client,
+            self.mqtt_connect,
+            base_delay=float(reconnect_cfg.get("base_delay", 1.0)),
+            max_delay=float(reconnect_cfg.get("max_delay", 60.0)),
+            jitter=float(reconnect_cfg.get("jitter", 0.5)),
         )
-        mqtt_client.publish(
-            cfg["[topics]"]["device"] + cfg["topics"]["config"],
-            json.dumps(sensehat_device.define_sensehat_device())
+
+    def availability_topics(self) -> List[str]:
+        """Return the availability topic of this device and of every gateway device."""
+        topics = [self.cfg.availability_topic]
+        if self.gateway is not None:
+            topics.extend(self.gateway.availability_topics())
+        return topics
+
+    def build_fanout(self) -> FanoutPublisher | None:
+        """
+        Build the fan-out to the extra brokers listed in the 'brokers' section of
+        the configuration, each with its own client, queues and retry policy.
+
+        Every message published on the main broker is also sent to each of them,
+        and each connection sets the availability topics "online", retained,
+        with a retained "offline" last will.
+
+        Returns
+        -------
+        FanoutPublisher | None
+            The fan-out, not connected yet, or None without extra brokers.
+        """
+        brokers = self.cfg.get("brokers")
+        if not brokers:
+            return None
+        links = []
+        for index, broker in enumerate(brokers):
+            name = broker.get("name", f"{broker['host']}:{broker.get('port', 1883)}")
+
+            def connect(client, broker=broker):
+                client.will_set(self.cfg.availability_topic, "offline", retain=True)
+                client.connect(broker["host"], port=int(broker.get("port", 1883)), keepalive=60)
+
+            links.append(
+                BrokerLink(
+                    name,
+                    create_client(broker, f"sensehat-{index + 1}"),
+                    connect,
+                    qos=int(broker.get("qos", 0)),
+                    retries=int(broker.get("retries", 2)),
+                    max_inflight=int(broker.get("max_inflight", 20)),
+                    max_pending=int(broker.get("max_pending", 1000)),
+                    timeout=float(broker.get("timeout", 30)),
+                    reconnect=broker.get("reconnect"),
+                    availability=self.availability_topics,
+                )
+            )
+        return FanoutPublisher(links)
+
+    def build_spool(self) -> SegmentLog | None:
+        """
+        Open the store-and-forward queue from the 'spool' section of the configuration.
+
+        Returns
+        -------
+        SegmentLog | None
+            The queue, or None to drop messages while disconnected.
+        """
+        spool_cfg = self.cfg.get("spool")
+        if not spool_cfg:
+            return None
+        directory = spool_cfg.get("directory", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+        return SegmentLog(
+            directory,
+            segment_size=int(spool_cfg.get("segment_size", 1 << 20)),
+            max_bytes=int(spool_cfg.get("max_bytes", 64 << 20)),
+            fsync_every=int(spool_cfg.get("fsync_every", 32)),
+            fsync_interval=float(spool_cfg.get("fsync_interval", 1.0)),
         )
-        print(
-            f"[on_subscribe] Published to "
-            + cfg["topics"]["device"]
-            + cfg["topics"]["config"]
-            + " topic."
+
+    def build_backfill(self) -> Backfill | None:
+        """
+        Start replaying the spooled messages whenever the client is connected.
+
+        Each message is published in order on the 'backfill' topic (defaults to
+        `<device>/backfill`) as {"topic", "timestamp", "payload"}, keeping its
+        original time, so replayed readings never show up as current states.
+
+        Returns
+        -------
+        Backfill | None
+            The running backfill, or None without a spool.
+        """
+        if self.spool is None:
+            return None
+        topic = self.cfg.backfill_topic
+
+        def send(record):
+            timestamp, original_topic, payload = record
+            if is_binary(payload):
+                try:
+                    payload = decode(payload, self.stats_schemas)
+                except FormatError as ex:
+                    # e.g. stats spooled by a run with other channels: keep the raw table
+                    log.warning(
+                        "Replaying an undecodable table from %s: %s", original_topic, ex, extra={"event": "backfill"}
+                    )
+                    payload = payload.hex()
+            else:
+                try:
+                    payload = json.loads(payload)
+                except ValueError:
+                    payload = payload.decode("utf-8", "replace")
+            message = {
+                "topic": original_topic,
+                "timestamp": str(datetime.datetime.fromtimestamp(timestamp)),
+                "payload": payload,
+            }
+            # Wait for the PUBACK: the record leaves the spool only once the broker has it
+            self.publisher.publish(topic, dumps(message), qos=1).result(timeout=timeout)
+
+        timeout = float(self.cfg.get("publish", {}).get("timeout", 30))
+        backfill = Backfill(
+            self.spool, send, self.mqtt_client.is_connected, rate=float(self.cfg["spool"].get("rate", 5))
         )
-    # elif rc != int(0) or rc[0] != int(0):
-    #     print(f"[on_subscribe] WARNING: Result Code: {error_code_message(rc)}")
-    else:
-        print(f"[on_subscribe] Unexpected Result Code: {type(rc)} {rc}")
-
-
-# Función para manejar la recepción de mensajes MQTT
-def on_message(client, userdata, msg):
-    print_info(client, userdata, msg, "on_message")
-    print(f"[on_message] Topic: {msg.topic}")
-    print(f"[on_message] Qos: {msg.qos}")
-    print(f"[on_message] Retain: {msg.retain}")
-    print(f"[on_message] Message received: {msg.payload.decode()}")
-
-
-def publish(
-    client: paho.mqtt.client.Client,
-    topic: str,
-    msg: str,
-    retain: bool = False,
-    qos: int = 0,
-) -> MQTTMessageInfo:
-    msg_count = 1
-    while True:
-        result = client.publish(topic, msg, retain=retain, qos=qos)
-
-        if result.rc == 0 or result.is_published():
-            print(
-                f"[publish] Message {result.mid}: `{msg}` to topic `{topic}` published."
-            )
-            return result
-        print(
-            f"[publish] Failed to send message to topic {topic}. Message: {result.mid} - Code: {result.rc}"
+        backfill.start()
+        log.info("Spooling to %s, %d messages waiting for backfill", self.spool.directory, len(self.spool))
+        return backfill
+
+    def build_sampler(self, seconds: int) -> HighRateSampler | None:
+        """
+        Start the high-rate sampler when 'sample_rate_hz' is set in the configuration.
+
+        Parameters
+        ----------
+        seconds
+            The publish interval. The ring buffer holds one and a half intervals.
+
+        Returns
+        -------
+        HighRateSampler | None
+            The running sampler, or None to sample once per interval.
+        """
+        if not self.cfg.get("sample_rate_hz"):
+            return None
+        rate_hz = float(self.cfg["sample_rate_hz"])
+        sampler = HighRateSampler(
+            self.sensehat_device.read_raw,
+            SenseHatDevice.RAW_CHANNELS,
+            rate_hz=rate_hz,
+            capacity=int(rate_hz * seconds * 1.5) + 1,
         )
-        msg_count += 1
-        if msg_count > 5:
-            print(
-                f"[publish] Timeout while retrying... #{msg_count} - Message: {result.mid} - Code: {result.rc}"
-            )
-            break
-        print(
-            f"[publish] Retrying... #{msg_count} - Message: {result.mid} - Code: {result.rc}"
+        sampler.start()
+        log.info("Sampling at %s Hz, publishing aggregates every %s seconds", rate_hz, seconds)
+        return sampler
+
+    def build_change_filter(self) -> ChangeFilter | None:
+        """
+        Build the report-by-exception filter from the 'report_by_exception' section
+        of the configuration.
+
+        Returns
+        -------
+        ChangeFilter | None
+            The filter, or None to publish every reading.
+        """
+        rbe = self.cfg.get("report_by_exception")
+        if not rbe:
+            return None
+        return ChangeFilter(
+            deadbands=rbe.get("deadbands"),
+            heartbeat=float(rbe.get("heartbeat", 300)),
         )
-        time.sleep(1)
-    return result
 
+    def build_imu_streamer(self) -> ImuStreamer | None:
+        """
+        Start streaming the IMU when the 'imu' section of the configuration is enabled.
 
-def mqtt_connect(param_client: paho.mqtt.client.Client) -> paho.mqtt.client.Client:
-    """
-    Connects the MQTT client to the broker and publishes an "online" message.
+        The rate defaults to LSM9DS1AccelSampleRate from RTIMULib.ini. Every
+        'block_size' samples (default 50) are published as one message on the
+        'imu' topic (defaults to `<device>/imu`).
 
-    Args:
-        param_client: The MQTT client object.
+        Returns
+        -------
+        ImuStreamer | None
+            The running streamer, or None when disabled.
+        """
+        imu_cfg = self.cfg.get("imu", {})
+        if not imu_cfg.get("enabled"):
+            return None
+        rate_hz = float(imu_cfg.get("rate_hz") or configured_sample_rate())
+        topic = self.cfg.imu_topic
+        encoder = TableEncoder(IMU_CHANNELS)
 
-    Returns:
-        The connected MQTT client object.
-    """
-    topic = cfg["topics"]["device"] + cfg["topics"]["availability"]
-    # param_client.will_clear()
-    param_client.will_clear()
-    param_client.will_set(cfg["topics"]["device"] + cfg["topics"]["availability"], "offline")
-    print(f"[mqtt_connect] Will set to topic {topic} with message 'offline'")
-    # Connect to the MQTT broker
-
-    param_client.connect(
-        cfg["broker"]["host"], port=cfg["broker"]["port"], keepalive=60
-    )
-    # Publish an "online" message
-    print(f"[mqtt_connect] Connected to {cfg['broker']['host']}:{cfg['broker']['port']}")
-    print(f"[mqtt_connect] Username: {cfg['broker']['username']}")
-
-    info = param_client.publish(topic, "online");
-
-    #MQTTMessageInfo
-    if info.is_published():
-        print(f"[mqtt_connect] Message sent to topic {topic} with message 'online'")
-    else:
-        print(f"[mqtt_connect] Message failed to topic {topic} with message 'online'")
+        def on_block(block):
+            if self.binary_payloads():
+                payload = encoder.encode(block, rate_hz)
+            else:
+                payload = dumps(encode_block(block, rate_hz))
+            self.publisher.publish(topic, payload, qos=0)
 
-    dev = sensehat_device.define_sensehat_device();
-    topic_disco = cfg["topics"]["device"] + cfg["topics"]["config"];
-    discovery = param_client.publish(topic_disco, json.dumps(dev));
-    if discovery.is_published():
-        print(f"[mqtt_connect] Message sent to topic {topic_disco} with device info")
-    else:
-        print(f"[mqtt_connect] Message failed to topic {topic_disco} with device info")
-        print(f"[mqtt_connect] {json.dumps(dev)}");
+        streamer = ImuStreamer(
+            self.sensehat_device.read_imu,
+            rate_hz=rate_hz,
+            block_size=int(imu_cfg.get("block_size", 50)),
+            on_block=on_block,
+        )
+        streamer.start()
+        log.info("Streaming IMU at %s Hz to %s", rate_hz, topic)
+        return streamer
 
+    def binary_payloads(self) -> bool:
+        """Return True when 'payload_format' selects the binary format of binformat.py for the high-rate streams."""
+        return self.cfg.get("payload_format", "json") == "binary"
 
-    return param_client
+    def stats_encoder(self, channels: Tuple[str, ...]) -> StatsEncoder:
+        """Return the encoder of the statistics of these channels, built once; its schema is published then."""
+        encoder = self._stats_encoders.get(channels)
+        if encoder is None:
+            encoder = self._stats_encoders[channels] = StatsEncoder(channels)
+            self.stats_schemas[encoder.table.schema_id] = encoder.table.columns
+            self.publish_stats_schemas()
+        return encoder
 
+    def publish_stats_schemas(self):
+        """
+        Publish the column names of every binary stats schema in use, retained,
+        on `<stats topic>/schema/<id>`: the stats payloads only carry the id.
+        Published again on every connection, in case the broker lost them.
+        """
+        for schema, columns in self.stats_schemas.items():
+            topic = f"{self.cfg.stats_topic}/schema/{schema.decode('ascii')}"
+            names = ",".join(columns).encode("ascii")
+            if self.fanout is not None:
+                self.fanout.publish(topic, names, retain=True)
+            if self.mqtt_client.is_connected():
+                self.publisher.publish(topic, names, qos=1, retain=True)
 
-def run():
-    """
-    Run the main function.
-
-    This function performs the following steps:
-    1. Loads the configuration using the `load_configuration()` function.
-    2. Validates the loaded configuration using the `validate_configuration()` function.
-    3. Builds an MQTT client using the `build_mqtt()` function.
-    4. Retrieves the refresh interval from the configuration and converts it to an integer.
-    5. Initializes a `SenseHatDevice` object using the loaded configuration.
-    6. Connects to the MQTT broker using the `mqtt_connect()` function.
-    7. Starts the MQTT client loop using the `mqtt_client.loop_start()` function.
-    8. Enters an infinite loop to continuously read sensor data and publish it to the MQTT broker.
-    9. Handles keyboard interrupts and other exceptions gracefully.
-    10. Stops the MQTT client loop and disconnects from the MQTT broker.
-    11. Prints the current time and exits.
-
-    Parameters:
-    - None
-
-    Return:
-    - None
-    """
-    exit_code = 0
-    seconds = int(cfg["seconds"])
-    # print(f"Starting sense-hat-mqtt. Warming up during 15 seconds.")
-    # time.sleep(15)  # Allow time for sense-hat to warm up and avoid erroneous data
-    current_time = datetime.datetime.now()
-    print(current_time)
-    print(f"Starting sense-hat-mqtt. Refreshing every {seconds} seconds")
+    def collect(self, sampler: HighRateSampler | None) -> Tuple[Reading, Dict[str, float] | None] | None:
+        """
+        Take the reading of one cycle.
 
-    try:
-        counter = 1
-        sensehat_device.show_message(f"{counter}")
-        #mqtt_connect(mqtt_client)
-        mqtt_client.loop_start()
-        mqtt_connect(mqtt_client)
-        #mqtt_client.loop_forever()
-        while True:
-            # -- mqtt_client.reconnect()
-            counter = counter + 1
-            metrics = sensehat_device.calculate_metrics()
-            json_read = metrics["messages"]["json"]
-            print(f"[{datetime.datetime.now()}] Reading: {json_read}")
-            # print(f"[DEBUG]: {json.dumps(metrics)}")
-            publish(
-                mqtt_client,
-                cfg["topics"]["humidity"] + cfg["topics"]["state"],
-                metrics["humidity"],
-                retain=False,
-            )
-            time.sleep(0.25)
-            publish(
-                mqtt_client,
-                cfg["topics"]["pressure"] + cfg["topics"]["state"],
-                metrics["pressure"],
+        Parameters
+        ----------
+        sampler
+            The high-rate sampler, whose samples since the last cycle are
+            aggregated, or None to read the sensors once.
+
+        Returns
+        -------
+        Tuple[Reading, Dict[str, float] | None] | None
+            The metrics and the derived values (None unless 'derived' is set), or
+            None when there is nothing to publish this cycle.
+        """
+        derived = None
+        if sampler is not None:
+            stats = sampler.drain(SenseHatDevice.derive_columns if self.cfg.get("derived") else None)
+            if stats is None:
+                log.warning("No samples since the last cycle.", extra={"event": "cycle"})
+                return None
+            metrics = self.sensehat_device.metrics_from_stats(stats)
+            if self.cfg.get("derived"):
+                derived = {sensor: round(stats[sensor]["mean"], 1) for sensor in DERIVED}
+            log.info("Aggregated %d samples: %r", stats["temp_room"]["count"], metrics, extra={"event": "reading"})
+            if self.binary_payloads():
+                payload = self.stats_encoder(tuple(stats)).encode(stats, float(self.cfg["sample_rate_hz"]), time.time())
+            else:
+                payload = dumps(stats)
+            self.publish(
+                self.cfg.stats_topic,
+                payload,
                 retain=False,
+                sample_time=time.time(),
             )
-            time.sleep(0.25)
-            publish(
-                mqtt_client,
-                cfg["topics"]["temperature"] + cfg["topics"]["state"],
-                metrics["temp_room"],
+        else:
+            try:
+                metrics = self.sensehat_device.calculate_metrics()
+            except IncompleteSample as incomplete:
+                log.warning("Skipping cycle: %s", incomplete, extra={"event": "cycle"})
+                return None
+            log.info("Reading: %s", metrics.to_json().decode(), extra={"event": "reading"})
+            if log.isEnabledFor(logging.DEBUG):
+                timings = {f"{name}_ms": round(elapsed * 1000, 1) for name, elapsed in metrics.timings.items()}
+                log.debug("Timings", extra={"event": "timings", **timings})
+            if self.cfg.get("derived"):
+                derived = self.sensehat_device.derived_metrics(metrics)
+        return metrics, derived
+
+    def publish_metrics(self, metrics: Reading, derived: Dict[str, float] | None, change_filter: ChangeFilter | None):
+        """
+        Publish the states of one cycle.
+
+        Parameters
+        ----------
+        metrics
+            The reading.
+        derived
+            The derived values, if enabled.
+        change_filter
+            Drops the states that did not change enough, if report-by-exception is enabled.
+        """
+        # print(f"[DEBUG]: {dumps(metrics)}")
+        if self.cfg.get("combined_state"):
+            # One document per cycle; discovery points each sensor into it with a value_template
+            values = {
+                "humidity": metrics.humidity,
+                "pressure": metrics.pressure,
+                "temperature": metrics.temp_room,
+                "temp_cpu": metrics.temp_cpu,
+            }
+            if derived is not None:
+                values.update(derived)
+            if change_filter is None or change_filter.should_publish_all("state", values):
+                state = metrics.state_dict()
+                if derived is not None:
+                    state.update(derived)
+                future = self.publish(
+                    self.cfg.combined_state_topic,
+                    dumps(state),
+                    retain=False,
+                    sample_time=metrics.time,
+                )
+                settle(change_filter, "state", future)
+            return
+        # Queued by the AsyncPublisher, which bounds the messages in flight: no pacing between them
+        for sensor, value in (
+            ("humidity", metrics.humidity),
+            ("pressure", metrics.pressure),
+            ("temperature", metrics.temp_room),
+            ("temp_cpu", metrics.temp_cpu),
+        ):
+            if change_filter is not None and not change_filter.should_publish(sensor, value):
+                continue
+            future = self.publish(
+                self.cfg.state_topics[sensor],
+                value,
                 retain=False,
+                sample_time=metrics.time,
             )
-            time.sleep(0.25)
-            publish(
-                mqtt_client,
-                cfg["topics"]["temp_cpu"] + cfg["topics"]["state"],
-                metrics["temp_cpu"],
+            settle(change_filter, sensor, future)
+        if derived is not None and (
+            change_filter is None or change_filter.should_publish_all("derived", derived)
+        ):
+            future = self.publish(
+                self.cfg.derived_topic,
+                dumps(derived),
                 retain=False,
+                sample_time=metrics.time,
             )
-            print(f"Sleeping for {seconds} seconds.")
-            time.sleep(seconds)
-    except KeyboardInterrupt as exc:
-        #client.loop_stop();
-        #client.disconnect();
-        print("KeyboardException, quitting...")
-        print(exc)
-        mqtt_client.loop_stop();
-        mqtt_client.disconnect();
-    except ConnectionResetError as cre:
-        #client.loop_stop();
-        #client.disconnect();
-        print("Connection error, sleeping...", cre)
-        print(f"Ex Type: {type(cre)}")
-        # sys.stderr.write(f"Exception: {cre}\n")
-        exit_code = 8
-        mqtt_client.loop_stop();
-        mqtt_client.disconnect();
-    except BaseException as exx:
-        #client.loop_stop();
-        #client.disconnect();
-        print("UnknownException, quitting...", exx)
-        print(f"Ex Type: {type(exx)}")
-        sys.stderr.write(f"Exception: {exx}\n")
-        exit_code = 1
-        print("Stop")
-        mqtt_client.loop_stop();
-        mqtt_client.disconnect();
-    finally:
-        # client.disconnect()
-        # Cerrar la conexión con el broker MQTT
-        print("Quitting...Closing loop and connection...")
-        #mqtt_client.loop_stop()
-        #mqtt_client.disconnect()
-        current_time = datetime.datetime.now()
-        print(f"[{current_time}] Exit! Done!")
-
-    return exit_code
-
-cfg = load_configuration()
-validate_configuration(cfg)
-mqtt_client: Client = build_mqtt()
-
-try:
-    sensehat_device = SenseHatDevice(cfg)
-except BaseException as ex:
-    print("SenseHat device initialization failed, quitting...", ex)
-    # print(ex.with_traceback())
-    print(f"Ex Type: {type(ex)}")
-    sys.stderr.write(f"Exception: {ex}\n")
-    #sys.stderr.write(f"Traceback: {ex.with_traceback()}\n")
-    print("Stop")
-    sys.exit(1)
+            settle(change_filter, "derived", future)
 
-if __name__ == "__main__":
-    # Main Program
-    ec = run()
+    def publish_gateway(self):
+        """Publish the states of the gateway devices, when 'gateway' is configured."""
+        if self.gateway is None:
+            return
+        self.gateway.publish_cycle(
+            lambda topic, payload, sample_time: self.publish(topic, payload, sample_time=sample_time)
+        )
+
+    def report(self, change_filter: ChangeFilter | None, supervisor: ConnectionSupervisor):
+        """
+        Expire unacknowledged messages and log the publishing and connection
+        statistics, as one record with a field per component.
+        """
+        expired = self.publisher.expire(float(self.cfg.get("publish", {}).get("timeout", 30)))
+        if expired:
+            log.warning("%d messages were not acknowledged in time.", expired, extra={"event": "publish"})
+        fields = {
+            "event": "report",
+            "latency": self.publisher.latency_percentiles(),
+            "publisher": self.publisher.stats(),
+            "connection": supervisor.stats(),
+        }
+        if self.fanout is not None:
+            fields["brokers"] = self.fanout.stats()
+        if self.gateway is not None:
+            fields["gateway"] = self.gateway.stats()
+        if self.commands.dispatched or self.commands.unmatched:
+            fields["commands"] = self.commands.stats()
+        if self.frame_writer.received:
+            fields["led_frames"] = self.frame_writer.stats()
+        if change_filter is not None:
+            fields["report_by_exception"] = change_filter.stats()
+        if self.log_pipeline is not None:
+            fields["logging"] = self.log_pipeline.stats()
+        log.info("Statistics", extra=fields)
+
+    def publish_cycle(
+        self,
+        collected: Tuple[Reading, Dict[str, float] | None] | None,
+        change_filter: ChangeFilter | None,
+        supervisor: ConnectionSupervisor,
+    ):
+        """
+        Publish one cycle: the states of this device, when `collect()` returned
+        a reading, then those of the gateway devices and the statistics.
+
+        The gateway devices are read on their own, so a failed or skipped
+        reading of this device does not hold them back.
+        """
+        if collected is not None:
+            self.publish_metrics(*collected, change_filter)
+        self.publish_gateway()
+        self.report(change_filter, supervisor)
+
+    def build_gateway(self) -> Gateway | None:
+        """
+        Build the extra devices of the 'gateway' section of the configuration.
+
+        They share this process's MQTT connection; each has its own device id,
+        topics and discovery, see `Gateway`.
+
+        Returns
+        -------
+        Gateway | None
+            The gateway, or None when no devices are listed.
+        """
+        if not self.cfg.get("gateway", {}).get("devices"):
+            return None
+        try:
+            built = Gateway(self.cfg)
+        except ConfigError as ce:
+            sys.stderr.write(f"{ce}\n")
+            sys.exit(1)
+        log.info("Gateway serving %d more devices: %s", len(built), ", ".join(built.stats()))
+        return built
+
+    def build_runtime(
+        self,
+        seconds: int,
+        sampler: HighRateSampler | None,
+        change_filter: ChangeFilter | None,
+        supervisor: ConnectionSupervisor,
+    ) -> AsyncRuntime | None:
+        """
+        Build the asyncio runtime when 'runtime' is "asyncio" in the configuration.
+
+        Sampling, publishing, the LED matrix and received commands then run as
+        separate tasks, each offloading its blocking calls to its own thread.
+
+        Returns
+        -------
+        AsyncRuntime | None
+            The runtime, or None to run the sampling loop on the main thread.
+        """
+        if self.cfg.get("runtime") != "asyncio":
+            return None
+
+        def sample():
+            # Boxed: the runtime drops None samples, but the gateway devices still publish without this reading
+            try:
+                return [self.collect(sampler)]
+            except Exception as ex:
+                log.warning("Reading failed: %s", ex, extra={"event": "cycle"})
+                return [None]
+
+        self.runtime = AsyncRuntime(
+            sample=sample,
+            publish=lambda cycle: self.publish_cycle(cycle[0], change_filter, supervisor),
+            interval=seconds,
+            display=self.sensehat_device.show_message,
+            handle_command=self.commands.dispatch,
+        )
+        return self.runtime
+
+    def run(self):
+        """
+        Run the service until it is interrupted.
+
+        The configuration, the MQTT client and the SenseHat device are set up
+        by the constructor; this function:
+        1. Starts the command dispatcher and the LED frame writer.
+        2. Starts a `ConnectionSupervisor` that connects with `mqtt_connect()`, runs
+           the MQTT client loop and reconnects with backoff when the connection drops,
+           and the broker fan-out, if configured.
+        3. Starts the high-rate sampler, the IMU streamer, the spool backfill and the
+           configuration watcher, each if configured.
+        4. Runs the asyncio runtime if configured, or else loops reading the sensors and
+           publishing them every `seconds`; sampling continues while disconnected and
+           the spool, if configured, keeps the messages.
+        5. Handles keyboard interrupts and other exceptions gracefully.
+        6. Stops the background threads and disconnects from the MQTT broker.
+
+        Parameters:
+        - None
+
+        Return:
+        - The exit code: 0, 8 after a connection reset, 1 after another error.
+        """
+        exit_code = 0
+        seconds = self.cfg.seconds
+        # print(f"Starting sense-hat-mqtt. Warming up during 15 seconds.")
+        # time.sleep(15)  # Allow time for sense-hat to warm up and avoid erroneous data
+        log.info("Starting sense-hat-mqtt. Refreshing every %s seconds", seconds)
+
+        sampler = None
+        imu_streamer = None
+        backfill = None
+        watcher = None
+        supervisor = self.build_supervisor()
+        try:
+            counter = 1
+            #mqtt_connect(mqtt_client)
+            self.commands.start()
+            self.frame_writer.start()
+            # The supervisor connects and keeps reconnecting in the background
+            supervisor.start()
+            if self.fanout is not None:
+                self.fanout.start()
+            #mqtt_client.loop_forever()
+            sampler = self.build_sampler(seconds)
+            change_filter = self.build_change_filter()
+            imu_streamer = self.build_imu_streamer()
+            backfill = self.build_backfill()
+            if self.cfg.get("watch_config", True):
+                watcher = ConfigWatcher(CONFIG_PATH, self.cfg, self.apply_settings)
+                watcher.start()
+            self.runtime = self.build_runtime(seconds, sampler, change_filter, supervisor)
+            # Through the runtime the scroll no longer blocks the start-up
+            (self.runtime or self.sensehat_device).show_message(f"{counter}")
+            if self.runtime is not None:
+                log.info("Running the asyncio runtime")
+                self.runtime.run()
+            while self.runtime is None:
+                # -- mqtt_client.reconnect()
+                counter = counter + 1
+                if sampler is not None:
+                    # High-rate mode: the sampler thread fills the buffer while we wait
+                    time.sleep(self.cfg.seconds)
+                self.publish_cycle(self.collect(sampler), change_filter, supervisor)
+                if sampler is None:
+                    # Read every cycle: a reloaded configuration may change it
+                    log.debug("Sleeping for %s seconds.", self.cfg.seconds, extra={"event": "cycle"})
+                    time.sleep(self.cfg.seconds)
+        except KeyboardInterrupt as exc:
+            #client.loop_stop();
+            #client.disconnect();
+            log.info("KeyboardException, quitting... %s", exc)
+            supervisor.stop()
+            self.mqtt_client.disconnect();
+        except ConnectionResetError as cre:
+            #client.loop_stop();
+            #client.disconnect();
+            log.error("Connection error, sleeping... %s (%s)", cre, type(cre))
+            # sys.stderr.write(f"Exception: {cre}\n")
+            exit_code = 8
+            supervisor.stop()
+            self.mqtt_client.disconnect();
+        except BaseException as exx:
+            #client.loop_stop();
+            #client.disconnect();
+            log.exception("UnknownException, quitting... %s (%s)", exx, type(exx))
+            sys.stderr.write(f"Exception: {exx}\n")
+            exit_code = 1
+            supervisor.stop()
+            self.mqtt_client.disconnect();
+        finally:
+            # client.disconnect()
+            # Cerrar la conexión con el broker MQTT
+            log.info("Quitting...Closing loop and connection...")
+            if sampler is not None:
+                sampler.stop()
+            if imu_streamer is not None:
+                imu_streamer.stop()
+            if backfill is not None:
+                backfill.stop()
+            if watcher is not None:
+                watcher.stop()
+            if self.spool is not None:
+                self.spool.sync()
+            if self.fanout is not None:
+                self.fanout.stop()
+            if self.gateway is not None:
+                self.gateway.close()
+            self.commands.stop()
+            self.frame_writer.stop()
+            self.gpio_outputs.close()
+            #mqtt_client.loop_stop()
+            #mqtt_client.disconnect()
+            log.info("Exit! Done!")
+
+        return exit_code
+
+
+def main() -> int:
+    """Publish this SenseHat with the settings of config.json, starting over after connection errors."""
+    cfg = load_configuration()
+    # Log through a background thread: supervisord writes stdout unbuffered
+    log_pipeline = LogPipeline()
+    log_pipeline.configure(cfg.get("logging", {}), LOG_SAMPLE)
+    log_pipeline.start()
+    atexit.register(log_pipeline.stop)
+    try:
+        service = SenseHatService(cfg, log_pipeline)
+    except BaseException as ex:
+        log.error("SenseHat device initialization failed, quitting... %s (%s)", ex, type(ex))
+        # print(ex.with_traceback())
+        sys.stderr.write(f"Exception: {ex}\n")
+        #sys.stderr.write(f"Traceback: {ex.with_traceback()}\n")
+        sys.exit(1)
+    ec = service.run()
     while ec == 8:
         time.sleep(300)
-        ec = run()
+        ec = service.run()
+    return ec
 
 
-    sys.exit(ec)
+if __name__ == "__main__":
+    # Main Program
+    sys.exit(main())
 
     # end
@@ -0,0 +1,233 @@
+"""
+Non-blocking MQTT publishing with acknowledgement tracking.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Sequence, Tuple
+
+import numpy as np
+import paho.mqtt.client
+
+
+class PublishError(Exception):
+    """A message was rejected by the client or dropped before it was sent."""
+
+
+class AsyncPublisher:
+    """
+    Hands messages to the paho client without waiting for the network.
+
+    Every message gets a `Future` that completes when the client's
+    `on_publish` callback reports its message id: once written to the socket
+    for QoS 0, once acknowledged by the broker for QoS 1 and 2. At most
+    `max_inflight` messages are handed to the client at a time; the rest wait
+    in a bounded queue, which drops its oldest message when full.
+
+    `on_publish` must be registered as (or called from) the client's
+    on_publish callback, and every message on the client must go through
+    `publish`: a message id reported for a message sent directly could
+    complete another message once the 16-bit ids wrap around.
+    """
+
+    def __init__(
+        self,
+        client: paho.mqtt.client.Client,
+        max_inflight: int = 20,
+        max_pending: int = 1000,
+        latency_window: int = 1000,
+        clock: Callable[[], float] = time.monotonic,
+        aliases=None,
+    ):
+        """
+        Parameters
+        ----------
+        client
+            The MQTT client. Its network loop must run on another thread.
+        max_inflight
+            Maximum number of messages handed to the client and not yet
+            reported by `on_publish`.
+        max_pending
+            Maximum number of messages waiting for an in-flight slot.
+        latency_window
+            Number of recent publish latencies kept for the percentiles.
+        clock
+            Returns the current time in seconds.
+        aliases
+            An MQTT v5 `TopicAliases` applied to every message, if any.
+        """
+        if max_inflight < 1:
+            raise ValueError("max_inflight must be at least 1")
+        self.client = client
+        self.max_inflight = max_inflight
+        self.clock = clock
+        self.aliases = aliases
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+        # mid -> (future, time handed to the client)
+        self._inflight: Dict[int, Tuple[Future, float]] = {}
+        # (topic, payload, qos, retain, properties, future, time queued)
+        self._pending: Deque[tuple] = collections.deque(maxlen=max_pending)
+        # mid -> time on_publish reported it before publish() returned it
+        self._early: Dict[int, float] = {}
+        # Slots reserved by messages being handed to the client
+        self._sending = 0
+        self._latencies: Deque[float] = collections.deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False, properties=None) -> Future:
+        """
+        Queue a message and return immediately.
+
+        Parameters
+        ----------
+        topic
+            The topic.
+        payload
+            The payload, as accepted by paho.
+        qos
+            The quality of service.
+        retain
+            Whether the broker keeps the message.
+        properties
+            MQTT v5 publish properties.
+
+        Returns
+        -------
+        Future
+            Resolves to the publish latency in seconds, or fails with
+            `PublishError`.
+        """
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+        message = (topic, payload, qos, retain, properties, future, self.clock())
+        dropped = None
+        with self._lock:
+            if len(self._inflight) + self._sending >= self.max_inflight or self._pending:
+                if len(self._pending) == self._pending.maxlen:
+                    dropped = self._pending.popleft()
+                    self.dropped += 1
+                self._pending.append(message)
+                message = None
+            else:
+                self._sending += 1
+        if dropped is not None:
+            dropped[5].set_exception(PublishError(f"Dropped message to {dropped[0]}: queue full"))
+        if message is not None:
+            self._send(*message)
+        return future
+
+    def _send(self, topic, payload, qos, retain, properties, future: Future, queued: float):
+        # Called without the lock, with a slot reserved in _sending: paho holds its
+        # own locks while it calls on_publish, so holding ours here could deadlock
+        token = None
+        sent_topic = topic
+        if self.aliases is not None:
+            sent_topic, properties, token = self.aliases.apply(topic, qos, properties)
+        info = self.client.publish(sent_topic, payload, qos=qos, retain=retain, properties=properties)
+        if token is not None and info.rc == paho.mqtt.client.MQTT_ERR_SUCCESS:
+            self.aliases.confirm(token)
+        # Without a connection QoS 1 and 2 messages stay queued in the client and
+        # are sent on reconnect; QoS 0 messages are lost
+        accepted = info.rc == paho.mqtt.client.MQTT_ERR_SUCCESS or (
+            info.rc == paho.mqtt.client.MQTT_ERR_NO_CONN and qos > 0
+        )
+        latency = None
+        with self._lock:
+            self._sending -= 1
+            if not accepted:
+                self.failed += 1
+            elif self._early.pop(info.mid, None) is not None:
+                latency = self._record(queued)
+            else:
+                self._inflight[info.mid] = (future, queued)
+        if not accepted:
+            future.set_exception(
+                PublishError(f"Failed to publish to {topic}: {paho.mqtt.client.error_string(info.rc)}")
+            )
+        elif latency is not None:
+            future.set_result(latency)
+
+    def _record(self, queued: float) -> float:
+        # Called with the lock held
+        latency = self.clock() - queued
+        self._latencies.append(latency)
+        self.published += 1
+        return latency
+
+    def _fill(self):
+        # Move waiting messages into free slots
+        while True:
+            with self._lock:
+                if not self._pending or len(self._inflight) + self._sending >= self.max_inflight:
+                    return
+                message = self._pending.popleft()
+                self._sending += 1
+            self._send(*message)
+
+    def on_publish(self, client, userdata, mid: int):
+        """The client's on_publish callback."""
+        with self._lock:
+            entry = self._inflight.pop(mid, None)
+            if entry is None:
+                self._early[mid] = self.clock()
+                return
+            latency = self._record(entry[1])
+        entry[0].set_result(latency)
+        self._fill()
+
+    def expire(self, timeout: float) -> int:
+        """
+        Fail the in-flight messages older than `timeout` seconds, freeing their slots.
+
+        Returns
+        -------
+        int
+            The number of expired messages.
+        """
+        now = self.clock()
+        with self._lock:
+            expired = [mid for mid, (_, queued) in self._inflight.items() if now - queued > timeout]
+            futures = [(mid, self._inflight.pop(mid)[0]) for mid in expired]
+            self.failed += len(futures)
+            # Late acknowledgements of expired messages must not pile up. The recent
+            # ones stay: their message may be between client.publish and _send's lock
+            stale = [mid for mid, reported in self._early.items() if now - reported > timeout]
+            for mid in stale:
+                del self._early[mid]
+        for mid, future in futures:
+            future.set_exception(PublishError(f"Message {mid} not acknowledged after {timeout} seconds"))
+        self._fill()
+        return len(expired)
+
+    def latency_percentiles(self, percentiles: Sequence[float] = (50, 90, 99)) -> Dict[str, float]:
+        """
+        Return the recent publish latencies in milliseconds.
+
+        Returns
+        -------
+        Dict[str, float]
+            "p50" -> latency for each percentile, empty before the first
+            acknowledgement.
+        """
+        with self._lock:
+            latencies = np.fromiter(self._latencies, dtype=np.float64)
+        if latencies.size == 0:
+            return {}
+        values = np.percentile(latencies, percentiles) * 1000
+        return {f"p{p:g}": round(float(v), 1) for p, v in zip(percentiles, values)}
+
+    def stats(self) -> Dict[str, int]:
+        """Return the message counters and the current window occupancy."""
+        with self._lock:
+            return {
+                "published": self.published,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "inflight": len(self._inflight) + self._sending,
+                "pending": len(self._pending),
+            }
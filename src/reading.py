@@ -0,0 +1,128 @@
+"""
+A compact record of one set of SenseHat metrics.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import datetime
+import time
+from typing import Dict
+
+from serialization import STATE_TEMPLATE
+
+
+class Reading:
+    """
+    One set of metrics with its monotonic and wall-clock timestamps.
+
+    The record only holds floats. The string and JSON forms are built the
+    first time a sink asks for them and cached, so a loop that never needs
+    them never pays for them.
+    """
+
+    __slots__ = (
+        "temp_room",
+        "temp_cpu",
+        "temp_avg",
+        "humidity",
+        "pressure",
+        "monotonic",
+        "time",
+        "timings",
+        "_strings",
+        "_json",
+    )
+
+    # Metric fields, in the order they are serialized
+    FIELDS = ("temp_room", "temp_cpu", "temp_avg", "humidity", "pressure")
+
+    def __init__(
+        self,
+        temp_room: float,
+        temp_cpu: float,
+        temp_avg: float,
+        humidity: float,
+        pressure: float,
+        monotonic: float | None = None,
+        wall_time: float | None = None,
+        timings: Dict[str, float] | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        temp_room
+            The temperature in the room.
+        temp_cpu
+            The CPU temperature.
+        temp_avg
+            The temperature compensating for CPU heating.
+        humidity
+            The relative humidity.
+        pressure
+            The air pressure.
+        monotonic
+            `time.monotonic()` when the reading was taken, for intervals.
+        wall_time
+            `time.time()` when the reading was taken, for display and payloads.
+        timings
+            Seconds spent reading each sensor, if known.
+        """
+        self.temp_room = temp_room
+        self.temp_cpu = temp_cpu
+        self.temp_avg = temp_avg
+        self.humidity = humidity
+        self.pressure = pressure
+        self.monotonic = time.monotonic() if monotonic is None else monotonic
+        self.time = time.time() if wall_time is None else wall_time
+        self.timings = timings
+        self._strings = None
+        self._json = None
+
+    @property
+    def timestamp(self) -> datetime.datetime:
+        """The wall-clock time of the reading as a local datetime."""
+        return datetime.datetime.fromtimestamp(self.time)
+
+    def as_dict(self) -> Dict[str, float]:
+        """Return the metric fields as a dictionary of floats."""
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def as_strings(self) -> Dict[str, str]:
+        """Return the metric fields formatted as strings."""
+        if self._strings is None:
+            self._strings = {field: str(getattr(self, field)) for field in self.FIELDS}
+        return self._strings
+
+    def state_dict(self) -> Dict[str, float | str]:
+        """Return the reading with the keys of the JSON state document."""
+        return dict(
+            zip(
+                STATE_TEMPLATE.keys,
+                (
+                    self.temp_avg,
+                    self.temp_room,
+                    self.temp_cpu,
+                    self.pressure,
+                    self.humidity,
+                    self.temp_room,
+                    str(self.timestamp),
+                ),
+            )
+        )
+
+    def to_json(self) -> bytes:
+        """Return the reading as a UTF-8 JSON document."""
+        if self._json is None:
+            self._json = STATE_TEMPLATE.render(
+                self.temp_avg,
+                self.temp_room,
+                self.temp_cpu,
+                self.pressure,
+                self.humidity,
+                self.temp_room,
+                str(self.timestamp),
+            )
+        return self._json
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{field}={getattr(self, field)}" for field in self.FIELDS)
+        return f"Reading({values}, time={self.time})"
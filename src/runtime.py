@@ -0,0 +1,161 @@
+"""
+asyncio runtime running sampling, publishing, the LED display and commands as independent tasks.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+log = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """
+    Drives the sensor pipeline from one event loop.
+
+    Each stage is a task with its own single-thread executor for the blocking
+    calls it makes, so a slow scroll on the LED matrix or a slow I2C read only
+    delays its own stage. Stages hand work to each other through bounded
+    queues; when a queue is full the oldest item is dropped.
+
+    `show_message`, `submit_command` and `stop` may be called from any thread,
+    for example from paho callbacks.
+    """
+
+    def __init__(
+        self,
+        sample: Callable[[], Any],
+        publish: Callable[[Any], None],
+        interval: float,
+        display: Callable[[str], None] | None = None,
+        handle_command: Callable[[str, bytes], None] | None = None,
+        queue_size: int = 8,
+    ):
+        """
+        Parameters
+        ----------
+        sample
+            Takes one reading, or returns None when there is nothing to publish.
+        publish
+            Publishes one reading returned by `sample`.
+        interval
+            Seconds between the starts of two readings.
+        display
+            Shows a message on the LED matrix.
+        handle_command
+            Handles a message received on a subscribed topic.
+        queue_size
+            Capacity of each queue between the stages.
+        """
+        self.sample = sample
+        self.publish = publish
+        self.interval = interval
+        self.display = display
+        self.handle_command = handle_command
+        self.queue_size = queue_size
+        self.samples = 0
+        self.errors: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self._executors = {
+            name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+            for name in ("sensors", "network", "display", "commands")
+        }
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopped: asyncio.Event | None = None
+        # Queues bind to the event loop on first use, so items offered before run() are kept
+        self._queues = {name: asyncio.Queue(queue_size) for name in ("readings", "display", "commands")}
+
+    def _offer(self, name: str, item):
+        # Event loop only: enqueue, dropping the oldest item when full
+        queue = self._queues[name]
+        if queue.full():
+            queue.get_nowait()
+            self.dropped[name] = self.dropped.get(name, 0) + 1
+        queue.put_nowait(item)
+
+    def _threadsafe(self, name: str, item):
+        if self._loop is None:
+            self._offer(name, item)
+        else:
+            self._loop.call_soon_threadsafe(self._offer, name, item)
+
+    def show_message(self, message: str):
+        """Queue a message for the LED matrix. Only the latest pending one is shown."""
+        self._threadsafe("display", message)
+
+    def submit_command(self, topic: str, payload: bytes):
+        """Queue a received message for `handle_command`."""
+        self._threadsafe("commands", (topic, payload))
+
+    def stop(self):
+        """Ask the runtime to finish."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _offload(self, stage: str, executor: str, function: Callable, *args):
+        try:
+            return await self._loop.run_in_executor(self._executors[executor], function, *args)
+        except Exception as ex:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+            log.warning("%s failed: %s", stage, ex)
+            return None
+
+    async def _sampling(self):
+        while True:
+            started = self._loop.time()
+            reading = await self._offload("sampling", "sensors", self.sample)
+            if reading is not None:
+                self.samples += 1
+                self._offer("readings", reading)
+            await asyncio.sleep(max(0.0, self.interval - (self._loop.time() - started)))
+
+    async def _publishing(self):
+        queue = self._queues["readings"]
+        while True:
+            reading = await queue.get()
+            await self._offload("publishing", "network", self.publish, reading)
+
+    async def _displaying(self):
+        queue = self._queues["display"]
+        while True:
+            message = await queue.get()
+            # Coalesce: a message overtaken while the last one scrolled is skipped
+            while not queue.empty():
+                message = queue.get_nowait()
+            await self._offload("display", "display", self.display, message)
+
+    async def _commanding(self):
+        queue = self._queues["commands"]
+        while True:
+            topic, payload = await queue.get()
+            await self._offload("commands", "commands", self.handle_command, topic, payload)
+
+    async def main(self):
+        """Run every stage until `stop()` is called."""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        tasks = [
+            asyncio.create_task(self._sampling(), name="sampling"),
+            asyncio.create_task(self._publishing(), name="publishing"),
+        ]
+        if self.display is not None:
+            tasks.append(asyncio.create_task(self._displaying(), name="display"))
+        if self.handle_command is not None:
+            tasks.append(asyncio.create_task(self._commanding(), name="commands"))
+        try:
+            await self._stopped.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loop = None
+
+    def run(self):
+        """Run the event loop on the calling thread until `stop()` or Ctrl+C."""
+        try:
+            asyncio.run(self.main())
+        finally:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False)
@@ -0,0 +1,170 @@
+"""
+Reads independent sensors concurrently on a small thread pool.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import concurrent.futures
+import time
+from typing import Callable, Dict, List, Tuple
+
+
+class Sample:
+    """
+    A single timestamped set of sensor values assembled by `SamplingEngine`.
+    """
+
+    __slots__ = ("values", "timings", "errors", "time", "monotonic", "duration")
+
+    def __init__(self):
+        # sensor name -> value, None if the sensor failed or timed out
+        self.values: Dict[str, float | None] = {}
+        # sensor or device name -> seconds spent reading it
+        self.timings: Dict[str, float] = {}
+        # sensor or device name -> error description
+        self.errors: Dict[str, str] = {}
+        # Wall-clock time as seconds since the epoch
+        self.time = time.time()
+        self.monotonic = time.monotonic()
+        self.duration = 0.0
+
+    @property
+    def complete(self) -> bool:
+        """True when every sensor returned a value."""
+        return not self.errors
+
+    def slowest(self) -> List[str]:
+        """Return the device names ordered from slowest to fastest."""
+        return sorted(self.timings, key=self.timings.get, reverse=True)
+
+
+class IncompleteSample(Exception):
+    """
+    Raised when a `Sample` is missing values, because a sensor timed out,
+    was still busy or its driver failed.
+    """
+
+    def __init__(self, errors: Dict[str, str]):
+        """
+        Parameters
+        ----------
+        errors
+            The `Sample.errors` of the sample: sensor or device name -> error description.
+        """
+        super().__init__(f"Incomplete reading: {errors}")
+        self.errors = errors
+
+
+class SamplingEngine:
+    """
+    Samples groups of sensors concurrently.
+
+    Sensors are grouped by the physical device they live on. The sensors of one
+    device are read one after another in the same worker, because the drivers
+    are not safe to call from two threads at once; different devices are read
+    in parallel. Each device has its own timeout.
+    """
+
+    def __init__(
+        self,
+        devices: Dict[str, Dict[str | Tuple[str, ...], Callable]],
+        max_workers: int = 3,
+        timeout: float = 2.0,
+        timeouts: Dict[str, float] | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        devices
+            Device name -> {sensor name -> read function}. A tuple of sensor
+            names maps to a function returning one value per name.
+        max_workers
+            Size of the thread pool.
+        timeout
+            Default per-device timeout in seconds.
+        timeouts
+            Per-device timeout overrides in seconds.
+        """
+        self.devices = devices
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(devices))),
+            thread_name_prefix="sampler",
+        )
+        # Reads that timed out but are still running, so they are not stacked up
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+
+    @staticmethod
+    def _names(sensors) -> List[str]:
+        names = []
+        for name in sensors:
+            names.extend(name if isinstance(name, tuple) else (name,))
+        return names
+
+    @staticmethod
+    def _read_device(sensors):
+        values = {}
+        timings = {}
+        for name, read in sensors.items():
+            start = time.perf_counter()
+            result = read()
+            elapsed = time.perf_counter() - start
+            if isinstance(name, tuple):
+                # One read returning several values, such as a burst read
+                values.update(zip(name, result))
+                timings["+".join(name)] = elapsed
+            else:
+                values[name] = result
+                timings[name] = elapsed
+        return values, timings
+
+    def sample(self) -> Sample:
+        """
+        Read every device once and assemble the values into a `Sample`.
+
+        Returns
+        -------
+        Sample
+            Values of devices that failed or timed out are set to None and
+            the reason is recorded in `Sample.errors`.
+        """
+        sample = Sample()
+        start = time.perf_counter()
+        futures = {}
+        for device, sensors in self.devices.items():
+            previous = self._pending.get(device)
+            if previous is not None and not previous.done():
+                sample.errors[device] = "busy"
+                for name in self._names(sensors):
+                    sample.values[name] = None
+                continue
+            futures[device] = self._pool.submit(self._read_device, sensors)
+
+        for device, future in futures.items():
+            timeout = self.timeouts.get(device, self.timeout)
+            remaining = max(0.0, start + timeout - time.perf_counter())
+            try:
+                values, timings = future.result(timeout=remaining)
+                self._pending.pop(device, None)
+                sample.values.update(values)
+                sample.timings.update(timings)
+                sample.timings[device] = sum(timings.values())
+            except concurrent.futures.TimeoutError:
+                self._pending[device] = future
+                sample.errors[device] = "timeout"
+                sample.timings[device] = timeout
+                for name in self._names(self.devices[device]):
+                    sample.values[name] = None
+            except Exception as ex:
+                self._pending.pop(device, None)
+                sample.errors[device] = f"{type(ex).__name__}: {ex}"
+                sample.timings[device] = time.perf_counter() - start
+                for name in self._names(self.devices[device]):
+                    sample.values[name] = None
+
+        sample.duration = time.perf_counter() - start
+        return sample
+
+    def close(self):
+        """Stop the worker threads without waiting for stuck reads."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
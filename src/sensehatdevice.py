@@ -3,86 +3,142 @@ Represents a SenseHat device and provides methods to calculate various metrics.
 :copyright: (c) 2022-present Dan Rodrigues
 :license: MIT, see LICENSE for more details.
 """
-from operator import concat
-
 from typing import Dict
 import datetime
 import os
 import sys
-from xml.sax import default_parser_list
-from sense_hat import SenseHat
+from backends import SensorBackend, create_backend
+import psychrometrics
+from reading import Reading
+from sampler import IncompleteSample, SamplingEngine
+from settings import Settings, compile_settings
 
 
 class SenseHatDevice:
     """
     Represents a SenseHat device and provides methods to calculate various metrics.
     """
-    
 
-    def __init__(self, config: Dict[str, str | Dict[str, str]] | None):
+    # Channels returned by `read_raw()`, in order
+    RAW_CHANNELS = ("temp_room", "temp_cpu", "temp_avg", "humidity", "pressure")
+    # Number of decimals each metric is published with
+    PRECISION = {"temp_room": 1, "temp_cpu": 1, "temp_avg": 1, "humidity": 1, "pressure": 2}
+    # Key of each sensor topic in the combined state document, see `Reading.state_dict()`
+    STATE_KEYS = {
+        "humidity": "humidity",
+        "pressure": "pressure",
+        "temperature": "temperature",
+        "temp_room": "room",
+        "temp_avg": "avg",
+        "temp_cpu": "cpu",
+        "cpu": "cpu",
+    }
+
+    # Identity of a device without 'device_id', kept for existing Home Assistant entities
+    DEFAULT_DEVICE_ID = "sensehat01rpi"
+
+    def __init__(self, config: Settings | Dict[str, str | Dict[str, str]], backend: SensorBackend | None = None):
         """
         Initializes a new instance of the class with the provided configuration.
 
         Parameters:
-            config (object): The configuration object.
+            config (Settings): The configuration. A raw dictionary is validated
+                and compiled, raising ConfigError when it is invalid.
+            backend (SensorBackend): The sensors to read. Built from the 'backend'
+                section of the configuration when not given.
 
         Returns:
             None
         """
 
-        def validate_configuration(init_config: Dict[str, str] | None):
-            """
-            Validate the configuration to ensure it has all the required fields.
-            """
-            # Check if 'id' field exists
-            if "id" not in init_config:
-                sys.stderr.write("No 'id' field in configuration.\n")
-                sys.exit(1)
-
-            # Check if 'broker' field exists
-            if "broker" not in init_config:
-                sys.stderr.write("No 'broker' field in configuration.\n")
-                sys.exit(1)
-
-            # Check if 'topics' field exists
-            if "topics" not in init_config:
-                sys.stderr.write("No 'topics' field in configuration.\n")
-                sys.exit(1)
-
-            # Check if 'seconds' field exists
-            if "seconds" not in init_config:
-                sys.stderr.write("No 'seconds' field in configuration.\n")
-                sys.exit(1)
-
-        # Store the configuration object
-        self.cfg = config
-        validate_configuration(self.cfg)
-
-        # Initialize the SenseHat device
-        self.sense = SenseHat()
+        # Store the configuration, validated and with its topics precomputed
+        self.cfg = config if isinstance(config, Settings) else compile_settings(config)
+
+        # The Home Assistant device: one per SenseHat, several behind a gateway
+        self.device_id = self.cfg.get("device_id", self.DEFAULT_DEVICE_ID)
+        self.device_name = self.cfg.get("device_name", "SenseHat")
+
+        # Initialize the SenseHat device, or a simulated or replayed one
+        self.backend = backend if backend is not None else create_backend(self.cfg)
+
+        # Read the sensors of each chip concurrently with the other chips
+        sampling = self.cfg.get("sampling", {})
+        self.sampler = SamplingEngine(
+            self.backend.sampling_devices(),
+            max_workers=int(sampling.get("workers", 3)),
+            timeout=float(sampling.get("timeout", 2.0)),
+            timeouts=sampling.get("timeouts"),
+        )
 
         # Show a message on the SenseHat display
-        # self.sense.show_message("Starting")
+        # self.backend.show_message("Starting")
 
         # Clear the SenseHat display
-        self.sense.clear()
+        self.backend.clear()
 
     def get_temperature(self):
         """
-        Get the temperature using the `sense` object.
+        Get the temperature using the sensor backend.
 
         Returns:
             The temperature as a float.
         """
-        return self.sense.get_temperature()
+        return self.backend.get_temperature()
 
     def get_humidity(self):
         """Get the humidity value from the SenseHat sensor."""
-        return self.sense.get_humidity()
+        return self.backend.get_humidity()
 
     def get_pressure(self):
         """Get the pressure value from the SenseHat sensor."""
-        return self.sense.get_pressure()
+        return self.backend.get_pressure()
+
+    def unique_id(self, sensor: str) -> str:
+        """
+        Return the Home Assistant unique id of one of the device's sensors.
+
+        The default device keeps its original ids, e.g. "hum01rpi"; any other
+        device prefixes them with its 'device_id'.
+        """
+        if self.device_id == self.DEFAULT_DEVICE_ID:
+            return sensor + "01rpi"
+        return f"{self.device_id}_{sensor}"
+
+    def device_info(self) -> Dict[str, str]:
+        """Return the Home Assistant device block shared by every sensor of the device."""
+        return {
+            "identifiers": self.device_id,
+            "name": self.device_name,
+            "sw_version": "1.0",
+            "model": "Raspberry Pi 4 Model B+",
+            "manufacturer": "Raspberry Pi Foundation",
+        }
+
+    def combined_state_topic(self) -> str:
+        """Return the topic of the combined state document."""
+        return self.cfg.combined_state_topic
+
+    def state_fields(self, sensor: str) -> Dict[str, str]:
+        """
+        Return where Home Assistant finds the state of a sensor.
+
+        Parameters
+        ----------
+        sensor
+            The sensor topic key in the configuration.
+
+        Returns
+        -------
+        dict
+            The sensor's own 'state_topic', or with 'combined_state' enabled the
+            combined state topic and a 'value_template' selecting the sensor.
+        """
+        if self.cfg.get("combined_state"):
+            return {
+                "state_topic": self.combined_state_topic(),
+                "value_template": "{{ value_json." + self.STATE_KEYS.get(sensor, sensor) + " }}",
+            }
+        return {"state_topic": self.cfg.state_topics[sensor]}
 
     def message_config_humidity(self, sensor) -> Dict[str, str | Dict[str, str]]:
         """Generate a message configuration for the humidity sensor.
@@ -98,18 +154,12 @@ class SenseHatDevice:
         message = {
             "device_class": "humidity",
             "availability_topic": self.cfg["id"] + self.cfg["topics"]["availability"],
-            "state_topic": self.cfg["topics"][sensor] + self.cfg["topics"]["state"],
+            **self.state_fields(sensor),
             "unit_of_measurement": "%",
             "icon": "mdi:water-percent",
             "name": "Humidity",
-            "unique_id": "hum01rpi",
-            "device": {
-                "identifiers": "sensehat01rpi",
-                "name": "SenseHat",
-                "sw_version": "1.0",
-                "model": "Raspberry Pi 4 Model B+",
-                "manufacturer": "Raspberry Pi Foundation",
-            },
+            "unique_id": self.unique_id("hum"),
+            "device": self.device_info(),
         }
         return message
 
@@ -123,18 +173,12 @@ class SenseHatDevice:
         message = {
             "device_class": "pressure",
             "availability_topic": self.cfg["id"] + self.cfg["topics"]["availability"],
-            "state_topic": self.cfg["topics"][sensor] + self.cfg["topics"]["state"],
+            **self.state_fields(sensor),
             "unit_of_measurement": "hPa",
             "icon": "mdi:axis-arrow",
             "name": "Pressure",
-            "unique_id": "pre01rpi",
-            "device": {
-                "identifiers": "sensehat01rpi",
-                "name": "SenseHat",
-                "sw_version": "1.0",
-                "model": "Raspberry Pi 4 Model B+",
-                "manufacturer": "Raspberry Pi Foundation",
-            },
+            "unique_id": self.unique_id("pre"),
+            "device": self.device_info(),
         }
         return message
 
@@ -148,20 +192,14 @@ class SenseHatDevice:
         message = {
             "device_class": "temperature",
             "availability_topic": self.cfg["id"] + self.cfg["topics"]["availability"],
-            "state_topic": self.cfg["topics"][sensor] + self.cfg["topics"]["state"],
+            **self.state_fields(sensor),
             "unit_of_measurement": "°C",
             "state_class": "measurement",
             "temperature_unit": "C",
             "icon": "mdi:temperature-celsius",
             "name": "Temperature",
-            "unique_id": "temp01rpi",
-            "device": {
-                "identifiers": "sensehat01rpi",
-                "name": "SenseHat",
-                "sw_version": "1.0",
-                "model": "Raspberry Pi 4 Model B+",
-                "manufacturer": "Raspberry Pi Foundation",
-            },
+            "unique_id": self.unique_id("temp"),
+            "device": self.device_info(),
         }
         return message
 
@@ -183,7 +221,7 @@ class SenseHatDevice:
         message = {
             "device_class": "temperature",
             "availability_topic": self.cfg["id"] + self.cfg["topics"]["availability"],
-            "state_topic": self.cfg["topics"][sensor] + self.cfg["topics"]["state"],
+            **self.state_fields(sensor),
             "unit_of_measurement": "°C",
             "temperature_unit": "C",
             "entity_category": "measurement",
@@ -192,24 +230,30 @@ class SenseHatDevice:
             "name": "CPU Temperature",
             "object_id": "sensehat.sensor.cpu.temperature",
             # "value_template": "{{ value_json.temperature }}",
-            "unique_id": "cputemp01rpi",
-            "device": {
-                "identifiers": "sensehat01rpi",
-                "name": "SenseHat",
-                "sw_version": "1.0",
-                "model": "Raspberry Pi 4 Model B+",
-                "manufacturer": "Raspberry Pi Foundation",
-            },
+            "unique_id": self.unique_id("cputemp"),
+            "device": self.device_info(),
         }
         return message
 
 
     def show_message(self, message):
-        #self.sense.clear()
-        self.sense.show_message(message)
+        #self.backend.clear()
+        self.backend.show_message(message)
+
+    def set_pixels(self, pixels):
+        """Show a frame of 64 [r, g, b] pixels on the LED matrix."""
+        self.backend.set_pixels(pixels)
+
+    def write_frame(self, frame: bytes):
+        """Show a 128-byte framebuffer frame on the LED matrix, see `ledmatrix.to_framebuffer`."""
+        self.backend.write_frame(frame)
+
+    def recalibrate(self) -> bool:
+        """Reload the sensors' calibration; False when the backend cannot, see `SensorBackend.recalibrate`."""
+        return self.backend.recalibrate()
 
     # create a function to define a device with a few sensors for home assistant by using mqtt discovery feature.
-    def define_device(self, device_name: str, device_id: str, availability_topic: str, state_topic: str, device_class: str, unit_of_measurement: str, icon: str, name: str, unique_id: str, model: str, manufacturer: str) -> Dict[str, str | Dict[str, str]]:
+    def define_device(self, device_name: str, device_id: str, availability_topic: str, state_topic: str, device_class: str, unit_of_measurement: str, icon: str, name: str, unique_id: str, model: str, manufacturer: str, value_template: str | None = None) -> Dict[str, str | Dict[str, str]]:
         """
         Define a device with multiple sensors for Home Assistant using MQTT discovery feature.
 
@@ -225,6 +269,7 @@ class SenseHatDevice:
             unique_id (str): The unique ID of the device.
             model (str): The model of the device.
             manufacturer (str): The manufacturer of the device.
+            value_template (str): Template extracting the value from the state payload, if any.
 
         Returns:
             dict: A dictionary containing the message configuration for the device.
@@ -245,6 +290,8 @@ class SenseHatDevice:
                 "manufacturer": manufacturer,
             },
         }
+        if value_template is not None:
+            message["value_template"] = value_template
         return message
 
 
@@ -254,8 +301,8 @@ class SenseHatDevice:
         Define a SenseHat device with multiple sensors for Home Assistant using MQTT discovery feature.
         """
         # Define the configuration for the device
-        device_name = "SenseHat"
-        device_id = "sensehat01rpi"
+        device_name = self.device_name
+        device_id = self.device_id
         availability_topic = self.cfg["topics"]["device"] + self.cfg["topics"]["availability"]
         model = "Raspberry Pi 4 Model B+"
         manufacturer = "Raspberry Pi Foundation"
@@ -265,12 +312,12 @@ class SenseHatDevice:
             device_name=device_name,
             device_id=device_id,
             availability_topic=availability_topic,
-            state_topic=self.cfg["topics"]["humidity"] + self.cfg["topics"]["state"],
+            **self.state_fields("humidity"),
             device_class="humidity",
             unit_of_measurement="%",
             icon="mdi:water-percent",
             name="Humidity",
-            unique_id="hum01rpi",
+            unique_id=self.unique_id("hum"),
             model=model,
             manufacturer=manufacturer,
         )
@@ -280,27 +327,26 @@ class SenseHatDevice:
             device_name=device_name,
             device_id=device_id,
             availability_topic=availability_topic,
-            state_topic=self.cfg["topics"]["pressure"] + self.cfg["topics"]["state"],
+            **self.state_fields("pressure"),
             device_class="pressure",
             unit_of_measurement="hPa",
             icon="mdi:axis-arrow",
             name="Pressure",
-            unique_id="pre01rpi",
+            unique_id=self.unique_id("pre"),
             model=model,
             manufacturer=manufacturer,
         )
         
-        state_topic =(self.cfg["topics"]["temperature"].join(self.cfg["topics"]["state"])).lower()
         temperature_config = self.define_device(
             device_name=device_name,
             device_id=device_id,
             availability_topic=availability_topic,
-            state_topic=state_topic,
+            **self.state_fields("temperature"),
             device_class="temperature",
             unit_of_measurement="°C",
             icon="mdi:temperature-celsius",
             name="Temperature",
-            unique_id="temp01rpi",
+            unique_id=self.unique_id("temp"),
             model=model,
             manufacturer=manufacturer,
         )
@@ -325,82 +371,161 @@ class SenseHatDevice:
 
 
 
-    # def calculate_metrics(self) -> dict[str, float | dict[str, str]] | None:
-    def calculate_metrics(self) -> Dict[str, str | Dict[str, str]]:
+    def read_raw(self):
+        """
+        Read the environmental sensors once, without rounding or formatting.
+
+        Used by the high-rate sampler, so it does not go through the sampling
+        engine and only builds one tuple per call.
+
+        Returns:
+            tuple: The values of `RAW_CHANNELS`.
+        """
+        pressure, temp_from_pressure, humidity, temp_from_humidity, temp_cpu = self.backend.read_all()
+        temp_room = (temp_from_pressure + temp_from_humidity) / 2
+        temp_avg = temp_room - ((temp_cpu - temp_room) / 1.5)
+        return (temp_room, temp_cpu, temp_avg, humidity, pressure)
+
+    @staticmethod
+    def derive_columns(columns):
+        """
+        Compute the psychrometric values of a whole buffer of samples at once.
+
+        Parameters
+        ----------
+        columns
+            Arrays keyed like `RAW_CHANNELS`, e.g. `RingBuffer.columns()`.
+
+        Returns
+        -------
+        dict
+            Arrays keyed like `psychrometrics.DERIVED`.
+        """
+        return psychrometrics.compute(columns["temp_avg"], columns["humidity"], columns["pressure"])
+
+    def derived_metrics(self, reading: Reading) -> Dict[str, float]:
+        """
+        Compute the psychrometric values of one reading.
+
+        Uses the temperature compensated for CPU heating, like the clock display.
+
+        Returns
+        -------
+        Dict[str, float]
+            Dew point, heat index, vapor pressure, wet bulb and delta-T, rounded.
+        """
+        derived = psychrometrics.compute(reading.temp_avg, reading.humidity, reading.pressure)
+        return {name: round(float(value), 1) for name, value in derived.items()}
+
+    def message_config_derived(self, sensor: str) -> Dict[str, str | Dict[str, str]]:
+        """
+        Generate a message configuration for a derived psychrometric sensor.
+
+        Parameters
+        ----------
+        sensor
+            One of `psychrometrics.DERIVED`.
+
+        Returns
+        -------
+        dict
+            A discovery payload reading the value from the derived state document.
+        """
+        names = {
+            "dew_point": ("Dew Point", "temperature", "°C", "mdi:water-thermometer"),
+            "heat_index": ("Heat Index", "temperature", "°C", "mdi:thermometer-lines"),
+            "vapor_pressure": ("Vapor Pressure", "pressure", "mbar", "mdi:water"),
+            "wet_bulb": ("Wet Bulb", "temperature", "°C", "mdi:thermometer-water"),
+            "delta_t": ("Delta-T", None, "°C", "mdi:delta"),
+        }
+        name, device_class, unit, icon = names[sensor]
+        message = {
+            "availability_topic": self.cfg["topics"]["device"] + self.cfg["topics"]["availability"],
+            "state_topic": (
+                self.combined_state_topic()
+                if self.cfg.get("combined_state")
+                else self.cfg.derived_topic
+            ),
+            "value_template": "{{ value_json." + sensor + " }}",
+            "unit_of_measurement": unit,
+            "state_class": "measurement",
+            "icon": icon,
+            "name": name,
+            "unique_id": self.unique_id(sensor.replace("_", "")),
+            "device": self.device_info(),
+        }
+        if device_class is not None:
+            message["device_class"] = device_class
+        return message
+
+    def read_imu(self):
+        """
+        Read the accelerometer, gyroscope and magnetometer once.
+
+        Returns:
+            tuple: The x, y, z values of each sensor, see `backends.IMU_FIELDS`.
+        """
+        return self.backend.read_imu()
+
+    def metrics_from_stats(self, stats: Dict[str, Dict[str, float]]) -> Reading:
+        """
+        Build the published metrics from the aggregated high-rate statistics.
+
+        Parameters
+        ----------
+        stats
+            The result of `HighRateSampler.drain()`.
+
+        Returns
+        -------
+        Reading
+            The rounded mean of every channel.
+        """
+        return Reading(
+            **{
+                channel: round(stats[channel]["mean"], self.PRECISION[channel])
+                for channel in self.RAW_CHANNELS
+            }
+        )
+
+    def calculate_metrics(self) -> Reading:
         """
         Calculates various metrics including temperature, humidity, and pressure.
 
-        :return: A dictionary containing the calculated metrics:
-                 - 'temp_room': float - the temperature in the room
-                 - 'temp_cpu': float - the CPU temperature
-                 - 'temp_avg': float - the average temperature compensating for CPU heating
-                 - 'humidity': float - the humidity level
-                 - 'pressure': float - the air pressure
-                 - 'messages': dict - formatted values in JSON format
+        :return: A `Reading` with the calculated metrics:
+                 - temp_room: float - the temperature in the room
+                 - temp_cpu: float - the CPU temperature
+                 - temp_avg: float - the average temperature compensating for CPU heating
+                 - humidity: float - the humidity level
+                 - pressure: float - the air pressure
+                 - timings: dict - seconds spent reading each sensor and chip
+
+        :raises IncompleteSample: if a sensor timed out, was still busy or failed; its
+                                  `errors` are the `Sample.errors` of the reading.
         """
+        sample = self.sampler.sample()
+        if not sample.complete:
+            raise IncompleteSample(sample.errors)
+        values = sample.values
+
         # Credit to yaab-arduino.blogspot.com for this formula, which measures temperature from the
         # sense-hat but also takes CPU temperature into account for a slightly more accurate reading.
         temp_room = round(
             number=float(
-                (
-                        self.sense.get_temperature_from_pressure()
-                        + self.sense.get_temperature_from_humidity()
-                )
-                / 2
+                (values["temp_from_pressure"] + values["temp_from_humidity"]) / 2
             ),
             ndigits=1,
         )
-        temp_room_str = str(temp_room)
-        temp_cpu = round(
-            number=float(
-                os.popen("vcgencmd measure_temp")
-                .readline()
-                .replace("temp=", "")
-                .replace("'C\n", "")
-            ),
-            ndigits=1,
-        )
-        temp_cpu_str = str(temp_cpu)
+        temp_cpu = round(number=values["temp_cpu"], ndigits=1)
         # calculates the real temperature compensating CPU heating
         temp_avg = round(temp_room - ((temp_cpu - temp_room) / 1.5), 1)
-        temp_avg_str = str(temp_avg)
-        humidity = round(self.sense.get_humidity(), 1)
-        humidity_str = str(humidity)
-        pressure = round(self.sense.get_pressure(), 2)
-        pressure_str = str(pressure)
-        current_time = datetime.datetime.now()
-        json_str = (
-                '{ "avg": '
-                + temp_avg_str
-                + ', "room": '
-                + temp_room_str
-                + ', "cpu": '
-                + temp_cpu_str
-                + ', "pressure": '
-                + pressure_str
-                + ', "humidity": '
-                + humidity_str
-                + ', "temperature": '
-                + temp_room_str
-                + ', timestamp: "'
-                + str(current_time)
-                + '" }'
+        return Reading(
+            temp_room=temp_room,
+            temp_cpu=temp_cpu,
+            temp_avg=temp_avg,
+            humidity=round(values["humidity"], 1),
+            pressure=round(values["pressure"], 2),
+            monotonic=sample.monotonic,
+            wall_time=sample.time,
+            timings=sample.timings,
         )
-        formatted_values = {
-            "temp_room": temp_room_str,
-            "temp_cpu": temp_cpu_str,
-            "temp_avg": temp_avg_str,
-            "humidity": humidity_str,
-            "pressure": pressure_str,
-            "json": json_str,
-        }
-        result = {
-            "temp_room": temp_room,
-            "temp_cpu": temp_cpu,
-            "temp_avg": temp_avg,
-            "humidity": humidity,
-            "pressure": pressure,
-            "messages": formatted_values,
-            "timestamp": current_time,
-        }
-        return result
@@ -0,0 +1,97 @@
+"""
+Encodes MQTT payloads as JSON bytes.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import math
+from typing import Any, Sequence
+
+try:
+    import ujson
+
+    def _dumps(obj: Any) -> str:
+        return ujson.dumps(
+            obj, ensure_ascii=False, escape_forward_slashes=False, allow_nan=False
+        )
+
+except ImportError:  # pragma: no cover - ujson is optional
+    import json
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False
+        )
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encode an object as UTF-8 JSON bytes.
+
+    Uses `ujson` when it is installed and the standard library otherwise.
+    NaN and infinities, which are not valid JSON, are written as null.
+
+    Parameters
+    ----------
+    obj
+        Any JSON-serializable object.
+
+    Returns
+    -------
+    bytes
+        The encoded document, ready to be passed to `publish()`.
+    """
+    try:
+        return _dumps(obj).encode("utf-8")
+    except (ValueError, OverflowError):
+        return _dumps(_replace_non_finite(obj)).encode("utf-8")
+
+
+def _replace_non_finite(obj: Any) -> Any:
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _replace_non_finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_non_finite(value) for value in obj]
+    return obj
+
+
+class PayloadTemplate:
+    """
+    A JSON object with a fixed set of keys.
+
+    The keys are stored once in output order and callers only pass the
+    values. Each render still builds a dictionary and hands it to `dumps()`:
+    one call into ujson's C encoder is faster than formatting the values one
+    by one into precompiled key fragments in Python, see
+    bench/bench_serialization.py.
+    """
+
+    def __init__(self, keys: Sequence[str]):
+        """
+        Parameters
+        ----------
+        keys
+            The object keys in output order.
+        """
+        self.keys = tuple(keys)
+
+    def render(self, *values: Any) -> bytes:
+        """
+        Encode the values, given in key order, as JSON bytes.
+
+        The values are zipped with the keys into a new dictionary, which is
+        encoded like any other object: NaN and infinities become null.
+
+        Returns
+        -------
+        bytes
+            The encoded document.
+        """
+        return dumps(dict(zip(self.keys, values)))
+
+
+# The combined state document of a SenseHat reading
+STATE_TEMPLATE = PayloadTemplate(
+    ("avg", "room", "cpu", "pressure", "humidity", "temperature", "timestamp")
+)
@@ -0,0 +1,397 @@
+"""
+Compiled, validated and immutable configuration, with hot reload of config.json.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import ctypes
+import ctypes.util
+import dataclasses
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import types
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List
+
+log = logging.getLogger(__name__)
+
+# Required keys and their types
+SCHEMA = {
+    "id": str,
+    "seconds": (int, float),
+    "broker": {"host": str, "port": int},
+    "topics": {
+        "device": str,
+        "status": str,
+        "config": str,
+        "state": str,
+        "availability": str,
+        "humidity": str,
+        "pressure": str,
+        "temperature": str,
+    },
+}
+
+# Types of the optional keys, checked when present
+OPTIONAL = {
+    "sample_rate_hz": (int, float),
+    "combined_state": bool,
+    "derived": bool,
+    "runtime": str,
+    "watch_config": bool,
+    "backend": Mapping,
+    "i2c": Mapping,
+    "imu": Mapping,
+    "report_by_exception": Mapping,
+    "publish": Mapping,
+    "spool": Mapping,
+    "reconnect": Mapping,
+    "sampling": Mapping,
+    "brokers": (list, tuple),
+    "mqtt5": Mapping,
+    "payload_format": str,
+    "client_id": str,
+    "device_id": str,
+    "device_name": str,
+    "gateway": Mapping,
+    "commands": Mapping,
+    "led": Mapping,
+    "logging": Mapping,
+    "client": Mapping,
+}
+
+# Types of the optional keys of some sections, checked when present
+OPTIONAL_FIELDS = {
+    "broker": {"username": str, "password": str},
+    "client": {"certfile": str, "keyfile": str, "keyfile_password": str, "ca_certs": str},
+    "logging": {"sample": Mapping},
+    "topics": {
+        key: str
+        for key in ("temp_avg", "temp_room", "temp_cpu", "cpu", "derived", "stats", "imu", "backfill", "command")
+    },
+}
+
+# Values of 'logging.level'
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+# Topics with the sensor readings, each with a state and a config topic
+SENSOR_TOPICS = ("humidity", "pressure", "temperature", "temp_avg", "temp_room", "temp_cpu", "cpu")
+
+
+class ConfigError(ValueError):
+    """The configuration is missing, unreadable or does not match the schema."""
+
+
+def _check(value: Any, schema, path: str, problems: List[str]):
+    if isinstance(schema, dict):
+        if not isinstance(value, Mapping):
+            problems.append(f"'{path}' must be an object")
+            return
+        for key, child in schema.items():
+            child_path = f"{path}.{key}" if path else key
+            if key not in value:
+                problems.append(f"No '{child_path}' field in configuration")
+            else:
+                _check(value[key], child, child_path, problems)
+        return
+    expected = schema if isinstance(schema, tuple) else (schema,)
+    # bool is an int: only accept it where a bool is expected
+    if not isinstance(value, expected) or (isinstance(value, bool) and bool not in expected):
+        problems.append(f"'{path}' has the wrong type {type(value).__name__}")
+
+
+def validate(raw: Mapping) -> None:
+    """
+    Check a configuration against `SCHEMA` and `OPTIONAL`.
+
+    Parameters
+    ----------
+    raw
+        The parsed config.json.
+
+    Raises
+    ------
+    ConfigError
+        Listing every problem found.
+    """
+    problems: List[str] = []
+    _check(raw, SCHEMA, "", problems)
+    for key, expected in OPTIONAL.items():
+        if key in raw:
+            _check(raw[key], expected, key, problems)
+    for section, fields in OPTIONAL_FIELDS.items():
+        if isinstance(raw.get(section), Mapping):
+            for key, expected in fields.items():
+                if key in raw[section]:
+                    _check(raw[section][key], expected, f"{section}.{key}", problems)
+    if not problems and raw["seconds"] <= 0:
+        problems.append("'seconds' must be positive")
+    if not problems and raw.get("logging", {}).get("level", "info") not in LOG_LEVELS:
+        problems.append(f"'logging.level' must be one of {', '.join(LOG_LEVELS)}")
+    for event, n in raw.get("logging", {}).get("sample", {}).items() if not problems else ():
+        # EventFilter logs one record in n
+        if not isinstance(n, int) or isinstance(n, bool) or n < 1:
+            problems.append(f"'logging.sample.{event}' must be a positive integer")
+    for index, broker in enumerate(raw.get("brokers", ()) if not problems else ()):
+        if not isinstance(broker, Mapping) or not isinstance(broker.get("host"), str):
+            problems.append(f"'brokers[{index}]' must be an object with a 'host'")
+    if problems:
+        raise ConfigError("; ".join(problems))
+
+
+def freeze(value: Any) -> Any:
+    """Return a read-only copy: dicts become mapping proxies and lists tuples."""
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Return a mutable copy of a frozen value: the inverse of `freeze()`."""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """
+    A validated configuration with every topic precomputed.
+
+    `raw` keeps the whole configuration, read-only, for the sections that
+    are only read once at startup.
+    """
+
+    raw: Mapping[str, Any]
+    seconds: int
+    topics: Mapping[str, str]
+    state_topics: Mapping[str, str]
+    config_topics: Mapping[str, str]
+    availability_topic: str
+    status_topic: str
+    combined_state_topic: str
+    derived_topic: str
+    stats_topic: str
+    imu_topic: str
+    backfill_topic: str
+    command_topic: str
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return a top-level configuration value."""
+        return self.raw.get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        return self.raw[key]
+
+
+def compile_settings(raw: Dict[str, Any]) -> Settings:
+    """
+    Validate a parsed configuration and precompute its topics.
+
+    Raises
+    ------
+    ConfigError
+        When the configuration does not match the schema.
+    """
+    validate(raw)
+    frozen = freeze(raw)
+    topics = frozen["topics"]
+    device = topics["device"]
+    # Every cycle publishes the CPU temperature, so its topic has a default
+    sensor_topics = {"temp_cpu": device + "/cpu", **topics}
+    sensors = [sensor for sensor in SENSOR_TOPICS if sensor in sensor_topics]
+    return Settings(
+        raw=frozen,
+        seconds=int(raw["seconds"]),
+        topics=topics,
+        state_topics=types.MappingProxyType({sensor: sensor_topics[sensor] + topics["state"] for sensor in sensors}),
+        config_topics=types.MappingProxyType({sensor: sensor_topics[sensor] + topics["config"] for sensor in sensors}),
+        availability_topic=device + topics["availability"],
+        status_topic=device + topics["status"],
+        combined_state_topic=device + topics["state"],
+        derived_topic=topics.get("derived", device + "/derived"),
+        stats_topic=topics.get("stats", device + "/stats"),
+        imu_topic=topics.get("imu", device + "/imu"),
+        backfill_topic=topics.get("backfill", device + "/backfill"),
+        command_topic=topics.get("command", device + "/cmd"),
+    )
+
+
+def load_settings(path: str) -> Settings:
+    """
+    Read, validate and compile a config.json file.
+
+    Raises
+    ------
+    ConfigError
+        When the file is missing, empty, not JSON or does not match the schema.
+    """
+    if not os.path.exists(path):
+        raise ConfigError(f"Configuration file {path} not found.")
+    with open(path, "r", encoding="utf-8") as fp:
+        content = fp.read()
+    if content == "":
+        raise ConfigError(f"Configuration file {path} is empty.")
+    try:
+        raw = json.loads(content)
+    except ValueError as ve:
+        raise ConfigError(f"Configuration file {path} is not valid JSON: {ve}") from ve
+    return compile_settings(raw)
+
+
+# inotify(7) constants
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _load_libc():
+    path = ctypes.util.find_library("c")
+    try:
+        libc = ctypes.CDLL(path or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class ConfigWatcher:
+    """
+    Watches a configuration file and calls back with the new settings when
+    it changes.
+
+    Uses inotify on the file's directory, so that editors replacing the file
+    by a rename are seen too, and falls back to polling the modification time
+    where inotify is not available. A file that does not validate is
+    reported and ignored; the previous settings stay in force.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        current: Settings,
+        on_change: Callable[[Settings], None],
+        interval: float = 2.0,
+    ):
+        """
+        Parameters
+        ----------
+        path
+            The configuration file.
+        current
+            The settings in force.
+        on_change
+            Called on the watcher thread with the new settings.
+        interval
+            Seconds between checks when polling.
+        """
+        self.path = os.path.abspath(path)
+        self.current = current
+        self.on_change = on_change
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Start watching on a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and wait for the thread to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reload(self) -> bool:
+        """
+        Load the file and apply it if it changed.
+
+        Returns
+        -------
+        bool
+            True when new settings were applied.
+        """
+        try:
+            settings = load_settings(self.path)
+        except (ConfigError, OSError) as ex:
+            self.errors += 1
+            log.warning("Ignoring the new configuration: %s", ex)
+            return False
+        if settings == self.current:
+            return False
+        self.current = settings
+        self.reloads += 1
+        self.on_change(settings)
+        return True
+
+    def _loop(self):
+        libc = _load_libc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC) if libc is not None else -1
+        if fd < 0:
+            log.info("inotify is not available, polling the configuration file")
+            self._poll()
+            return
+        try:
+            directory = os.path.dirname(self.path).encode()
+            if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                log.warning("Cannot watch the configuration directory, polling instead")
+                self._poll()
+                return
+            # Catch a change made before the watch was set up; unchanged settings are ignored
+            self.reload()
+            name = os.path.basename(self.path).encode()
+            while not self._stop.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+                if name in self._read_events(fd):
+                    self.reload()
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _read_events(fd: int) -> List[bytes]:
+        try:
+            data = os.read(fd, 4096)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.append(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+        return names
+
+    def _poll(self):
+        def signature():
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return None
+            return stat.st_mtime_ns, stat.st_size
+
+        last = signature()
+        # Catch a change made before the first check; unchanged settings are ignored
+        self.reload()
+        while not self._stop.wait(self.interval):
+            current = signature()
+            if current != last and current is not None:
+                last = current
+                self.reload()
@@ -0,0 +1,404 @@
+"""
+Disk-backed store-and-forward queue for messages published while the broker is away.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, List, Tuple
+
+# crc32 of the rest of the record, payload length, original time, topic length
+RECORD_HEADER = struct.Struct("<IIdH")
+# Segment number and offset of the next record to replay
+CURSOR = struct.Struct("<QQ")
+
+SEGMENT_SUFFIX = ".seg"
+
+Record = Tuple[float, str, bytes]
+
+
+class SegmentLog:
+    """
+    An append-only log of (time, topic, payload) records in fixed-size,
+    memory-mapped segment files.
+
+    Records are appended to the newest segment and read back in order from a
+    cursor that survives restarts. Appends are flushed to disk every
+    `fsync_every` records or `fsync_interval` seconds, whichever comes first;
+    a record torn by a crash fails its checksum and ends the log there. When
+    the segments take more than `max_bytes`, the oldest one is deleted even if
+    it was not replayed yet.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = 1 << 20,
+        max_bytes: int = 64 << 20,
+        fsync_every: int = 32,
+        fsync_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Parameters
+        ----------
+        directory
+            Where the segments and the cursor are kept. Created if missing.
+        segment_size
+            The size of each segment file, which bounds the size of a record.
+        max_bytes
+            The disk space the segments may take.
+        fsync_every
+            Flush after this many appended records.
+        fsync_interval
+            Flush when the last flush is older than this many seconds.
+        clock
+            Returns the current time in seconds.
+        """
+        if segment_size <= RECORD_HEADER.size:
+            raise ValueError("segment_size is too small")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(2, max_bytes // segment_size)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.clock = clock
+        self.appended = 0
+        self.replayed = 0
+        self.evicted = 0
+        self.syncs = 0
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = clock()
+        self._readers = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        if not self.segments:
+            self.segments.append(0)
+        self._open_writer(self.segments[-1])
+        self._write_offset = self._scan(self._writer)[0]
+        self._cursor = self._load_cursor()
+        for segment in [segment for segment in self.segments if segment < self._cursor[0]]:
+            self._drop(segment)
+        self.pending = sum(self._count(segment) for segment in self.segments)
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:010d}{SEGMENT_SUFFIX}")
+
+    def _open_writer(self, segment: int):
+        path = self._path(segment)
+        self._file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        if os.fstat(self._file.fileno()).st_size < self.segment_size:
+            self._file.truncate(self.segment_size)
+        self._writer = mmap.mmap(self._file.fileno(), self.segment_size)
+
+    def _map(self, segment: int) -> mmap.mmap:
+        if segment == self.segments[-1]:
+            return self._writer
+        reader = self._readers.get(segment)
+        if reader is None:
+            with open(self._path(segment), "rb") as fp:
+                reader = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self._readers[segment] = reader
+        return reader
+
+    def _unmap(self, segment: int):
+        reader = self._readers.pop(segment, None)
+        if reader is not None:
+            reader.close()
+
+    @staticmethod
+    def _parse(buffer: mmap.mmap, offset: int) -> Tuple[Record, int] | None:
+        """Return the record at `offset` and the offset after it, or None at the end."""
+        if offset + RECORD_HEADER.size > len(buffer):
+            return None
+        crc, payload_length, timestamp, topic_length = RECORD_HEADER.unpack_from(buffer, offset)
+        if topic_length == 0:
+            return None
+        end = offset + RECORD_HEADER.size + topic_length + payload_length
+        if end > len(buffer) or zlib.crc32(buffer[offset + 4 : end]) != crc:
+            return None
+        body = offset + RECORD_HEADER.size
+        topic = buffer[body : body + topic_length].decode("utf-8")
+        return (timestamp, topic, bytes(buffer[body + topic_length : end])), end
+
+    def _scan(self, buffer: mmap.mmap, offset: int = 0) -> Tuple[int, int]:
+        """Return the offset after the last valid record and the number of records from `offset`."""
+        count = 0
+        while True:
+            parsed = self._parse(buffer, offset)
+            if parsed is None:
+                return offset, count
+            offset = parsed[1]
+            count += 1
+
+    def _count(self, segment: int) -> int:
+        if segment < self._cursor[0]:
+            return 0
+        start = self._cursor[1] if segment == self._cursor[0] else 0
+        return self._scan(self._map(segment), start)[1]
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, "cursor"), "rb") as fp:
+                segment, offset = CURSOR.unpack(fp.read(CURSOR.size))
+        except (OSError, struct.error):
+            return self.segments[0], 0
+        if segment not in self.segments:
+            # The segment was evicted or consumed: start at the oldest one left
+            return (self.segments[0], 0) if segment < self.segments[0] else (self.segments[-1], 0)
+        return segment, offset
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "wb") as fp:
+            fp.write(CURSOR.pack(*self._cursor))
+        os.replace(path + ".tmp", path)
+
+    def append(self, topic: str, payload: bytes, timestamp: float | None = None):
+        """
+        Append a record.
+
+        Parameters
+        ----------
+        topic
+            The topic the payload was meant for.
+        payload
+            The message.
+        timestamp
+            The original time of the message, defaults to now.
+        """
+        topic_bytes = topic.encode("utf-8")
+        size = RECORD_HEADER.size + len(topic_bytes) + len(payload)
+        if not topic_bytes or size > self.segment_size:
+            raise ValueError(f"Cannot spool a {size} byte record to topic '{topic}'")
+        header = RECORD_HEADER.pack(0, len(payload), time.time() if timestamp is None else timestamp, len(topic_bytes))
+        body = header[4:] + topic_bytes + payload
+        with self._lock:
+            if self._write_offset + size > self.segment_size:
+                self._roll()
+            offset = self._write_offset
+            self._writer[offset : offset + 4] = struct.pack("<I", zlib.crc32(body))
+            self._writer[offset + 4 : offset + size] = body
+            self._write_offset += size
+            self.appended += 1
+            self.pending += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or self.clock() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        # Called with the lock held
+        self._writer.flush()
+        self._unsynced = 0
+        self._last_sync = self.clock()
+        self.syncs += 1
+
+    def sync(self):
+        """Flush the appended records to disk."""
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def _roll(self):
+        # Called with the lock held: seal the full segment and start the next one
+        self._sync()
+        self._writer.close()
+        self._file.close()
+        segment = self.segments[-1] + 1
+        self.segments.append(segment)
+        self._open_writer(segment)
+        self._write_offset = 0
+        while len(self.segments) > self.max_segments:
+            self._evict()
+
+    def _evict(self):
+        oldest = self.segments[0]
+        if self._cursor[0] == oldest:
+            lost = self._count(oldest)
+            self.evicted += lost
+            self.pending -= lost
+            self._cursor = (self.segments[1], 0)
+            self._save_cursor()
+        self._drop(oldest)
+
+    def _drop(self, segment: int):
+        self._unmap(segment)
+        self.segments.remove(segment)
+        os.remove(self._path(segment))
+
+    def _read(self, limit: int) -> Tuple[List[Record], Tuple[int, int]]:
+        # Called with the lock held: the oldest records and the cursor after them
+        records = []
+        segment, offset = self._cursor
+        while len(records) < limit:
+            parsed = self._parse(self._map(segment), offset)
+            if parsed is None:
+                if segment == self.segments[-1]:
+                    break
+                segment, offset = self.segments[self.segments.index(segment) + 1], 0
+                continue
+            record, offset = parsed
+            records.append(record)
+        return records, (segment, offset)
+
+    def _advance(self, records: List[Record], cursor: Tuple[int, int]):
+        # Called with the lock held
+        for segment in [segment for segment in self.segments if segment < cursor[0]]:
+            # Fully replayed: the segment is no longer needed
+            self._drop(segment)
+        self._cursor = cursor
+        if records:
+            self.replayed += len(records)
+            self.pending -= len(records)
+            self._save_cursor()
+
+    def peek(self, limit: int = 1) -> List[Record]:
+        """
+        Return the oldest records without removing them, see `commit()`.
+
+        Parameters
+        ----------
+        limit
+            The maximum number of records.
+
+        Returns
+        -------
+        List[Record]
+            (original time, topic, payload) tuples; empty when all were replayed.
+        """
+        with self._lock:
+            return self._read(limit)[0]
+
+    def commit(self, records: List[Record]) -> int:
+        """
+        Remove records returned by `peek()`, once they were delivered.
+
+        Only the records still at the head of the log are removed: those
+        evicted in the meantime are already gone.
+
+        Returns
+        -------
+        int
+            The number of records removed.
+        """
+        with self._lock:
+            head, cursor = self._read(len(records))
+            count = 0
+            while count < len(head) and head[count] == records[count]:
+                count += 1
+            if count < len(head):
+                head, cursor = self._read(count)
+            self._advance(head, cursor)
+            return count
+
+    def pop(self, limit: int = 1) -> List[Record]:
+        """
+        Remove and return the oldest records, in the order they were appended.
+
+        Parameters
+        ----------
+        limit
+            The maximum number of records.
+
+        Returns
+        -------
+        List[Record]
+            (original time, topic, payload) tuples; empty when all were replayed.
+        """
+        with self._lock:
+            records, cursor = self._read(limit)
+            self._advance(records, cursor)
+        return records
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def close(self):
+        """Flush and unmap every segment."""
+        with self._lock:
+            self._sync()
+            for segment in list(self._readers):
+                self._unmap(segment)
+            self._writer.close()
+            self._file.close()
+
+
+class Backfill:
+    """
+    Replays a `SegmentLog` on a background thread at a limited rate whenever
+    `ready()` says the connection is up.
+
+    A record is only removed from the log once `send` returned: when it
+    raises, the record stays at the head and is sent again once the
+    connection is back, so delivery is at least once.
+    """
+
+    def __init__(
+        self,
+        log: SegmentLog,
+        send: Callable[[Record], None],
+        ready: Callable[[], bool],
+        rate: float = 5.0,
+    ):
+        """
+        Parameters
+        ----------
+        log
+            The spooled records.
+        send
+            Publishes one record and returns once the broker acknowledged
+            it; raises when it was not delivered.
+        ready
+            Returns True while records can be sent.
+        rate
+            Maximum number of records sent per second.
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.log = log
+        self.send = send
+        self.ready = ready
+        self.period = 1.0 / rate
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Start the replay thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="backfill", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the replay thread and wait for it to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not len(self.log) or not self.ready():
+                self._stop.wait(1.0)
+                continue
+            records = self.log.peek(1)
+            try:
+                for record in records:
+                    self.send(record)
+            except Exception:
+                # Kept in the log: wait for the connection before trying again
+                self.errors += 1
+                self._stop.wait(1.0)
+                continue
+            self.log.commit(records)
+            self._stop.wait(self.period)
@@ -0,0 +1,158 @@
+"""
+Keeps the MQTT connection up from inside the process.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict
+
+import paho.mqtt.client
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionSupervisor:
+    """
+    Runs the client's network loop on a background thread and reconnects
+    with capped exponential backoff and jitter whenever the connection drops.
+
+    The rest of the process keeps running while the broker is away. The
+    client's on_connect callback is expected to restore the subscriptions
+    and the availability message after every successful connection.
+
+    Every socket write happens on the supervisor thread. Without a network
+    thread of its own, paho writes from whichever thread calls publish(), so
+    two threads could write to the socket at once and interleave partial
+    packets. The supervisor registers the client's on_socket_register_write
+    callback, so publish() only queues the packet and wakes the select() in
+    loop().
+    """
+
+    def __init__(
+        self,
+        client: paho.mqtt.client.Client,
+        connect: Callable[[paho.mqtt.client.Client], object],
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        jitter: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Parameters
+        ----------
+        client
+            The MQTT client. Do not call its loop_start() as well, nor set its
+            on_socket_register_write callback.
+        connect
+            Opens the connection, for example `mqtt_connect`. Raises on failure.
+        base_delay
+            Seconds to wait after the first failed attempt.
+        max_delay
+            Cap of the delay between attempts.
+        jitter
+            Fraction of each delay that is randomized, so that many devices do
+            not reconnect to a restarted broker at the same instant.
+        clock
+            Returns the current time in seconds.
+        """
+        self.client = client
+        self.connect = connect
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.clock = clock
+        self.reconnects = 0
+        self.failures = 0
+        # Seconds to recover from the latest and the longest outage, and from all of them
+        self.last_recovery: float | None = None
+        self.max_recovery = 0.0
+        self.total_recovery = 0.0
+        self._attempt = 0
+        self._down_since: float | None = None
+        self._ever_connected = False
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._random = random.Random()
+        client.on_socket_register_write = self._on_socket_register_write
+
+    def start(self):
+        """Start the network thread, which makes the first connection."""
+        self._stop.clear()
+        self._down_since = self.clock()
+        self._thread = threading.Thread(target=self._loop, name="mqtt-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the network thread and wait for it to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def next_delay(self) -> float:
+        """Return how long to wait before the next attempt, and count the attempt."""
+        delay = min(self.max_delay, self.base_delay * 2 ** self._attempt)
+        self._attempt += 1
+        return delay * (1 - self.jitter * self._random.random())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        # Nothing to do: loop() selects the socket for writing while packets are queued
+        pass
+
+    def _loop(self):
+        connecting = True
+        while not self._stop.is_set():
+            if connecting:
+                try:
+                    self.connect(self.client)
+                except Exception as ex:
+                    self.failures += 1
+                    delay = self.next_delay()
+                    log.warning("Connection failed: %s. Retrying in %.1f seconds.", ex, delay)
+                    self._stop.wait(delay)
+                    continue
+                connecting = False
+            try:
+                rc = self.client.loop(timeout=1.0)
+            except OSError as ex:
+                log.warning("Network error: %s", ex)
+                rc = paho.mqtt.client.MQTT_ERR_CONN_LOST
+            if rc == paho.mqtt.client.MQTT_ERR_SUCCESS:
+                if self._down_since is not None and self.client.is_connected():
+                    self._recovered()
+                continue
+            if self._down_since is None:
+                self._down_since = self.clock()
+                log.warning("Connection lost: %s", paho.mqtt.client.error_string(rc))
+            else:
+                # The socket opened but the broker dropped or refused us: back off as well
+                self.failures += 1
+                self._stop.wait(self.next_delay())
+            connecting = True
+
+    def _recovered(self):
+        elapsed = self.clock() - self._down_since
+        self._down_since = None
+        self._attempt = 0
+        if self._ever_connected:
+            self.reconnects += 1
+            self.last_recovery = elapsed
+            self.max_recovery = max(self.max_recovery, elapsed)
+            self.total_recovery += elapsed
+            log.info("Reconnected after %.1f seconds.", elapsed)
+        self._ever_connected = True
+
+    def stats(self) -> Dict[str, float | int | bool]:
+        """Return the reconnect counters and the time-to-recover statistics in seconds."""
+        recovered = self.reconnects > 0
+        return {
+            "connected": self._down_since is None,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "last_recovery": round(self.last_recovery, 1) if recovered else None,
+            "max_recovery": round(self.max_recovery, 1) if recovered else None,
+            "mean_recovery": round(self.total_recovery / self.reconnects, 1) if recovered else None,
+        }
@@ -0,0 +1,135 @@
+"""
+Reads the CPU/SoC temperature from the Linux thermal sysfs interface.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import glob
+import os
+from typing import Dict, List, Tuple
+
+THERMAL_ROOT = "/sys/class/thermal"
+
+
+def read_vcgencmd() -> float:
+    """
+    Read the SoC temperature by running `vcgencmd measure_temp`.
+
+    This forks a subprocess on every call, so it is only used when the
+    thermal sysfs interface is not available.
+
+    Returns
+    -------
+    float
+        The temperature in degrees Celsius.
+    """
+    return float(
+        os.popen("vcgencmd measure_temp")
+        .readline()
+        .replace("temp=", "")
+        .replace("'C\n", "")
+    )
+
+
+class ThermalReader:
+    """
+    Keeps the `thermal_zone*/temp` files open and re-reads them with `pread`,
+    so a reading costs one system call instead of a fork and exec.
+    """
+
+    def __init__(self, root: str = THERMAL_ROOT, fallback: bool = True):
+        """
+        Open every thermal zone found under `root`.
+
+        Parameters
+        ----------
+        root
+            The thermal sysfs directory. Tests point it at a fake tree.
+        fallback
+            Use `vcgencmd` when no zone can be read.
+        """
+        self.root = root
+        self.fallback = fallback
+        # (zone name, zone type, file descriptor), ordered by zone number
+        self.zones: List[Tuple[str, str, int]] = []
+        self._open_zones()
+
+    def _open_zones(self):
+        def zone_number(path: str) -> int:
+            suffix = os.path.basename(path)[len("thermal_zone"):]
+            return int(suffix) if suffix.isdigit() else -1
+
+        paths = glob.glob(os.path.join(self.root, "thermal_zone*"))
+        for path in sorted(paths, key=zone_number):
+            name = os.path.basename(path)
+            try:
+                with open(os.path.join(path, "type"), "r", encoding="utf-8") as fp:
+                    zone_type = fp.read().strip()
+            except OSError:
+                zone_type = name
+            try:
+                fd = os.open(os.path.join(path, "temp"), os.O_RDONLY)
+            except OSError:
+                continue
+            self.zones.append((name, zone_type, fd))
+
+    @staticmethod
+    def _read_fd(fd: int) -> float:
+        # sysfs regenerates the value on every read from offset 0, in millidegrees
+        return int(os.pread(fd, 32, 0)) / 1000.0
+
+    def read_all(self) -> Dict[str, float]:
+        """
+        Read every open thermal zone.
+
+        Returns
+        -------
+        Dict[str, float]
+            The temperature in degrees Celsius keyed by zone type.
+            Zones that fail to read are left out.
+        """
+        temps = {}
+        for _name, zone_type, fd in self.zones:
+            try:
+                temps[zone_type] = self._read_fd(fd)
+            except (OSError, ValueError):
+                continue
+        return temps
+
+    def read(self) -> float:
+        """
+        Read the CPU temperature.
+
+        The first zone (`thermal_zone0`, the `cpu-thermal` zone on a Raspberry
+        Pi) is used. If it cannot be read, `vcgencmd` is used as a fallback.
+
+        Returns
+        -------
+        float
+            The temperature in degrees Celsius.
+        """
+        for _name, _zone_type, fd in self.zones:
+            try:
+                return self._read_fd(fd)
+            except (OSError, ValueError):
+                continue
+        if not self.fallback:
+            raise OSError(f"No readable thermal zone under {self.root}")
+        return read_vcgencmd()
+
+    def close(self):
+        """Close the open thermal zone files."""
+        for _name, _zone_type, fd in self.zones:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.zones = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
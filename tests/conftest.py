@@ -0,0 +1,9 @@
+"""
+Puts src/ on the import path: its modules import each other as top-level scripts.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
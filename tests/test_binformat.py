@@ -0,0 +1,61 @@
+"""
+Tests of the binary tables and their schema ids.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import numpy as np
+import pytest
+
+from binencoder import StatsEncoder, TableEncoder
+from binformat import FormatError, UnknownSchema, decode, decode_stats, parse_schema, schema_id
+
+STATS = {
+    "temp_room": {"mean": 21.5, "min": 21.0, "max": 22.0, "stddev": 0.25, "count": 100},
+    "humidity": {"mean": 40.0, "min": 39.5, "max": 40.5, "stddev": 0.5, "count": 100},
+}
+
+
+def test_named_table_round_trip():
+    encoder = TableEncoder(("time", "x"))
+    rows = np.array([[1000.0, 1.5], [1000.5, 2.5]])
+    table = decode(encoder.encode(rows, rate_hz=2.0))
+    assert table["columns"] == ("time", "x")
+    assert table["rows"] == [[1000.0, 1.5], [1000.5, 2.5]]
+    assert table["rate"] == 2.0
+
+
+def test_stats_carry_the_schema_id_instead_of_the_names():
+    encoder = StatsEncoder(tuple(STATS))
+    payload = encoder.encode(STATS, 119.0, 1000.0)
+    named = StatsEncoder(tuple(STATS), schema=False).encode(STATS, 119.0, 1000.0)
+    assert encoder.table.schema_id in payload
+    assert encoder.table.names not in payload
+    assert len(named) - len(payload) == len(encoder.table.names) - len(encoder.table.schema_id)
+
+
+def test_stats_decode_with_the_published_schema():
+    encoder = StatsEncoder(tuple(STATS))
+    payload = encoder.encode(STATS, 119.0, 1000.0)
+    schemas = dict([parse_schema(encoder.table.names)])
+    assert decode_stats(payload, schemas) == STATS
+
+
+def test_unknown_schema():
+    payload = StatsEncoder(tuple(STATS)).encode(STATS, 119.0, 1000.0)
+    with pytest.raises(UnknownSchema):
+        decode_stats(payload)
+    with pytest.raises(FormatError):
+        decode_stats(payload, {b"00000000": ("count",)})
+
+
+def test_schema_id_follows_the_names():
+    assert schema_id(b"a,b") == schema_id(b"a,b")
+    assert schema_id(b"a,b") != schema_id(b"b,a")
+    assert len(schema_id(b"a,b")) == 8
+    assert parse_schema(b"a.mean,count") == (schema_id(b"a.mean,count"), ("a.mean", "count"))
+
+
+def test_truncated_payload():
+    payload = StatsEncoder(tuple(STATS), schema=False).encode(STATS, 119.0, 1000.0)
+    with pytest.raises(FormatError):
+        decode(payload[:-1])
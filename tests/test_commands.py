@@ -0,0 +1,132 @@
+"""
+Tests of the wildcard topic trie and the command dispatcher.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import threading
+
+import pytest
+
+from commands import CommandDispatcher, TopicTrie
+
+
+def handler(name):
+    def handle(topic, payload):
+        pass
+    handle.__name__ = name
+    return handle
+
+
+def names(handlers):
+    return [h.__name__ for h in handlers]
+
+
+def test_hash_matches_its_parent_and_every_level_below():
+    trie = TopicTrie()
+    trie.add("a/#", handler("a/#"))
+    assert names(trie.match("a")) == ["a/#"]
+    assert names(trie.match("a/b")) == ["a/#"]
+    assert names(trie.match("a/b/c")) == ["a/#"]
+    assert trie.match("b") == ()
+    assert trie.match("ab") == ()
+
+
+@pytest.mark.parametrize("topic_filter", ["+/b/c", "a/+/c", "a/b/+", "+/+/+"])
+def test_plus_matches_one_whole_level(topic_filter):
+    trie = TopicTrie()
+    trie.add(topic_filter, handler(topic_filter))
+    assert names(trie.match("a/b/c")) == [topic_filter]
+    assert trie.match("a/b") == ()
+    assert trie.match("a/b/c/d") == ()
+
+
+def test_every_matching_filter_is_returned():
+    trie = TopicTrie()
+    trie.add("a/b", handler("exact"))
+    trie.add("a/+", handler("plus"))
+    trie.add("#", handler("all"))
+    trie.add("a/b", handler("exact again"))
+    matched = names(trie.match("a/b"))
+    assert sorted(matched) == ["all", "exact", "exact again", "plus"]
+    # The handlers of one filter keep their registration order
+    assert matched.index("exact") < matched.index("exact again")
+    assert sorted(names(trie.match("a/c"))) == ["all", "plus"]
+
+
+@pytest.mark.parametrize("topic_filter", ["a/#/b", "#/a", "a/b#", "a+/b", "a/+b", "a/#b"])
+def test_invalid_filters_are_rejected(topic_filter):
+    with pytest.raises(ValueError):
+        TopicTrie().add(topic_filter, handler("invalid"))
+
+
+def test_wildcard_first_level_does_not_match_dollar_topics():
+    trie = TopicTrie()
+    trie.add("#", handler("#"))
+    trie.add("+/broker/uptime", handler("+"))
+    trie.add("$SYS/#", handler("$SYS/#"))
+    trie.add("$SYS/+/uptime", handler("$SYS/+"))
+    assert sorted(names(trie.match("$SYS/broker/uptime"))) == ["$SYS/#", "$SYS/+"]
+    assert sorted(names(trie.match("sys/broker/uptime"))) == ["#", "+"]
+
+
+def test_add_clears_the_cache():
+    trie = TopicTrie()
+    assert trie.match("a/b") == ()
+    trie.add("a/+", handler("a/+"))
+    assert names(trie.match("a/b")) == ["a/+"]
+
+
+def test_cache_is_bounded():
+    trie = TopicTrie(cache_size=4)
+    trie.add("a/+", handler("a/+"))
+    for i in range(10):
+        assert names(trie.match(f"a/{i}")) == ["a/+"]
+        assert len(trie._cache) <= 4
+
+
+def test_submit_drops_the_oldest_message_when_full():
+    handled = []
+    done = threading.Event()
+
+    def handle(topic, payload):
+        handled.append(payload)
+        if payload == b"3":
+            done.set()
+
+    dispatcher = CommandDispatcher(queue_size=2)
+    dispatcher.register("cmd/+", handle)
+    for payload in (b"1", b"2", b"3"):
+        dispatcher.submit("cmd/x", payload)
+    assert dispatcher.stats()["dropped"] == 1
+    dispatcher.start()
+    try:
+        assert done.wait(5)
+    finally:
+        dispatcher.stop()
+    assert handled == [b"2", b"3"]
+    assert dispatcher.stats() == {"dispatched": 2, "unmatched": 0, "dropped": 1, "errors": 0, "queued": 0}
+
+
+def test_handler_errors_are_counted():
+    dispatcher = CommandDispatcher()
+
+    def fail(topic, payload):
+        raise RuntimeError("bad command")
+
+    dispatcher.register("cmd", fail)
+    assert dispatcher.dispatch("cmd", b"")
+    assert dispatcher.stats()["errors"] == 1
+
+
+def test_reset_forgets_every_filter():
+    unmatched = []
+    dispatcher = CommandDispatcher(default=lambda topic, payload: unmatched.append(topic))
+    dispatcher.register("old/cmd", handler("worker"))
+    dispatcher.register("old/stream", handler("inline"), inline=True)
+    dispatcher.reset()
+    assert not dispatcher.handle_inline("old/stream", b"")
+    assert not dispatcher.dispatch("old/cmd", b"")
+    assert unmatched == ["old/cmd"]
+    dispatcher.register("new/cmd", handler("worker"))
+    assert dispatcher.dispatch("new/cmd", b"")
+    assert dispatcher.stats()["unmatched"] == 1
@@ -0,0 +1,65 @@
+"""
+Tests of the report-by-exception filter.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+from deadband import ChangeFilter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_committed_value_becomes_the_reference():
+    change_filter = ChangeFilter({"humidity": {"absolute": 1.0}}, clock=Clock())
+    assert change_filter.should_publish("humidity", 40.0)
+    change_filter.commit("humidity")
+    assert not change_filter.should_publish("humidity", 40.5)
+    assert change_filter.stats()["humidity"] == {"published": 1, "suppressed": 1, "heartbeats": 0}
+
+
+def test_rolled_back_value_is_published_again():
+    change_filter = ChangeFilter({"humidity": {"absolute": 1.0}}, clock=Clock())
+    assert change_filter.should_publish("humidity", 40.0)
+    change_filter.rollback("humidity")
+    assert change_filter.should_publish("humidity", 40.0)
+    change_filter.commit("humidity")
+    assert change_filter.stats()["humidity"]["published"] == 1
+
+
+def test_rollback_keeps_the_last_published_reference():
+    change_filter = ChangeFilter({"humidity": {"absolute": 1.0}}, clock=Clock())
+    change_filter.should_publish("humidity", 40.0)
+    change_filter.commit("humidity")
+    assert change_filter.should_publish("humidity", 42.0)
+    change_filter.rollback("humidity")
+    # Compared with 40.0, the last value actually published
+    assert change_filter.should_publish("humidity", 41.5)
+
+
+def test_heartbeat_counts_once_committed():
+    clock = Clock()
+    change_filter = ChangeFilter(heartbeat=10.0, clock=clock)
+    change_filter.should_publish("pressure", 1000.0)
+    change_filter.commit("pressure")
+    clock.now = 11.0
+    assert change_filter.should_publish("pressure", 1000.0)
+    change_filter.rollback("pressure")
+    assert change_filter.stats()["pressure"]["heartbeats"] == 0
+    assert change_filter.should_publish("pressure", 1000.0)
+    change_filter.commit("pressure")
+    assert change_filter.stats()["pressure"]["heartbeats"] == 1
+
+
+def test_document_rollback_keeps_every_reference():
+    change_filter = ChangeFilter({"default": {"absolute": 1.0}}, clock=Clock())
+    values = {"humidity": 40.0, "pressure": 1000.0}
+    assert change_filter.should_publish_all("state", values)
+    change_filter.rollback("state")
+    assert change_filter.should_publish_all("state", values)
+    change_filter.commit("state")
+    assert not change_filter.should_publish_all("state", {"humidity": 40.5, "pressure": 1000.5})
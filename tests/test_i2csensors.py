@@ -0,0 +1,162 @@
+"""
+Tests of the direct I2C drivers against an in-memory register map.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import struct
+import threading
+
+import pytest
+
+from i2csensors import HTS221, HTS221_ADDRESS, LPS25H, LPS25H_ADDRESS, MemoryBus
+
+
+def load_hts221(bus, h_out=3000, t_out=400):
+    registers = bus.device(HTS221_ADDRESS)
+    # 20 %rH at 0 counts and 80 %rH at 6000; 10 degC at 100 counts and 40 degC at 700
+    calibration = bytearray(16)
+    calibration[0] = 40
+    calibration[1] = 160
+    calibration[2] = 80
+    calibration[3] = 320 & 0xFF
+    calibration[5] = (320 >> 8) << 2
+    struct.pack_into("<h", calibration, 6, 0)
+    struct.pack_into("<h", calibration, 10, 6000)
+    struct.pack_into("<hh", calibration, 12, 100, 700)
+    registers[HTS221.REG_CALIB_0:HTS221.REG_CALIB_0 + 16] = calibration
+    set_hts221_output(bus, h_out, t_out)
+
+
+def set_hts221_output(bus, h_out, t_out):
+    registers = bus.device(HTS221_ADDRESS)
+    registers[HTS221.REG_HUMIDITY_OUT_L:HTS221.REG_HUMIDITY_OUT_L + 4] = struct.pack("<hh", h_out, t_out)
+
+
+def load_lps25h(bus, p_out, t_out):
+    registers = bus.device(LPS25H_ADDRESS)
+    registers[LPS25H.REG_PRESS_OUT_XL:LPS25H.REG_PRESS_OUT_XL + 3] = p_out.to_bytes(3, "little", signed=True)
+    registers[LPS25H.REG_PRESS_OUT_XL + 3:LPS25H.REG_PRESS_OUT_XL + 5] = t_out.to_bytes(2, "little", signed=True)
+
+
+def test_hts221_calibration():
+    bus = MemoryBus()
+    load_hts221(bus)
+    assert HTS221(bus).calibration() == (20.0, 80.0, 0, 6000, 10.0, 40.0, 100, 700)
+
+
+def test_hts221_conversion():
+    bus = MemoryBus()
+    load_hts221(bus, h_out=3000, t_out=400)
+    humidity, temperature = HTS221(bus).read()
+    assert humidity == pytest.approx(50.0)
+    assert temperature == pytest.approx(25.0)
+
+
+@pytest.mark.parametrize("h_out, humidity", [(-1000, 10.0), (-6000, 0.0), (12000, 100.0)])
+def test_hts221_humidity_is_clamped(h_out, humidity):
+    bus = MemoryBus()
+    load_hts221(bus, h_out=h_out)
+    assert HTS221(bus).get_humidity() == pytest.approx(humidity)
+
+
+def test_hts221_is_powered_on():
+    bus = MemoryBus()
+    HTS221(bus)
+    assert bus.device(HTS221_ADDRESS)[HTS221.REG_CTRL_REG1] == 0x87
+
+
+def test_hts221_one_burst_read_per_measurement():
+    bus = MemoryBus()
+    load_hts221(bus)
+    sensor = HTS221(bus)
+    sensor.calibration()
+    bus.transactions = 0
+    sensor.read()
+    assert bus.transactions == 1
+    sensor.get_humidity()
+    sensor.get_temperature()
+    assert bus.transactions == 3
+
+
+def test_hts221_calibration_is_cached_until_recalibrate():
+    bus = MemoryBus()
+    load_hts221(bus)
+    sensor = HTS221(bus)
+    bus.transactions = 0
+    sensor.read()
+    # The calibration block and the output registers
+    assert bus.transactions == 2
+    # A changed calibration block is ignored until the cache is dropped
+    bus.device(HTS221_ADDRESS)[HTS221.REG_CALIB_0 + 1] = 120
+    sensor.read()
+    assert bus.transactions == 3
+    assert sensor.get_humidity() == pytest.approx(50.0)
+    sensor.recalibrate()
+    bus.transactions = 0
+    # 20 %rH at 0 counts and 60 %rH at 6000 now
+    assert sensor.get_humidity() == pytest.approx(40.0)
+    assert bus.transactions == 2
+
+
+def test_lps25h_conversion():
+    bus = MemoryBus()
+    load_lps25h(bus, p_out=round(1013.25 * 4096), t_out=-8400)
+    pressure, temperature = LPS25H(bus).read()
+    assert pressure == pytest.approx(1013.25)
+    assert temperature == pytest.approx(25.0)
+
+
+def test_lps25h_negative_temperature():
+    bus = MemoryBus()
+    load_lps25h(bus, p_out=4096 * 900, t_out=-24000)
+    assert LPS25H(bus).get_temperature() == pytest.approx(-7.5)
+
+
+def test_lps25h_set_up_like_rtimulib():
+    bus = MemoryBus()
+    LPS25H(bus)
+    registers = bus.device(LPS25H_ADDRESS)
+    assert registers[LPS25H.REG_CTRL_REG1] == 0xC4
+    assert registers[LPS25H.REG_RES_CONF] == 0x05
+    assert registers[LPS25H.REG_FIFO_CTRL] == 0xC0
+    assert registers[LPS25H.REG_CTRL_REG2] == 0x40
+
+
+def test_lps25h_one_burst_read_per_measurement():
+    bus = MemoryBus()
+    load_lps25h(bus, p_out=4096 * 1000, t_out=0)
+    sensor = LPS25H(bus)
+    bus.transactions = 0
+    assert sensor.read() == (1000.0, 42.5)
+    assert bus.transactions == 1
+
+
+def test_who_am_i():
+    bus = MemoryBus()
+    bus.device(HTS221_ADDRESS)[0x0F] = 0xBC
+    bus.device(LPS25H_ADDRESS)[0x0F] = 0xBD
+    assert HTS221(bus).who_am_i() == 0xBC
+    assert LPS25H(bus).who_am_i() == 0xBD
+
+
+def test_drivers_on_one_bus_share_its_lock():
+    bus = MemoryBus()
+    load_hts221(bus)
+    load_lps25h(bus, p_out=4096 * 1000, t_out=0)
+    lock = threading.Lock()
+    hts221 = HTS221(bus, lock=lock)
+    lps25h = LPS25H(bus, lock=lock)
+    results = []
+    with lock:
+        readers = [threading.Thread(target=lambda sensor=sensor: results.append(sensor.read()))
+                   for sensor in (hts221, lps25h)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join(0.1)
+        # Neither can touch the bus while another transfer holds it
+        assert all(reader.is_alive() for reader in readers)
+        assert results == []
+    for reader in readers:
+        reader.join(1)
+    assert sorted(results) == [(50.0, 25.0), (1000.0, 42.5)]
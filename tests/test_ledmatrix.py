@@ -0,0 +1,108 @@
+"""
+Tests of the LED matrix frame conversions and of the coalescing frame writer.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import random
+import threading
+import time
+
+import pytest
+
+from ledmatrix import (
+    RGB565_FRAME_SIZE,
+    RGB_FRAME_SIZE,
+    FrameWriter,
+    decode_frame,
+    framebuffer_pixels,
+    to_framebuffer,
+)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def rgb565_frame(seed):
+    return random.Random(seed).randbytes(RGB565_FRAME_SIZE)
+
+
+def test_rgb565_round_trip():
+    payload = rgb565_frame(1)
+    frame = to_framebuffer(payload)
+    assert len(frame) == RGB565_FRAME_SIZE
+    assert framebuffer_pixels(frame) == decode_frame(payload)
+
+
+def test_rgb_round_trip():
+    # Colours with 5-6-5 bits survive the conversion unchanged
+    pixels = decode_frame(rgb565_frame(2))
+    payload = bytes(channel for pixel in pixels for channel in pixel)
+    assert len(payload) == RGB_FRAME_SIZE
+    assert framebuffer_pixels(to_framebuffer(payload)) == pixels
+
+
+def test_framebuffer_is_little_endian_rgb565():
+    payload = bytes([255, 0, 0, 0, 255, 0, 0, 0, 255] + [0] * (RGB_FRAME_SIZE - 9))
+    frame = to_framebuffer(payload)
+    assert frame[:6] == bytes([0x00, 0xF8, 0xE0, 0x07, 0x1F, 0x00])
+    assert framebuffer_pixels(frame)[:3] == [[255, 0, 0], [0, 255, 0], [0, 0, 255]]
+
+
+@pytest.mark.parametrize("convert", [decode_frame, to_framebuffer])
+def test_wrong_size_is_rejected(convert):
+    with pytest.raises(ValueError):
+        convert(bytes(100))
+
+
+def test_frames_arriving_during_a_write_are_coalesced():
+    written = []
+    writing = threading.Event()
+    release = threading.Event()
+
+    def write(frame):
+        written.append(frame)
+        writing.set()
+        release.wait(5)
+
+    frames = [bytes([i]) * RGB565_FRAME_SIZE for i in range(4)]
+    writer = FrameWriter(write, max_fps=1000)
+    writer.start()
+    try:
+        writer.submit(frames[0])
+        assert writing.wait(5)
+        # Each replaces the previous one in the back buffer
+        for frame in frames[1:]:
+            writer.submit(frame)
+        release.set()
+        wait_until(lambda: writer.written == 2)
+    finally:
+        writer.stop()
+    assert written == [to_framebuffer(frames[0]), to_framebuffer(frames[3])]
+    assert writer.stats() == {"received": 4, "written": 2, "coalesced": 2, "errors": 0}
+
+
+def test_write_errors_are_counted():
+    def write(frame):
+        raise OSError("no framebuffer")
+
+    writer = FrameWriter(write, max_fps=1000)
+    writer.start()
+    try:
+        writer.submit(rgb565_frame(3))
+        wait_until(lambda: writer.errors == 1)
+        writer.submit(rgb565_frame(4))
+        wait_until(lambda: writer.errors == 2)
+    finally:
+        writer.stop()
+    assert writer.written == 0
+
+
+def test_submit_rejects_a_bad_frame():
+    writer = FrameWriter(lambda frame: None)
+    with pytest.raises(ValueError):
+        writer.submit(bytes(10))
+    assert writer.stats()["received"] == 0
@@ -0,0 +1,92 @@
+"""
+Tests of the per-event rate limiting and sampling of log records.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import logging
+
+from logs import EventFilter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(msg="Reading: %s", event=None, level=logging.INFO, args=(1,)):
+    attributes = {
+        "name": "publish", "msg": msg, "args": args, "levelno": level, "levelname": logging.getLevelName(level)
+    }
+    if event is not None:
+        attributes["event"] = event
+    return logging.makeLogRecord(attributes)
+
+
+def passed(event_filter, records):
+    return [event_filter.filter(r) for r in records]
+
+
+def test_burst_then_rate():
+    clock = Clock()
+    event_filter = EventFilter(rate=1.0, burst=3, clock=clock)
+    assert passed(event_filter, [record(event="cycle") for _ in range(5)]) == [True, True, True, False, False]
+    assert event_filter.suppressed == 2
+    clock.now = 0.5
+    assert not event_filter.filter(record(event="cycle"))
+    # Half a token at 0.5 s plus half at 1 s: one record, which reports the dropped ones
+    clock.now = 1.0
+    next_record = record(event="cycle")
+    assert event_filter.filter(next_record)
+    assert next_record.suppressed == 3
+    assert not event_filter.filter(record(event="cycle"))
+    # The burst refills at `rate` per second up to `burst`
+    clock.now = 11.0
+    assert passed(event_filter, [record(event="cycle") for _ in range(4)]) == [True, True, True, False]
+    assert event_filter.suppressed == 5
+
+
+def test_events_are_limited_separately():
+    event_filter = EventFilter(rate=1.0, burst=1, clock=Clock())
+    assert event_filter.filter(record(event="cycle"))
+    assert event_filter.filter(record(event="reading"))
+    assert not event_filter.filter(record(event="cycle"))
+
+
+def test_event_defaults_to_logger_and_template():
+    event_filter = EventFilter(rate=1.0, burst=1, clock=Clock())
+    first = record("Reading: %s", args=(1,))
+    assert event_filter.filter(first)
+    assert first.event == "publish"
+    # Other arguments, same template: the same event
+    assert not event_filter.filter(record("Reading: %s", args=(2,)))
+    assert event_filter.filter(record("Timings: %s"))
+
+
+def test_sampling_logs_one_record_in_n():
+    event_filter = EventFilter(rate=1.0, burst=100, sample={"reading": 3}, clock=Clock())
+    assert passed(event_filter, [record(event="reading") for _ in range(7)]) == [
+        True, False, False, True, False, False, True
+    ]
+    assert event_filter.suppressed == 4
+    # Other events are not sampled
+    assert passed(event_filter, [record(event="cycle") for _ in range(3)]) == [True, True, True]
+
+
+def test_sampled_record_reports_the_suppressed_ones():
+    event_filter = EventFilter(rate=1.0, burst=100, sample={"reading": 2}, clock=Clock())
+    records = [record(event="reading") for _ in range(3)]
+    assert passed(event_filter, records) == [True, False, True]
+    assert not hasattr(records[0], "suppressed")
+    assert records[2].suppressed == 1
+
+
+def test_errors_and_disabled_filter_always_pass():
+    event_filter = EventFilter(rate=1.0, burst=1, clock=Clock())
+    assert passed(event_filter, [record(event="cycle", level=logging.ERROR) for _ in range(3)]) == [True] * 3
+    assert passed(event_filter, [record(event="cycle") for _ in range(2)]) == [True, False]
+    event_filter.enabled = False
+    assert passed(event_filter, [record(event="cycle") for _ in range(3)]) == [True] * 3
+    assert event_filter.suppressed == 1
@@ -0,0 +1,92 @@
+"""
+Tests of the MQTT v5 topic aliases and telemetry publish properties.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from mqtt5 import PublishProperties, TopicAliases
+
+
+def test_no_aliases_before_the_connack():
+    aliases = TopicAliases()
+    assert aliases.apply("a", 0, None) == ("a", None, None)
+    assert aliases.assigned == 0
+
+
+def test_alias_is_used_once_established():
+    aliases = TopicAliases()
+    aliases.reset(2)
+    topic, properties, token = aliases.apply("a", 0, None)
+    assert (topic, properties.TopicAlias) == ("a", 1)
+    # Not handed to the client yet: later publishes send the topic in full
+    assert aliases.apply("a", 0, None) == ("a", None, None)
+    aliases.confirm(token)
+    topic, properties, token = aliases.apply("a", 0, None)
+    assert (topic, properties.TopicAlias, token) == ("", 1, None)
+    assert aliases.hits == 1
+
+
+def test_aliases_are_limited_by_the_broker_maximum():
+    aliases = TopicAliases()
+    aliases.reset(2)
+    assert aliases.apply("a", 0, None)[1].TopicAlias == 1
+    assert aliases.apply("b", 0, None)[1].TopicAlias == 2
+    assert aliases.apply("c", 0, None) == ("c", None, None)
+    assert aliases.assigned == 2
+
+
+def test_reset_starts_over_with_the_new_maximum():
+    aliases = TopicAliases()
+    aliases.reset(1)
+    _, _, token = aliases.apply("a", 0, None)
+    aliases.confirm(token)
+    aliases.reset(3)
+    assert aliases.maximum == 3
+    # The new connection does not know alias 1 yet
+    topic, properties, stale = aliases.apply("a", 0, None)
+    assert (topic, properties.TopicAlias) == ("a", 1)
+    assert aliases.apply("b", 0, None)[1].TopicAlias == 2
+    # A confirmation from the previous connection is ignored
+    aliases.reset(3)
+    aliases.apply("a", 0, None)
+    aliases.confirm(stale)
+    assert aliases.apply("a", 0, None) == ("a", None, None)
+
+
+def test_a_broker_without_aliases():
+    aliases = TopicAliases()
+    aliases.reset(1)
+    aliases.reset(0)
+    assert aliases.apply("a", 0, None) == ("a", None, None)
+
+
+def test_only_qos_0_messages_use_aliases():
+    aliases = TopicAliases()
+    aliases.reset(10)
+    properties = Properties(PacketTypes.PUBLISH)
+    for qos in (1, 2):
+        assert aliases.apply("a", qos, properties) == ("a", properties, None)
+    assert aliases.assigned == 0
+
+
+def test_alias_does_not_change_the_callers_properties():
+    aliases = TopicAliases()
+    aliases.reset(1)
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.MessageExpiryInterval = 300
+    _, aliased, _ = aliases.apply("a", 0, properties)
+    assert (aliased.TopicAlias, aliased.MessageExpiryInterval) == (1, 300)
+    assert not hasattr(properties, "TopicAlias")
+
+
+def test_publish_properties_number_the_messages():
+    builder = PublishProperties(expiry=300)
+    first = builder.build()
+    second = builder.build(sample_time=0.0)
+    assert first.MessageExpiryInterval == 300
+    assert first.UserProperty == [("seq", "1")]
+    assert [name for name, _ in second.UserProperty] == ["seq", "time"]
+    assert second.UserProperty[0] == ("seq", "2")
+    assert not hasattr(PublishProperties().build(), "MessageExpiryInterval")
@@ -0,0 +1,142 @@
+"""
+Tests of the non-blocking publisher against a fake paho client.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import paho.mqtt.client
+import pytest
+
+from publisher import AsyncPublisher, PublishError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Info:
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+
+class FakeClient:
+    """Hands out message ids like paho; `during_publish` runs before publish() returns."""
+
+    def __init__(self):
+        self.sent = []
+        self.rc = paho.mqtt.client.MQTT_ERR_SUCCESS
+        self.next_mid = 1
+        self.during_publish = None
+
+    def publish(self, topic, payload, qos=0, retain=False, properties=None):
+        mid = self.next_mid
+        self.next_mid += 1
+        self.sent.append((mid, topic))
+        if self.during_publish is not None:
+            self.during_publish(mid)
+        return Info(self.rc, mid)
+
+
+def make_publisher(**kwargs):
+    clock = Clock()
+    client = FakeClient()
+    return AsyncPublisher(client, clock=clock, **kwargs), client, clock
+
+
+def test_window_holds_messages_until_a_slot_frees():
+    publisher, client, clock = make_publisher(max_inflight=2)
+    futures = [publisher.publish(f"t/{i}", b"x", qos=1) for i in range(3)]
+    assert [topic for _, topic in client.sent] == ["t/0", "t/1"]
+    assert publisher.stats()["inflight"] == 2
+    assert publisher.stats()["pending"] == 1
+    clock.now = 0.5
+    publisher.on_publish(client, None, 1)
+    assert futures[0].result(0) == pytest.approx(0.5)
+    # The acknowledgement freed the slot of the waiting message
+    assert [topic for _, topic in client.sent] == ["t/0", "t/1", "t/2"]
+    assert publisher.stats() == {"published": 1, "failed": 0, "dropped": 0, "inflight": 2, "pending": 0}
+
+
+def test_full_queue_drops_the_oldest_waiting_message():
+    publisher, client, _ = make_publisher(max_inflight=1, max_pending=2)
+    publisher.publish("t/0", b"x", qos=1)
+    oldest = publisher.publish("t/1", b"x", qos=1)
+    publisher.publish("t/2", b"x", qos=1)
+    publisher.publish("t/3", b"x", qos=1)
+    with pytest.raises(PublishError):
+        oldest.result(0)
+    assert publisher.stats()["dropped"] == 1
+    assert publisher.stats()["pending"] == 2
+
+
+def test_acknowledgement_before_publish_returns():
+    publisher, client, clock = make_publisher()
+    # paho writes QoS 0 messages and calls on_publish inside client.publish
+    client.during_publish = lambda mid: publisher.on_publish(client, None, mid)
+    future = publisher.publish("t", b"x")
+    assert future.result(0) == 0.0
+    assert publisher.stats()["inflight"] == 0
+    assert publisher.stats()["published"] == 1
+
+
+def test_expire_keeps_an_acknowledgement_it_raced_with():
+    publisher, client, clock = make_publisher()
+    publisher.publish("old", b"x", qos=1)
+    clock.now = 10.0
+
+    def acknowledge_then_expire(mid):
+        if mid == 2:
+            publisher.on_publish(client, None, mid)
+            assert publisher.expire(5.0) == 1
+
+    client.during_publish = acknowledge_then_expire
+    future = publisher.publish("new", b"x")
+    # Sent, not left in flight to be failed by the next expire
+    assert future.result(0) == 0.0
+    clock.now = 20.0
+    assert publisher.expire(5.0) == 0
+    assert publisher.stats() == {"published": 1, "failed": 1, "dropped": 0, "inflight": 0, "pending": 0}
+
+
+def test_expire_fails_old_messages_and_frees_their_slots():
+    publisher, client, clock = make_publisher(max_inflight=1)
+    old = publisher.publish("old", b"x", qos=1)
+    waiting = publisher.publish("waiting", b"x", qos=1)
+    clock.now = 3.0
+    assert publisher.expire(5.0) == 0
+    clock.now = 6.0
+    assert publisher.expire(5.0) == 1
+    with pytest.raises(PublishError):
+        old.result(0)
+    assert [topic for _, topic in client.sent] == ["old", "waiting"]
+    publisher.on_publish(client, None, 2)
+    # Latency counts from when the message was queued
+    assert waiting.result(0) == pytest.approx(6.0)
+
+
+def test_late_acknowledgements_are_forgotten_after_the_timeout():
+    publisher, client, clock = make_publisher()
+    # The acknowledgement of an expired message
+    publisher.on_publish(client, None, 1)
+    clock.now = 6.0
+    publisher.expire(5.0)
+    # Its id is reused once the ids wrap around: the new message is not complete
+    future = publisher.publish("t", b"x", qos=1)
+    assert client.sent == [(1, "t")]
+    assert not future.done()
+    publisher.on_publish(client, None, 1)
+    assert future.result(0) == 0.0
+
+
+def test_rejected_message_fails():
+    publisher, client, _ = make_publisher()
+    client.rc = paho.mqtt.client.MQTT_ERR_NO_CONN
+    with pytest.raises(PublishError):
+        publisher.publish("t", b"x", qos=0).result(0)
+    # QoS 1 stays queued in the client until the reconnect
+    assert not publisher.publish("t", b"x", qos=1).done()
+    assert publisher.stats()["failed"] == 1
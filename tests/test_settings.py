@@ -0,0 +1,97 @@
+"""
+Tests of the configuration validation and of its hot reload.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import json
+import time
+
+import pytest
+
+import settings
+from settings import ConfigError, ConfigWatcher, compile_settings, load_settings
+
+
+def config(**overrides):
+    raw = {
+        "id": "sensehat",
+        "seconds": 10,
+        "broker": {"host": "localhost", "port": 1883},
+        "topics": {
+            "device": "homeassistant/sensor/sensehat",
+            "status": "/status",
+            "config": "/config",
+            "state": "/state",
+            "availability": "/availability",
+            "humidity": "homeassistant/sensor/humidity",
+            "pressure": "homeassistant/sensor/pressure",
+            "temperature": "homeassistant/sensor/temperature",
+        },
+    }
+    raw.update(overrides)
+    return raw
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_topics_are_precomputed():
+    cfg = compile_settings(config())
+    assert cfg.availability_topic == "homeassistant/sensor/sensehat/availability"
+    assert cfg.state_topics["humidity"] == "homeassistant/sensor/humidity/state"
+    assert cfg.state_topics["temp_cpu"] == "homeassistant/sensor/sensehat/cpu/state"
+    assert cfg.command_topic == "homeassistant/sensor/sensehat/cmd"
+
+
+def test_every_problem_is_reported():
+    raw = config(seconds="10", combined_state=1)
+    del raw["broker"]["port"]
+    with pytest.raises(ConfigError) as error:
+        compile_settings(raw)
+    assert str(error.value) == (
+        "'seconds' has the wrong type str; No 'broker.port' field in configuration; "
+        "'combined_state' has the wrong type int"
+    )
+
+
+@pytest.mark.parametrize("n", [0, -1, 2.5, True, "10"])
+def test_log_sampling_must_be_a_positive_integer(n):
+    with pytest.raises(ConfigError, match=r"'logging.sample.reading' must be a positive integer"):
+        compile_settings(config(logging={"sample": {"reading": n}}))
+
+
+def test_settings_are_read_only():
+    cfg = compile_settings(config(logging={"sample": {"reading": 10}}))
+    with pytest.raises(TypeError):
+        cfg["broker"]["port"] = 1884
+    assert cfg.get("logging")["sample"]["reading"] == 10
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(ConfigError, match="not found"):
+        load_settings(str(tmp_path / "config.json"))
+
+
+def test_polling_fallback_applies_a_valid_change(tmp_path, monkeypatch):
+    # No inotify: the watcher polls the modification time and size
+    monkeypatch.setattr(settings, "_load_libc", lambda: None)
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config()))
+    applied = []
+    watcher = ConfigWatcher(str(path), load_settings(str(path)), applied.append, interval=0.01)
+    watcher.start()
+    try:
+        path.write_text(json.dumps(config(seconds=120)))
+        wait_until(lambda: watcher.reloads == 1)
+        assert [cfg.seconds for cfg in applied] == [120]
+        # A file that does not validate leaves the settings in force
+        path.write_text(json.dumps(config(seconds=0)))
+        wait_until(lambda: watcher.errors == 1)
+        assert watcher.current.seconds == 120
+    finally:
+        watcher.stop()
+    assert len(applied) == 1
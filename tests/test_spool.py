@@ -0,0 +1,95 @@
+"""
+Tests of the store-and-forward log and its backfill.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import threading
+import time
+
+from spool import Backfill, SegmentLog
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_peek_keeps_records_until_commit(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.append("a", b"1", timestamp=1.0)
+    log.append("b", b"2", timestamp=2.0)
+    head = log.peek(1)
+    assert head == [(1.0, "a", b"1")]
+    assert log.peek(1) == head
+    assert len(log) == 2
+    assert log.commit(head) == 1
+    assert log.peek(2) == [(2.0, "b", b"2")]
+    assert len(log) == 1
+
+
+def test_cursor_survives_a_restart_only_after_commit(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.append("a", b"1", timestamp=1.0)
+    log.append("b", b"2", timestamp=2.0)
+    log.peek(1)
+    log.close()
+    log = SegmentLog(str(tmp_path))
+    assert log.commit(log.peek(1)) == 1
+    log.close()
+    log = SegmentLog(str(tmp_path))
+    assert log.pop(5) == [(2.0, "b", b"2")]
+
+
+def test_commit_skips_records_no_longer_at_the_head(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.append("a", b"1", timestamp=1.0)
+    log.append("b", b"2", timestamp=2.0)
+    head = log.peek(1)
+    # Evicted or replayed meanwhile
+    log.pop(1)
+    assert log.commit(head) == 0
+    assert log.peek(1) == [(2.0, "b", b"2")]
+
+
+def test_peek_and_commit_across_segments(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=64)
+    for index in range(6):
+        log.append("t", bytes([index]) * 20, timestamp=float(index))
+    assert len(log.segments) > 1
+    replayed = []
+    while len(log):
+        head = log.peek(1)
+        replayed.extend(head)
+        log.commit(head)
+    assert [record[0] for record in replayed] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    assert len(log.segments) == 1
+
+
+def test_backfill_keeps_a_record_whose_send_fails(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    log.append("a", b"1", timestamp=1.0)
+    log.append("b", b"2", timestamp=2.0)
+    connected = threading.Event()
+    connected.set()
+    sent = []
+
+    def send(record):
+        if record[1] == "a" and not sent:
+            # The link drops while the first record is in flight
+            sent.append(None)
+            connected.clear()
+            raise ConnectionError("not acknowledged")
+        sent.append(record)
+
+    backfill = Backfill(log, send, connected.is_set, rate=100.0)
+    backfill.start()
+    try:
+        wait_until(lambda: backfill.errors == 1)
+        assert len(log) == 2
+        connected.set()
+        wait_until(lambda: len(log) == 0)
+    finally:
+        backfill.stop()
+    assert sent[1:] == [(1.0, "a", b"1"), (2.0, "b", b"2")]
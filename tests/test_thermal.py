@@ -0,0 +1,107 @@
+"""
+Tests of the thermal sysfs reader against a fake `thermal_zone*` tree.
+:copyright: (c) 2022-present Dan Rodrigues
+:license: MIT, see LICENSE for more details.
+"""
+import os
+
+import pytest
+
+import thermal
+from thermal import ThermalReader
+
+
+def make_zone(root, number, zone_type=None, millidegrees=None):
+    zone = root / f"thermal_zone{number}"
+    zone.mkdir()
+    if zone_type is not None:
+        (zone / "type").write_text(zone_type + "\n")
+    if millidegrees is not None:
+        (zone / "temp").write_text(f"{millidegrees}\n")
+    return zone
+
+
+def test_read_uses_the_first_zone(tmp_path):
+    make_zone(tmp_path, 0, "cpu-thermal", 47236)
+    make_zone(tmp_path, 1, "gpu-thermal", 51000)
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        assert reader.read() == pytest.approx(47.236)
+
+
+def test_read_all_keys_by_zone_type(tmp_path):
+    make_zone(tmp_path, 0, "cpu-thermal", 47236)
+    make_zone(tmp_path, 1, "gpu-thermal", 51000)
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        assert reader.read_all() == {"cpu-thermal": pytest.approx(47.236), "gpu-thermal": pytest.approx(51.0)}
+
+
+def test_zones_are_ordered_by_number(tmp_path):
+    # Lexical order would put thermal_zone10 before thermal_zone2
+    for number in (10, 2, 0, 1):
+        make_zone(tmp_path, number, f"zone{number}", number * 1000)
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        assert [name for name, _type, _fd in reader.zones] == [
+            "thermal_zone0", "thermal_zone1", "thermal_zone2", "thermal_zone10",
+        ]
+        assert list(reader.read_all()) == ["zone0", "zone1", "zone2", "zone10"]
+
+
+def test_zone_type_defaults_to_the_zone_name(tmp_path):
+    make_zone(tmp_path, 0, None, 40000)
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        assert reader.read_all() == {"thermal_zone0": pytest.approx(40.0)}
+
+
+def test_zone_without_temp_is_skipped(tmp_path):
+    make_zone(tmp_path, 0, "broken")
+    make_zone(tmp_path, 1, "cpu-thermal", 45500)
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        assert [zone_type for _name, zone_type, _fd in reader.zones] == ["cpu-thermal"]
+        assert reader.read() == pytest.approx(45.5)
+
+
+def test_unreadable_zone_is_skipped(tmp_path):
+    make_zone(tmp_path, 0, "garbage", "not a number")
+    make_zone(tmp_path, 1, "cpu-thermal", 45500)
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        assert reader.read() == pytest.approx(45.5)
+        assert reader.read_all() == {"cpu-thermal": pytest.approx(45.5)}
+
+
+def test_rereads_the_current_value(tmp_path):
+    zone = make_zone(tmp_path, 0, "cpu-thermal", 40000)
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        assert reader.read() == pytest.approx(40.0)
+        (zone / "temp").write_text("52125\n")
+        assert reader.read() == pytest.approx(52.125)
+
+
+def test_falls_back_to_vcgencmd(tmp_path, monkeypatch):
+    monkeypatch.setattr(thermal, "read_vcgencmd", lambda: 48.3)
+    with ThermalReader(str(tmp_path)) as reader:
+        assert reader.zones == []
+        assert reader.read() == 48.3
+
+
+def test_falls_back_to_vcgencmd_when_every_zone_fails(tmp_path, monkeypatch):
+    make_zone(tmp_path, 0, "garbage", "not a number")
+    monkeypatch.setattr(thermal, "read_vcgencmd", lambda: 48.3)
+    with ThermalReader(str(tmp_path)) as reader:
+        assert reader.read() == 48.3
+
+
+def test_without_fallback_raises(tmp_path, monkeypatch):
+    monkeypatch.setattr(thermal, "read_vcgencmd", lambda: pytest.fail("vcgencmd must not run"))
+    with ThermalReader(str(tmp_path), fallback=False) as reader:
+        with pytest.raises(OSError, match="No readable thermal zone"):
+            reader.read()
+
+
+def test_close_releases_the_files(tmp_path):
+    make_zone(tmp_path, 0, "cpu-thermal", 40000)
+    reader = ThermalReader(str(tmp_path), fallback=False)
+    fd = reader.zones[0][2]
+    reader.close()
+    assert reader.zones == []
+    with pytest.raises(OSError):
+        os.fstat(fd)